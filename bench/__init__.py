@@ -0,0 +1,2 @@
+# Offline benchmarks of the patch/DR Lambdas against in-process fakes of AWS.
+# Run with: python -m bench --help (see bench/Readme.md).
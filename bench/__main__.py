@@ -0,0 +1,291 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import logging
+import math
+import sys
+import threading
+import time
+import tracemalloc
+
+from bench import clock as virtual_time
+from bench import coldstart
+from bench import emf
+from bench import fake_aws
+from bench.scenarios import SCENARIOS, environment
+
+DEFAULT_SIZES = (10, 100, 1000)
+MEMORY_MB = 128  # none of the functions set MemorySize
+RUNTIME_MB = 70  # resident size of the Python runtime and boto3 before any handler allocation
+MAX_INVOCATIONS = 500  # self re-invocations and queue deliveries followed per run
+DEFAULT_CONCURRENCY = 10  # WorkerConcurrency (event source mapping MaximumConcurrency) in the stack
+GB_SECOND_PRICE = 0.0000166667  # USD, x86
+REQUEST_PRICE = 0.0000002  # USD per invocation
+
+
+class LogSink:
+    # Discards handler output, counting the bytes CloudWatch Logs would ingest and keeping the EMF lines
+    def __init__(self):
+        self.bytes = 0
+        self.emf = []
+        self._line = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self.bytes += len(text.encode('utf-8', 'replace'))
+            if not self._line and text.endswith("\n") and emf.is_emf(text):
+                # Written whole, so concurrent invocations cannot interleave with it
+                self.emf.append(text.rstrip("\n"))
+            elif self._line or text.startswith('{'):
+                self._line.append(text)
+                if "\n" in text:
+                    line = "".join(self._line)
+                    self._line = []
+                    self.emf.extend(part for part in line.splitlines() if emf.is_emf(part))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class FakeContext:
+    def __init__(self, function_name, clock, timeout):
+        self.function_name = function_name
+        self.invoked_function_arn = f"arn:aws:lambda:{fake_aws.HOME_REGION}:{fake_aws.HOME_ACCOUNT}:function:{function_name}"
+        self.aws_request_id = f"bench-{clock.now:.0f}"
+        self.memory_limit_in_mb = MEMORY_MB
+        self._clock = clock
+        self._deadline = clock.now + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - self._clock.now) * 1000))
+
+
+def outcome(response):
+    # The handlers report failures in their response rather than raising
+    if isinstance(response, dict):
+        if response.get('statusCode', 200) >= 400 or response.get('status') == 'error':
+            return 'failed', str(response.get('body') or response.get('message'))[:200]
+        if response.get('statusCode') == 202:
+            return 'resumed', ''
+        if response.get('batchItemFailures'):
+            return 'retried', f"{len(response['batchItemFailures'])} queue messages failed and are retried"[:200]
+    return 'ok', ''
+
+
+def emf_check(lines, aws):
+    """Validate the EMF lines of a run; their API call counts must match what the fakes served."""
+    problems = []
+    calls = 0
+    for line in lines:
+        document, line_problems = emf.parse(line)
+        problems.extend(line_problems)
+        if document:
+            calls += document.get('ApiCalls', 0) + document.get('Retries', 0)
+    if lines and not problems and calls != sum(aws.calls.values()):
+        problems.append(f"EMF counted {calls} API attempts, the fakes served {sum(aws.calls.values())}")
+    return problems
+
+
+def invocation_cost(seconds, memory_mb=MEMORY_MB):
+    billed_ms = math.ceil(seconds * 1000)
+    return billed_ms / 1000 * memory_mb / 1024 * GB_SECOND_PRICE + REQUEST_PRICE
+
+
+def sqs_event(message, queue):
+    return {'Records': [{
+        'messageId': message['MessageId'],
+        'receiptHandle': f"bench-{message['MessageId']}-{message['ReceiveCount']}",
+        'body': message['Body'],
+        'attributes': {'ApproximateReceiveCount': str(message['ReceiveCount'])},
+        'eventSource': 'aws:sqs',
+        'eventSourceARN': 'arn:aws:sqs:{}:{}:{}'.format(fake_aws.HOME_REGION, fake_aws.HOME_ACCOUNT, queue['Url'].rsplit('/', 1)[-1]),
+    }]}
+
+
+def run_scenario(name, size, latency=0.03, throttle_rate=0.0, failure_rate=0.0, seed=0, env=None, trace_memory=True,
+                 concurrency=DEFAULT_CONCURRENCY):
+    """Run one handler against a fake fleet of `size` instances, following its own self re-invocations.
+
+    Each invocation lasts its virtual time (everything spent waiting on the
+    fakes or sleeping) plus the real time the handler spent computing; that
+    sum is what Lambda would bill, and what is checked against the timeout.
+    Messages the handler queues on its scenario's queue are delivered like
+    an SQS event source mapping: one per invocation, up to `concurrency` at
+    once, each concurrent invocation in its own container (module).
+    """
+    scenario = SCENARIOS[name]
+    queue = scenario.get('queue')
+    clock = virtual_time.VirtualClock(time.time())
+    aws = fake_aws.FakeAWS(clock, latency=latency, throttle_rate=throttle_rate, failure_rate=failure_rate, seed=seed)
+    variables, event = scenario['setup'](aws, size)
+    variables.update(env or {})
+    function_name = f"bench-{name}"
+    sink = LogSink()
+    log_handler = logging.StreamHandler(sink)
+    logging.getLogger().addHandler(log_handler)
+    invocations = []
+    containers = []  # warm modules, each used by one invocation at a time
+    lock = threading.Lock()
+
+    def invoke(invocation_event):
+        with lock:
+            module = containers.pop() if containers else None
+        context = FakeContext(function_name, clock, scenario['timeout'])
+        virtual_start, real_start = clock.now, time.perf_counter()
+        response = None
+        try:
+            if module is None:
+                # Cold start: module init is part of the first invocation of a container
+                with lock:
+                    module = scenario['load']()
+            response = getattr(module, scenario['handler'])(invocation_event, context)
+            status, detail = outcome(response)
+        except Exception as e:
+            status, detail = 'error', f"{type(e).__name__}: {e}"[:200]
+        if module is not None:
+            with lock:
+                containers.append(module)
+        seconds = clock.now - virtual_start + time.perf_counter() - real_start
+        if seconds > scenario['timeout']:
+            status, detail = 'timeout', f"ran {seconds:.0f}s of a {scenario['timeout']}s timeout"
+        invocations.append({'Status': status, 'Detail': detail, 'Seconds': seconds,
+                            'RealSeconds': time.perf_counter() - real_start})
+        return status, response
+
+    def deliver(message):
+        status, response = invoke(sqs_event(message, queue))
+        failed = isinstance(response, dict) and response.get('batchItemFailures')
+        if status not in ('error', 'timeout') and not failed:
+            aws.delete_message(queue['Url'], message['MessageId'])
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(environment(variables))
+        stack.enter_context(virtual_time.install(clock))
+        stack.enter_context(fake_aws.install(aws))
+        stack.enter_context(contextlib.redirect_stdout(sink))
+        if trace_memory:
+            tracemalloc.start()
+        started, real_started = clock.now, time.perf_counter()
+        pending = [event]
+        while (pending or (queue and aws.queues[queue['Url']])) and len(invocations) < MAX_INVOCATIONS:
+            if pending:
+                invoke(pending.pop(0))
+            else:
+                messages = aws.receive_messages(queue['Url'], queue['VisibilityTimeout'], queue['MaxReceiveCount'])
+                if messages:
+                    # Patched by virtual_time.install, so the concurrent invocations share the virtual clock
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+                        list(executor.map(deliver, messages))
+                elif aws.next_visible(queue['Url']) is not None:
+                    # Only failed messages left: wait out their visibility timeout
+                    clock.sleep(max(0.001, aws.next_visible(queue['Url']) - clock.now))
+            pending.extend(json.loads(i['Payload']) for i in aws.take_invocations(function_name))
+        span = clock.now - started + time.perf_counter() - real_started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        if trace_memory:
+            tracemalloc.stop()
+    logging.getLogger().removeHandler(log_handler)
+
+    statuses = [i['Status'] for i in invocations]
+    status = next((s for s in ('error', 'timeout', 'failed') if s in statuses), 'ok')
+    emf_problems = emf_check(sink.emf, aws)
+    if status == 'ok' and emf_problems:
+        status = 'bad-emf'
+    peak_mb = peak / 1024 / 1024
+    if status == 'ok' and trace_memory and peak_mb + RUNTIME_MB > MEMORY_MB:
+        status = 'memory'
+    if status == 'ok' and (pending or (queue and aws.queues[queue['Url']]) or aws.dead_letters):
+        status = 'unfinished'
+    return {
+        'Scenario': name,
+        'Instances': size,
+        'Status': status,
+        'Detail': next((i['Detail'] for i in invocations if i['Detail']), ''),
+        'Invocations': len(invocations),
+        'Seconds': sum(i['Seconds'] for i in invocations),
+        'Span': span,
+        'RealSeconds': sum(i['RealSeconds'] for i in invocations),
+        'ApiCalls': sum(aws.calls.values()),
+        'CallsByService': dict(aws.calls_by_service()),
+        'CallsByOperation': {f"{service}:{operation}": count for (service, operation), count in sorted(aws.calls.items())},
+        'Throttled': sum(aws.throttled.values()),
+        'Emails': aws.emails,
+        'DeadLetters': len(aws.dead_letters),
+        'PeakMB': round(peak_mb, 1),
+        'LogKB': round(sink.bytes / 1024, 1),
+        'EmfLines': len(sink.emf),
+        'EmfProblems': emf_problems,
+        'CostUSD': sum(invocation_cost(i['Seconds']) for i in invocations),
+    }
+
+
+def print_table(results, out=sys.stdout):
+    columns = (
+        ('scenario', '{Scenario}', 28), ('hosts', '{Instances}', 6), ('status', '{Status}', 10),
+        ('inv', '{Invocations}', 4), ('billed s', '{Seconds:.1f}', 9), ('span s', '{Span:.1f}', 8), ('cpu s', '{RealSeconds:.2f}', 7),
+        ('calls', '{ApiCalls}', 7), ('throttled', '{Throttled}', 9), ('peak MB', '{PeakMB}', 8),
+        ('log KB', '{LogKB}', 8), ('emf', '{EmfLines}', 4), ('cost $', '{CostUSD:.6f}', 10),
+    )
+    print("  ".join(title.ljust(width) for title, _, width in columns) + "  calls by service", file=out)
+    for result in results:
+        services = " ".join(f"{service}:{count}" for service, count in sorted(result['CallsByService'].items()))
+        print("  ".join(fmt.format(**result).ljust(width) for _, fmt, width in columns) + "  " + services, file=out)
+    for result in results:
+        if result['Detail']:
+            print(f"{result['Scenario']} @ {result['Instances']}: {result['Status']}: {result['Detail']}", file=out)
+        if result['EmfProblems']:
+            print(f"{result['Scenario']} @ {result['Instances']}: EMF: {'; '.join(result['EmfProblems'][:5])}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description="Benchmark the patch/DR handlers against fake AWS.")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS), help="comma-separated, default all: " + ", ".join(SCENARIOS))
+    parser.add_argument('--sizes', default=",".join(map(str, DEFAULT_SIZES)), help="comma-separated fleet sizes (instances)")
+    parser.add_argument('--latency', type=float, default=0.03, help="mean seconds per API call (default 0.03)")
+    parser.add_argument('--throttle', type=float, default=0.0, help="fraction of API calls throttled (default 0)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of per-host commands that fail (default 0)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"queue worker invocations run at once (default {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="extra handler environment variable")
+    parser.add_argument('--json', help="also write the full results (including calls per operation) to this file")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc; CPU seconds are then closer to real")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="instead of invoking, time each handler's module import/init in fresh interpreters")
+    parser.add_argument('--repeat', type=int, default=coldstart.DEFAULT_REPEAT,
+                        help=f"with --cold-start: interpreters per handler, the median is reported (default {coldstart.DEFAULT_REPEAT})")
+    parser.add_argument('--source', metavar='REVISION',
+                        help="with --cold-start: load the handlers from this git revision, e.g. the commit before a change")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {unknown}")
+    if args.cold_start:
+        results = coldstart.cold_start(names, args.repeat, args.source)
+        coldstart.print_table(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        return
+    env = dict(item.split('=', 1) for item in args.env)
+    results = []
+    for name in names:
+        for size in (int(size) for size in args.sizes.split(',')):
+            results.append(run_scenario(
+                name, size, args.latency, args.throttle, args.failure_rate, args.seed, env, not args.no_memory,
+                args.concurrency
+            ))
+            print(f"{name} @ {size}: {results[-1]['Status']}", file=sys.stderr)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
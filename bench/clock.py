@@ -0,0 +1,138 @@
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+_real_future_result = concurrent.futures.Future.result
+_real_as_completed = concurrent.futures.as_completed
+_real_executor = concurrent.futures.ThreadPoolExecutor
+
+
+class VirtualClock:
+    """Discrete-event clock shared by every thread of a benchmark run.
+
+    sleep() blocks the calling thread until virtual time reaches its wake-up
+    time; time only moves forward once every runnable thread is asleep, and
+    then jumps straight to the earliest wake-up. Threads come from
+    ThreadPoolExecutor (patched by install()), which reports when tasks start
+    and finish and when a thread blocks on a future, so concurrent sleeps
+    overlap exactly as they would in a real invocation.
+    """
+
+    def __init__(self, start=1_800_000_000.0):
+        self.now = float(start)
+        self._cond = threading.Condition()
+        self._sleepers = []  # heap of [wake, seq, woken]
+        self._seq = itertools.count()
+        self._blocked = 0
+        self._pools = {}  # executor id -> [queued, busy, max_workers]
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def _runnable(self):
+        # The driving thread, plus every task that runs or could start on a free worker, minus threads waiting on futures
+        in_pools = sum(busy + min(queued, max(0, workers - busy)) for queued, busy, workers in self._pools.values())
+        return 1 + in_pools - self._blocked
+
+    def _advance(self):
+        # Caller holds the condition
+        while self._sleepers and len(self._sleepers) >= self._runnable():
+            wake = self._sleepers[0][0]
+            self.now = max(self.now, wake)
+            while self._sleepers and self._sleepers[0][0] <= self.now:
+                heapq.heappop(self._sleepers)[2] = True
+            self._cond.notify_all()
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        with self._cond:
+            entry = [self.now + seconds, next(self._seq), False]
+            heapq.heappush(self._sleepers, entry)
+            self._advance()
+            while not entry[2]:
+                self._cond.wait()
+
+    @contextlib.contextmanager
+    def blocked(self):
+        with self._cond:
+            self._blocked += 1
+            self._advance()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._blocked -= 1
+
+    def _pool_event(self, pool, queued=0, busy=0, workers=None):
+        with self._cond:
+            counts = self._pools.setdefault(pool, [0, 0, workers or 1])
+            counts[0] += queued
+            counts[1] += busy
+            if counts[0] == 0 and counts[1] == 0 and workers is None:
+                del self._pools[pool]
+            self._advance()
+
+
+def executor_class(clock):
+    class VirtualExecutor(_real_executor):
+        # ThreadPoolExecutor whose tasks are accounted for by `clock`
+        def submit(self, fn, *args, **kwargs):
+            clock._pool_event(id(self), queued=1, workers=self._max_workers)
+
+            def task():
+                clock._pool_event(id(self), queued=-1, busy=1, workers=self._max_workers)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    clock._pool_event(id(self), busy=-1)
+            return super().submit(task)
+
+        def shutdown(self, wait=True, **kwargs):
+            with clock.blocked():
+                super().shutdown(wait, **kwargs)
+
+    return VirtualExecutor
+
+
+@contextlib.contextmanager
+def install(clock):
+    """Route time.time/monotonic/sleep and thread pools through `clock` for the duration of the block.
+
+    Modules must be imported inside the block: defaults such as
+    `clock=time.monotonic` are bound when a function is defined.
+    """
+    saved = (time.time, time.monotonic, time.sleep)
+
+    def result(future, timeout=None):
+        if future.done():
+            return _real_future_result(future, timeout)
+        with clock.blocked():
+            return _real_future_result(future, timeout)
+
+    def as_completed(futures, timeout=None):
+        completed = _real_as_completed(futures, timeout)
+        while True:
+            with clock.blocked():
+                future = next(completed, None)
+            if future is None:
+                return
+            yield future
+
+    time.time, time.monotonic, time.sleep = clock.time, clock.monotonic, clock.sleep
+    concurrent.futures.Future.result = result
+    concurrent.futures.as_completed = as_completed
+    concurrent.futures.ThreadPoolExecutor = executor_class(clock)
+    try:
+        yield clock
+    finally:
+        time.time, time.monotonic, time.sleep = saved
+        concurrent.futures.Future.result = _real_future_result
+        concurrent.futures.as_completed = _real_as_completed
+        concurrent.futures.ThreadPoolExecutor = _real_executor
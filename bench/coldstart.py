@@ -0,0 +1,117 @@
+import contextlib
+import io
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+BENCH_ROOT = pathlib.Path(__file__).resolve().parent.parent
+SOURCE_ROOT_VARIABLE = 'BENCH_SOURCE_ROOT'  # read by scenarios.py: where the handler sources are loaded from
+DEFAULT_REPEAT = 5
+SAMPLE_TIMEOUT = 120  # seconds per interpreter
+# Init builds real clients (that is the cost measured), so credentials are dummies and any call made at import fails fast
+OFFLINE = {
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'AWS_REGION': 'ap-south-1',
+    'AWS_DEFAULT_REGION': 'ap-south-1',
+    'AWS_EC2_METADATA_DISABLED': 'true',
+    'AWS_ENDPOINT_URL': 'http://127.0.0.1:9',
+    'AWS_MAX_ATTEMPTS': '1',
+}
+
+
+@contextlib.contextmanager
+def source_tree(revision):
+    """The repository at git `revision`, extracted to a temporary directory (the working tree when None)."""
+    if revision is None:
+        yield None
+        return
+    with tempfile.TemporaryDirectory(prefix='bench-source-') as directory:
+        archive = subprocess.run(['git', 'archive', revision], cwd=BENCH_ROOT, capture_output=True, check=True).stdout
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(directory, filter='data')
+        yield directory
+
+
+def sample(name, source=None):
+    # One cold start of scenario `name` in a fresh interpreter, like a new Lambda container
+    env = dict(os.environ, **OFFLINE)
+    if source:
+        env[SOURCE_ROOT_VARIABLE] = source
+    process = subprocess.run(
+        [sys.executable, '-m', 'bench.coldstart', name], cwd=BENCH_ROOT, env=env, capture_output=True, text=True,
+        timeout=SAMPLE_TIMEOUT
+    )
+    if process.returncode:
+        return {'Error': (process.stderr.strip().splitlines() or [f"exit {process.returncode}"])[-1][:200]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def cold_start(names, repeat=DEFAULT_REPEAT, revision=None):
+    """Median module import/init time of each scenario's handler over `repeat` fresh interpreters.
+
+    boto3 itself is imported first and reported apart (the runtime pays it
+    whatever the handler does); init is the handler module's own import:
+    patch_common, clients built at module level and anything else it runs.
+    """
+    results = []
+    with source_tree(revision) as source:
+        for name in names:
+            samples = [sample(name, source) for _ in range(repeat)]
+            errors = [s['Error'] for s in samples if 'Error' in s]
+            init = [s['InitMs'] for s in samples if 'Error' not in s]
+            boto3_ms = [s['Boto3Ms'] for s in samples if 'Error' not in s]
+            results.append({
+                'Scenario': name,
+                'Source': revision or 'working tree',
+                'Status': 'error' if errors else 'ok',
+                'Detail': errors[0] if errors else '',
+                'Samples': len(init),
+                'InitMs': statistics.median(init) if init else 0.0,
+                'MinInitMs': min(init, default=0.0),
+                'MaxInitMs': max(init, default=0.0),
+                'Boto3Ms': statistics.median(boto3_ms) if boto3_ms else 0.0,
+            })
+    return results
+
+
+def print_table(results, out=sys.stdout):
+    columns = (
+        ('scenario', '{Scenario}', 28), ('source', '{Source}', 14), ('status', '{Status}', 7), ('n', '{Samples}', 3),
+        ('init ms', '{InitMs:.1f}', 8), ('min', '{MinInitMs:.1f}', 8), ('max', '{MaxInitMs:.1f}', 8),
+        ('boto3 ms', '{Boto3Ms:.1f}', 8),
+    )
+    print("  ".join(title.ljust(width) for title, _, width in columns), file=out)
+    for result in results:
+        print("  ".join(fmt.format(**result).ljust(width) for _, fmt, width in columns), file=out)
+    for result in results:
+        if result['Detail']:
+            print(f"{result['Scenario']}: {result['Status']}: {result['Detail']}", file=out)
+
+
+def main(name):
+    # Child side of sample(): nothing but the standard library is imported before the clock starts
+    started = time.perf_counter()
+    import boto3  # noqa: F401
+    boto3_ms = (time.perf_counter() - started) * 1000
+    from bench import clock as virtual_time
+    from bench import fake_aws
+    from bench.scenarios import SCENARIOS, environment
+    scenario = SCENARIOS[name]
+    # Only for the environment the handler reads at import; the module itself gets real boto3
+    variables, _ = scenario['setup'](fake_aws.FakeAWS(virtual_time.VirtualClock()), 10)
+    with environment(variables):
+        started = time.perf_counter()
+        scenario['load']()
+        init_ms = (time.perf_counter() - started) * 1000
+    print(json.dumps({'Boto3Ms': boto3_ms, 'InitMs': init_ms}))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
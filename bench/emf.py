@@ -0,0 +1,58 @@
+import json
+import numbers
+
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+UNITS = {
+    'Seconds', 'Microseconds', 'Milliseconds', 'Bytes', 'Kilobytes', 'Megabytes', 'Gigabytes', 'Terabytes',
+    'Bits', 'Kilobits', 'Megabits', 'Gigabits', 'Terabits', 'Percent', 'Count', 'Bytes/Second',
+    'Kilobytes/Second', 'Megabytes/Second', 'Gigabytes/Second', 'Terabytes/Second', 'Bits/Second',
+    'Kilobits/Second', 'Megabits/Second', 'Gigabits/Second', 'Terabits/Second', 'Count/Second', 'None'
+}
+MAX_METRICS = 100
+MAX_DIMENSIONS = 30
+
+
+def is_emf(line):
+    return line.startswith('{') and '"_aws"' in line
+
+
+def check(document):
+    """Problems that would make CloudWatch drop or reject the EMF `document`; empty when it is valid."""
+    problems = []
+    metadata = document.get('_aws')
+    if not isinstance(metadata, dict):
+        return ["no _aws metadata"]
+    if not isinstance(metadata.get('Timestamp'), int):
+        problems.append("_aws.Timestamp is not epoch milliseconds")
+    directives = metadata.get('CloudWatchMetrics')
+    if not isinstance(directives, list) or not directives:
+        return problems + ["no CloudWatchMetrics directive"]
+    for directive in directives:
+        if not directive.get('Namespace'):
+            problems.append("directive without Namespace")
+        for dimension_set in directive.get('Dimensions', []):
+            if len(dimension_set) > MAX_DIMENSIONS:
+                problems.append(f"{len(dimension_set)} dimensions in one set")
+            problems.extend(
+                f"dimension {key} missing or not a string" for key in dimension_set
+                if not isinstance(document.get(key), str)
+            )
+        metrics = directive.get('Metrics', [])
+        if len(metrics) > MAX_METRICS:
+            problems.append(f"{len(metrics)} metrics in one directive")
+        for metric in metrics:
+            name = metric.get('Name')
+            if not isinstance(document.get(name), numbers.Number) or isinstance(document.get(name), bool):
+                problems.append(f"metric {name} missing or not a number")
+            if metric.get('Unit', 'None') not in UNITS:
+                problems.append(f"metric {name} has unit {metric.get('Unit')}")
+    return problems
+
+
+def parse(line):
+    # (document, problems) of one EMF log line
+    try:
+        document = json.loads(line)
+    except ValueError as e:
+        return None, [f"not JSON: {e}"]
+    return document, check(document)
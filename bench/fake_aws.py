@@ -0,0 +1,809 @@
+import collections
+import contextlib
+import datetime
+import fnmatch
+import io
+import itertools
+import json
+import random
+import threading
+import types
+
+import boto3
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+HOME_ACCOUNT = '111111111111'
+HOME_REGION = 'ap-south-1'
+DEFAULT_MAX_ATTEMPTS = 5  # botocore legacy retry mode
+DEFAULT_READ_TIMEOUT = 60  # seconds, botocore default
+TAGS = {
+    'PatchScanAutomation': 'Enabled',
+    'PatchScanAutomationWindow': 'Daily',
+    'PatchDeployAutomation': 'Enabled',
+}
+EMAIL_TAG = 'PatchScanEmailAlert'
+BASELINE_ID = 'pb-0a1b2c3d4e5f60718'
+PATCH_GROUP = 'default'
+PATCH_CATALOG = 400  # distinct patches a non-compliant host draws its missing patches from
+SES_MAX_SEND_RATE = 14
+SNS_MAX_MESSAGE = 256 * 1024
+SQS_BATCH = 10
+SQS_MAX_MESSAGE = 256 * 1024  # per message and per batch
+MAX_FILTER_VALUES = 200
+IMAGE_VISIBLE_DELAY = 10  # seconds
+LAMBDA_MAX_PAYLOAD = {'Event': 1024 * 1024, 'RequestResponse': 6 * 1024 * 1024}
+# Seconds a command takes on one host, by document and Operation parameter
+COMMAND_TIMES = {
+    ('AWS-RunPatchBaseline', 'Scan'): (30, 180),
+    ('AWS-RunPatchBaseline', 'Install'): (120, 600),
+    ('AWS-RunShellScript', ''): (2, 20),
+}
+
+# (input token, output token, page size parameter) per pageable operation
+PAGINATORS = {
+    'describe_instances': ('NextToken', 'NextToken', 'MaxResults'),
+    'describe_images': ('NextToken', 'NextToken', 'MaxResults'),
+    'describe_instance_information': ('NextToken', 'NextToken', 'MaxResults'),
+    'describe_instance_patch_states': ('NextToken', 'NextToken', 'MaxResults'),
+    'describe_instance_patches': ('NextToken', 'NextToken', 'MaxResults'),
+    'describe_patch_groups': ('NextToken', 'NextToken', 'MaxResults'),
+    'list_command_invocations': ('NextToken', 'NextToken', 'MaxResults'),
+    'list_objects_v2': ('ContinuationToken', 'NextContinuationToken', 'MaxKeys'),
+}
+
+
+class Throttled(Exception):
+    # Raised by an operation to reject a call the way the service would under load
+    pass
+
+
+def client_error(code, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, operation)
+
+
+def api_name(operation):
+    return ''.join(part.capitalize() for part in operation.split('_'))
+
+
+def page(operation, params, items, key, limit, minimum=1, token='NextToken', size='MaxResults'):
+    # Slices `items` the way the real API does, rejecting page sizes outside the documented range
+    page_size = params.get(size, limit)
+    if not minimum <= page_size <= limit:
+        raise client_error('ValidationException', api_name(operation), f"{size} must be between {minimum} and {limit}")
+    start = int(params.get(token) or 0)
+    result = {key: items[start:start + page_size]}
+    if start + page_size < len(items):
+        result['NextToken' if token == 'NextToken' else 'NextContinuationToken'] = str(start + page_size)
+    return result
+
+
+def check_ids(operation, ids, limit):
+    if len(ids) > limit:
+        raise client_error('ValidationException', api_name(operation), f"at most {limit} instance ids per call, got {len(ids)}")
+
+
+def utc(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+class Fleet:
+    """Instances, patch states and in-flight work of one account/region."""
+
+    def __init__(self, size, account_id, region, rng, clock, non_compliant=0.3, fresh=0.0,
+                 per_owner=25, tags=None):
+        self.account_id = account_id
+        self.region = region
+        self.rng = rng
+        self.instances = []
+        self.states = {}
+        self.patches = {}
+        self.commands = {}
+        self.images = {}
+        self.automations = {}
+        self.targets = collections.defaultdict(dict)  # target group arn -> {instance id: registered at}
+        tags = dict(TAGS, **(tags or {}))
+        zones = [f"{region}{zone}" for zone in 'abc']
+        for n in range(size):
+            iid = f"i-{account_id[-4:]}{n:013x}"
+            ip = f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}"
+            instance_tags = [{'Key': key, 'Value': value} for key, value in tags.items()]
+            instance_tags.append({'Key': 'Name', 'Value': f"app-{n % 50:02d}"})
+            instance_tags.append({'Key': EMAIL_TAG, 'Value': f"owner{n // per_owner}@example.com"})
+            self.instances.append({
+                'InstanceId': iid,
+                'State': {'Name': 'running'},
+                'PrivateIpAddress': ip,
+                'PrivateDnsName': f"ip-{ip.replace('.', '-')}.{region}.compute.internal",
+                'Placement': {'AvailabilityZone': zones[n % len(zones)]},
+                'Tags': instance_tags,
+            })
+            missing = rng.randint(1, 40) if rng.random() < non_compliant else 0
+            scanned = clock.now - (rng.uniform(600, 7200) if rng.random() < fresh else rng.uniform(2, 4) * 86400)
+            self.states[iid] = {
+                'InstanceId': iid,
+                'PatchGroup': PATCH_GROUP,
+                'BaselineId': BASELINE_ID,
+                'Operation': 'Scan',
+                'OperationStartTime': utc(scanned - 90),
+                'OperationEndTime': utc(scanned),
+                'InstalledCount': rng.randint(200, 600),
+                'MissingCount': missing,
+                'FailedCount': 0,
+                'InstalledPendingRebootCount': rng.randint(0, 2) if missing else 0,
+                'CriticalNonCompliantCount': missing // 4,
+                'SecurityNonCompliantCount': missing // 2,
+            }
+        self.by_id = {instance['InstanceId']: instance for instance in self.instances}
+
+    def missing_patches(self, iid):
+        if iid not in self.patches:
+            picks = random.Random(iid).sample(range(PATCH_CATALOG), self.states[iid]['MissingCount'])
+            self.patches[iid] = [
+                {
+                    'KBId': f"KB{5030000 + pick}",
+                    'Title': f"Security update KB{5030000 + pick}",
+                    'Classification': 'SecurityUpdates' if pick % 3 else 'CriticalUpdates',
+                    'Severity': ('Critical', 'Important', 'Moderate')[pick % 3],
+                    'State': 'Missing',
+                    'CVEIds': f"CVE-2026-{10000 + pick}",
+                }
+                for pick in picks
+            ]
+        return self.patches[iid]
+
+
+class Service:
+    """Base for the fakes: public methods are the boto3 operations of the service."""
+    name = None
+    LOCAL = ()  # client methods that make no API call
+
+    def __init__(self, aws, fleet):
+        self.aws = aws
+        self.fleet = fleet
+        self.exceptions = types.SimpleNamespace()
+
+    def response_time(self, name, params):
+        # Seconds the service takes to answer beyond the call latency
+        return 0
+
+
+class EC2(Service):
+    name = 'ec2'
+
+    def __init__(self, aws, fleet):
+        super().__init__(aws, fleet)
+        self._reservations = {}
+
+    def _matches(self, instance, filters, instance_ids):
+        if instance_ids and instance['InstanceId'] not in instance_ids:
+            return False
+        tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+        for flt in filters or []:
+            name, values = flt['Name'], flt['Values']
+            if name.startswith('tag:'):
+                if tags.get(name[4:]) not in values:
+                    return False
+            elif name == 'tag-key':
+                if not any(key in tags for key in values):
+                    return False
+            elif name == 'instance-state-name':
+                if instance['State']['Name'] not in values:
+                    return False
+            elif name == 'instance-id':
+                if instance['InstanceId'] not in values:
+                    return False
+        return True
+
+    def describe_instances(self, Filters=None, InstanceIds=None, **params):
+        # Tags never change during a run, so each filter is evaluated once and its pages sliced from the result
+        key = json.dumps([Filters, InstanceIds], sort_keys=True)
+        if key not in self._reservations:
+            self._reservations[key] = [
+                {'ReservationId': f"r-{instance['InstanceId'][2:]}", 'Instances': [instance]}
+                for instance in self.fleet.instances if self._matches(instance, Filters, InstanceIds)
+            ]
+        reservations = self._reservations[key]
+        if 'MaxResults' not in params:
+            return {'Reservations': reservations}
+        return page('describe_instances', params, reservations, 'Reservations', 1000, minimum=5)
+
+    def create_image(self, InstanceId, Name, **params):
+        image_id = f"ami-{len(self.fleet.images):017x}"
+        self.fleet.images[image_id] = {
+            'ImageId': image_id,
+            'Name': Name,
+            'CreationDate': utc(self.aws.clock.now).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            'Ready': self.aws.clock.now + self.fleet.rng.uniform(*self.aws.image_time),
+            # DescribeImages is eventually consistent: a new AMI can be unknown to it for a few seconds
+            'Visible': self.aws.clock.now + self.fleet.rng.uniform(0, IMAGE_VISIBLE_DELAY),
+        }
+        return {'ImageId': image_id}
+
+    def _image(self, image):
+        state = 'available' if self.aws.clock.now >= image['Ready'] else 'pending'
+        return {key: value for key, value in dict(image, State=state).items() if key not in ('Ready', 'Visible')}
+
+    def _visible(self, image_id):
+        image = self.fleet.images.get(image_id)
+        return image is not None and self.aws.clock.now >= image['Visible']
+
+    def describe_images(self, ImageIds=None, Filters=None, Owners=None, **params):
+        if ImageIds:
+            missing = [image_id for image_id in ImageIds if not self._visible(image_id)]
+            if missing:
+                raise client_error('InvalidAMIID.NotFound', 'DescribeImages', f"The image id '[{missing[0]}]' does not exist")
+            return {'Images': [self._image(self.fleet.images[image_id]) for image_id in ImageIds]}
+        images = [self._image(image) for image_id, image in self.fleet.images.items() if self._visible(image_id)]
+        for flt in Filters or []:
+            if len(flt['Values']) > MAX_FILTER_VALUES:
+                raise client_error('FilterLimitExceeded', 'DescribeImages', f"at most {MAX_FILTER_VALUES} filter values")
+            if flt['Name'] == 'image-id':
+                images = [i for i in images if i['ImageId'] in flt['Values']]
+            elif flt['Name'] == 'name':
+                images = [i for i in images if any(fnmatch.fnmatch(i['Name'], pattern) for pattern in flt['Values'])]
+            elif flt['Name'] == 'state':
+                images = [i for i in images if i['State'] in flt['Values']]
+        if 'MaxResults' not in params:
+            return {'Images': images}
+        return page('describe_images', params, images, 'Images', 1000, minimum=5)
+
+    def create_tags(self, **params):
+        return {}
+
+
+class SSM(Service):
+    name = 'ssm'
+
+    def describe_instance_information(self, **params):
+        # Paged first, so each call only builds its own page
+        result = page('describe_instance_information', params, self.fleet.instances, 'InstanceInformationList', 50, minimum=5)
+        result['InstanceInformationList'] = [
+            {'InstanceId': instance['InstanceId'], 'PingStatus': 'Online', 'PlatformType': 'Linux',
+             'ResourceType': 'EC2Instance', 'ComputerName': instance['PrivateDnsName']}
+            for instance in result['InstanceInformationList']
+        ]
+        return result
+
+    def describe_instance_patch_states(self, InstanceIds, **params):
+        check_ids('describe_instance_patch_states', InstanceIds, 50)
+        states = [self.fleet.states[iid] for iid in InstanceIds if iid in self.fleet.states]
+        return page('describe_instance_patch_states', params, states, 'InstancePatchStates', 100, minimum=10)
+
+    def describe_instance_patches(self, InstanceId, Filters=None, **params):
+        wanted = next((flt['Values'] for flt in Filters or [] if flt['Key'] == 'State'), None)
+        patches = [p for p in self.fleet.missing_patches(InstanceId) if wanted is None or p['State'] in wanted]
+        return page('describe_instance_patches', params, patches, 'Patches', 100, minimum=10)
+
+    def describe_patch_groups(self, **params):
+        mappings = [{'PatchGroup': PATCH_GROUP, 'BaselineIdentity': {'BaselineId': BASELINE_ID}}]
+        return page('describe_patch_groups', params, mappings, 'Mappings', 100)
+
+    def get_patch_baseline(self, BaselineId):
+        return {'BaselineId': BaselineId, 'ModifiedDate': utc(self.aws.clock.now - 30 * 86400)}
+
+    def send_command(self, DocumentName, InstanceIds=None, Targets=None, Parameters=None, Comment='', **params):
+        if Targets:
+            InstanceIds = [instance['InstanceId'] for instance in self.fleet.instances]
+        check_ids('send_command', InstanceIds, 50 if not Targets else len(InstanceIds))
+        command_id = f"{len(self.fleet.commands):08x}-bench-command"
+        operation = (Parameters or {}).get('Operation', [''])[0]
+        low, high = self.aws.command_times.get((DocumentName, operation), (30, 180))
+        self.fleet.commands[command_id] = {
+            'CommandId': command_id,
+            'DocumentName': DocumentName,
+            'Comment': Comment,
+            'Parameters': Parameters or {},
+            'Hosts': {
+                iid: [self.aws.clock.now + self.fleet.rng.uniform(low, high),
+                      'Failed' if self.fleet.rng.random() < self.aws.failure_rate else 'Success']
+                for iid in InstanceIds
+            },
+        }
+        return {'Command': {'CommandId': command_id, 'DocumentName': DocumentName, 'Comment': Comment}}
+
+    def _status(self, command, iid):
+        finish, status = command['Hosts'][iid]
+        if self.aws.clock.now < finish:
+            return 'InProgress'
+        operation = command['Parameters'].get('Operation', [''])[0]
+        state = self.fleet.states.get(iid)
+        if status == 'Success' and command['DocumentName'] == 'AWS-RunPatchBaseline' and state:
+            if operation == 'Install' and state['MissingCount']:
+                state.update(MissingCount=0, InstalledPendingRebootCount=0, CriticalNonCompliantCount=0,
+                             SecurityNonCompliantCount=0, Operation='Install')
+            state.update(OperationStartTime=utc(finish - 90), OperationEndTime=utc(finish))
+        return status
+
+    def _invocation(self, command, iid, details):
+        invocation = {'CommandId': command['CommandId'], 'InstanceId': iid, 'Status': self._status(command, iid),
+                      'DocumentName': command['DocumentName'], 'Comment': command['Comment']}
+        if details:
+            invocation['CommandPlugins'] = [{'Name': 'aws:runShellScript', 'Output': self._output(command)}]
+        return invocation
+
+    def _output(self, command):
+        if command['DocumentName'] != 'AWS-RunShellScript':
+            return ''
+        return (
+            "### disk\nFilesystem 1024-blocks Used Available Capacity Mounted on\n"
+            "/dev/xvda1 20959212 8388608 12570604 41% /\n/dev/xvdf1 104806400 52428800 52377600 50% /data\n"
+            "### memory\n              total        used        free      shared  buff/cache   available\n"
+            "Mem:           7821        2300        3100          12        2400        5200\n"
+            "### ports\nLISTEN 0 128 0.0.0.0:22 0.0.0.0:*\nLISTEN 0 128 0.0.0.0:8089 0.0.0.0:*\n"
+            "### failed\n"
+        )
+
+    def list_command_invocations(self, CommandId, InstanceId=None, Details=False, **params):
+        command = self.fleet.commands[CommandId]
+        ids = [InstanceId] if InstanceId else list(command['Hosts'])
+        result = page('list_command_invocations', params, ids, 'CommandInvocations', 50)
+        result['CommandInvocations'] = [self._invocation(command, iid, Details) for iid in result['CommandInvocations']]
+        return result
+
+    def get_command_invocation(self, CommandId, InstanceId, **params):
+        command = self.fleet.commands[CommandId]
+        return dict(self._invocation(command, InstanceId, False), StandardOutputContent=self._output(command))
+
+    def list_commands(self, CommandId=None, **params):
+        commands = [self.fleet.commands[CommandId]] if CommandId in self.fleet.commands else []
+        return {'Commands': [{key: c[key] for key in ('CommandId', 'DocumentName', 'Comment')} for c in commands]}
+
+    def get_automation_execution(self, AutomationExecutionId):
+        steps = self.fleet.automations.get(AutomationExecutionId)
+        if steps is None:
+            raise client_error('AutomationExecutionNotFoundException', 'GetAutomationExecution')
+        return {'AutomationExecution': {'AutomationExecutionId': AutomationExecutionId, 'StepExecutions': steps}}
+
+
+class SES(Service):
+    name = 'ses'
+
+    def __init__(self, aws, fleet):
+        super().__init__(aws, fleet)
+        self.sent = collections.deque()
+
+    def _send(self, count=1):
+        # Sending faster than MaxSendRate is rejected, as SES does
+        now = self.aws.clock.now
+        while self.sent and self.sent[0] <= now - 1:
+            self.sent.popleft()
+        if len(self.sent) + count > SES_MAX_SEND_RATE:
+            raise Throttled('Throttling')
+        self.sent.extend([now] * count)
+        self.aws.emails += count
+
+    def get_send_quota(self):
+        return {'Max24HourSend': 200000.0, 'MaxSendRate': float(SES_MAX_SEND_RATE), 'SentLast24Hours': 0.0}
+
+    def send_email(self, Source, Destination, Message, **params):
+        self._send()
+        return {'MessageId': f"bench-{self.aws.emails}"}
+
+    def send_raw_email(self, RawMessage, **params):
+        self._send()
+        return {'MessageId': f"bench-{self.aws.emails}"}
+
+    def send_bulk_templated_email(self, Destinations, **params):
+        if len(Destinations) > 50:
+            raise client_error('ValidationError', 'SendBulkTemplatedEmail', 'at most 50 destinations')
+        self._send(len(Destinations))
+        return {'Status': [{'Status': 'Success', 'MessageId': f"bench-{n}"} for n in range(len(Destinations))]}
+
+
+class DynamoDB(Service):
+    name = 'dynamodb'
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for table, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise client_error('ValidationException', 'BatchGetItem', 'at most 100 keys')
+            items = self.aws.tables[table]
+            responses[table] = [items[json.dumps(key, sort_keys=True)] for key in request['Keys']
+                                if json.dumps(key, sort_keys=True) in items]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems):
+        for table, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise client_error('ValidationException', 'BatchWriteItem', 'at most 25 items')
+            for request in requests:
+                item = request['PutRequest']['Item']
+                key = {name: value for name, value in item.items() if name in ('Email', 'InstanceId')}
+                self.aws.tables[table][json.dumps(key, sort_keys=True)] = item
+        return {'UnprocessedItems': {}}
+
+    def put_item(self, TableName, Item, **params):
+        key = {name: value for name, value in Item.items() if name in ('Email', 'InstanceId')}
+        self.aws.tables[TableName][json.dumps(key, sort_keys=True)] = Item
+        return {}
+
+
+class S3(Service):
+    name = 's3'
+    LOCAL = ('generate_presigned_url',)
+
+    def __init__(self, aws, fleet):
+        super().__init__(aws, fleet)
+        self.exceptions.NoSuchKey = aws.NoSuchKey
+
+    def put_object(self, Bucket, Key, Body=b'', IfNoneMatch=None, **params):
+        data = Body.read() if hasattr(Body, 'read') else Body
+        if IfNoneMatch == '*' and Key in self.aws.buckets[Bucket]:
+            raise client_error('PreconditionFailed', 'PutObject', 'At least one of the pre-conditions you specified did not hold')
+        self.aws.buckets[Bucket][Key] = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+        return {'ETag': f'"{len(data)}"'}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **params):
+        # Managed transfer: one PutObject for the report sizes the handlers produce
+        return self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj, **(ExtraArgs or {}))
+
+    def get_object(self, Bucket, Key, **params):
+        data = self.aws.buckets[Bucket].get(Key)
+        if data is None:
+            raise self.aws.NoSuchKey({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key, **params):
+        data = self.aws.buckets[Bucket].get(Key)
+        if data is None:
+            raise client_error('404', 'HeadObject', 'Not Found')
+        return {'ContentLength': len(data)}
+
+    def list_objects_v2(self, Bucket, Prefix='', **params):
+        keys = sorted(key for key in self.aws.buckets[Bucket] if key.startswith(Prefix))
+        objects = [{'Key': key, 'Size': len(self.aws.buckets[Bucket][key])} for key in keys]
+        result = page('list_objects_v2', params, objects, 'Contents', 1000, token='ContinuationToken', size='MaxKeys')
+        return dict(result, KeyCount=len(result['Contents']), IsTruncated='NextContinuationToken' in result)
+
+    def create_multipart_upload(self, Bucket, Key, **params):
+        upload_id = f"upload-{len(self.aws.uploads)}"
+        self.aws.uploads[upload_id] = {}
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **params):
+        self.aws.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **params):
+        parts = self.aws.uploads.pop(UploadId)
+        self.aws.buckets[Bucket][Key] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **params):
+        self.aws.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature=bench"
+
+
+class STS(Service):
+    name = 'sts'
+
+    def get_caller_identity(self):
+        return {'Account': self.fleet.account_id, 'Arn': f"arn:aws:sts::{self.fleet.account_id}:assumed-role/bench"}
+
+    def assume_role(self, RoleArn, RoleSessionName, **params):
+        account_id = RoleArn.split(':')[4]
+        if account_id not in self.aws.fleets:
+            raise client_error('AccessDenied', 'AssumeRole', f"not authorized to assume {RoleArn}")
+        return {'Credentials': {
+            'AccessKeyId': f"BENCH{account_id}", 'SecretAccessKey': 'bench', 'SessionToken': 'bench',
+            'Expiration': utc(self.aws.clock.now + 3600)
+        }}
+
+
+class IAM(Service):
+    name = 'iam'
+
+    def list_account_aliases(self, **params):
+        return {'AccountAliases': [f"bench-{self.fleet.account_id[-4:]}"]}
+
+
+class ELBv2(Service):
+    name = 'elbv2'
+
+    def register_targets(self, TargetGroupArn, Targets):
+        for target in Targets:
+            self.fleet.targets[TargetGroupArn].setdefault(target['Id'], self.aws.clock.now)
+        return {}
+
+    def deregister_targets(self, TargetGroupArn, Targets):
+        for target in Targets:
+            self.fleet.targets[TargetGroupArn].pop(target['Id'], None)
+        return {}
+
+    def describe_target_health(self, TargetGroupArn, Targets=None):
+        registered = self.fleet.targets[TargetGroupArn]
+        descriptions = []
+        for target in Targets or [{'Id': iid} for iid in registered]:
+            since = registered.get(target['Id'])
+            if since is None:
+                state = 'unused'
+            elif self.aws.clock.now - since >= self.aws.health_time:
+                state = 'healthy'
+            else:
+                state = 'initial'
+            descriptions.append({'Target': target, 'TargetHealth': {'State': state}})
+        return {'TargetHealthDescriptions': descriptions}
+
+
+class Lambda(Service):
+    name = 'lambda'
+
+    def response_time(self, name, params):
+        # A synchronous invoke answers once the other function has run
+        return self.aws.sync_invoke_time if name == 'invoke' and params.get('InvocationType', 'RequestResponse') == 'RequestResponse' else 0
+
+    def invoke(self, FunctionName, Payload=b'{}', InvocationType='RequestResponse', **params):
+        # Recorded so the runner can follow self re-invocations; other functions are not executed
+        payload = Payload if isinstance(Payload, str) else Payload.decode('utf-8')
+        if len(payload.encode('utf-8')) > LAMBDA_MAX_PAYLOAD[InvocationType]:
+            raise client_error('RequestEntityTooLargeException', 'Invoke', f"{InvocationType} payload over the limit")
+        self.aws.invocations.append({'FunctionName': FunctionName, 'InvocationType': InvocationType, 'Payload': payload})
+        status = 202 if InvocationType == 'Event' else 200
+        return {'StatusCode': status, 'Payload': io.BytesIO(b'{"statusCode": 200, "body": "{}"}')}
+
+
+class SNS(Service):
+    name = 'sns'
+
+    def publish(self, TopicArn, Message, **params):
+        if len(Message.encode('utf-8')) > SNS_MAX_MESSAGE:
+            raise client_error('InvalidParameter', 'Publish', 'message too long')
+        self.aws.messages.append(Message)
+        return {'MessageId': f"bench-{len(self.aws.messages)}"}
+
+
+class SQS(Service):
+    name = 'sqs'
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if not 1 <= len(Entries) <= SQS_BATCH:
+            raise client_error('AWS.SimpleQueueService.TooManyEntriesInBatchRequest', 'SendMessageBatch', f"{len(Entries)} entries")
+        if len({entry['Id'] for entry in Entries}) != len(Entries):
+            raise client_error('AWS.SimpleQueueService.BatchEntryIdsNotDistinct', 'SendMessageBatch')
+        if sum(len(entry['MessageBody'].encode('utf-8')) for entry in Entries) > SQS_MAX_MESSAGE:
+            raise client_error('AWS.SimpleQueueService.BatchRequestTooLong', 'SendMessageBatch', 'batch over 256 KB')
+        successful = []
+        for entry in Entries:
+            message_id = f"bench-message-{next(self.aws.message_ids)}"
+            self.aws.queues[QueueUrl].append({
+                'MessageId': message_id, 'Body': entry['MessageBody'], 'ReceiveCount': 0, 'VisibleAt': self.aws.clock.now
+            })
+            successful.append({'Id': entry['Id'], 'MessageId': message_id})
+        return {'Successful': successful, 'Failed': []}
+
+
+SERVICES = {service.name: service for service in (EC2, SSM, SES, DynamoDB, S3, STS, IAM, ELBv2, Lambda, SNS, SQS)}
+
+
+class FakeEvents:
+    # The part of botocore's event system the handlers hook into: register() and prefix-matched emit()
+    def __init__(self):
+        self.handlers = []
+
+    def register(self, event_name, handler, unique_id=None, **kwargs):
+        self.handlers.append((event_name, handler))
+
+    def emit(self, event_name, **kwargs):
+        for name, handler in self.handlers:
+            if event_name == name or event_name.startswith(name + '.'):
+                handler(event_name=event_name, **kwargs)
+
+
+class FakeClient:
+    # What boto3.client() returns while the fakes are installed
+    def __init__(self, aws, service, max_attempts, read_timeout=DEFAULT_READ_TIMEOUT):
+        self._aws = aws
+        self._service = service
+        self._max_attempts = max_attempts
+        self._read_timeout = read_timeout
+        self.exceptions = service.exceptions
+        self.meta = types.SimpleNamespace(
+            region_name=service.fleet.region,
+            service_model=types.SimpleNamespace(service_name=service.name),
+            events=FakeEvents()
+        )
+
+    def __getattr__(self, name):
+        operation = getattr(self._service, name, None) if not name.startswith('_') else None
+        if not callable(operation):
+            raise AttributeError(f"{self._service.name} fake has no operation {name}")
+        if name in self._service.LOCAL:
+            return operation
+        return lambda *args, **params: self._aws.call(
+            self._service, name, operation, args, params, self._max_attempts, self.meta.events, self._read_timeout
+        )
+
+    def get_paginator(self, name):
+        if name not in PAGINATORS or not hasattr(self._service, name):
+            raise AttributeError(f"{self._service.name} fake cannot paginate {name}")
+        return FakePaginator(self, name)
+
+
+class FakePaginator:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def paginate(self, PaginationConfig=None, **params):
+        input_token, output_token, size = PAGINATORS[self.name]
+        if PaginationConfig and 'PageSize' in PaginationConfig:
+            params[size] = PaginationConfig['PageSize']
+        operation = getattr(self.client, self.name)
+        while True:
+            result = operation(**params)
+            yield result
+            if not result.get(output_token):
+                return
+            params[input_token] = result[output_token]
+
+
+class FakeAWS:
+    """In-process EC2, SSM, SES, DynamoDB, S3, STS, IAM, ELBv2, Lambda, SNS and SQS.
+
+    Every call sleeps a jittered `latency` (or its account's entry in
+    `account_latency`) on the virtual clock, may be throttled (randomly at
+    `throttle_rate`, or by SES above its send rate) and is then retried
+    with botocore's backoff up to the client's max_attempts. Calls, throttles and page sizes are checked against the
+    real API limits and counted per service and operation.
+    """
+
+    def __init__(self, clock, latency=0.03, throttle_rate=0.0, failure_rate=0.0, seed=0,
+                 command_times=None, image_time=(120, 600), health_time=30.0, sync_invoke_time=5.0,
+                 account_latency=None):
+        self.clock = clock
+        self.latency = latency
+        self.account_latency = account_latency or {}  # account id -> latency of the calls into that account
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.command_times = {**COMMAND_TIMES, **(command_times or {})}
+        self.image_time = image_time
+        self.health_time = health_time
+        self.sync_invoke_time = sync_invoke_time
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.lock = threading.RLock()
+        self.fleets = {}  # account id -> {region: Fleet}
+        self.buckets = collections.defaultdict(dict)
+        self.uploads = {}
+        self.tables = collections.defaultdict(dict)
+        self.calls = collections.Counter()  # (service, Operation) -> count
+        self.throttled = collections.Counter()
+        self.invocations = []
+        self.messages = []
+        self.queues = collections.defaultdict(list)  # queue url -> messages not yet deleted
+        self.message_ids = itertools.count(1)
+        self.dead_letters = []
+        self.emails = 0
+        self._services = {}
+        self.NoSuchKey = type('NoSuchKey', (ClientError,), {})
+
+    def add_fleet(self, size, account_id=HOME_ACCOUNT, region=HOME_REGION, **options):
+        fleet = Fleet(size, account_id, region, random.Random(f"{self.seed}-{account_id}-{region}"), self.clock, **options)
+        self.fleets.setdefault(account_id, {})[region] = fleet
+        return fleet
+
+    def fleet(self, account_id=HOME_ACCOUNT, region=HOME_REGION):
+        regions = self.fleets.setdefault(account_id, {})
+        if region not in regions:
+            return self.add_fleet(0, account_id, region)
+        return regions[region]
+
+    def client(self, service_name, region_name=None, config=None, account_id=HOME_ACCOUNT, **ignored):
+        retries = (getattr(config, 'retries', None) or {}) if config else {}
+        key = (service_name, account_id, region_name or HOME_REGION)
+        with self.lock:
+            if key not in self._services:
+                self._services[key] = SERVICES[service_name](self, self.fleet(account_id, region_name or HOME_REGION))
+        # botocore: max_attempts counts retries after the first attempt, total_max_attempts counts all of them
+        attempts = retries.get('total_max_attempts', retries['max_attempts'] + 1 if 'max_attempts' in retries else DEFAULT_MAX_ATTEMPTS)
+        read_timeout = getattr(config, 'read_timeout', None) or DEFAULT_READ_TIMEOUT
+        return FakeClient(self, self._services[key], attempts, read_timeout)
+
+    def session(self, aws_access_key_id=None, region_name=None, **ignored):
+        # Credentials from the fake AssumeRole carry the account id
+        account_id = aws_access_key_id[5:] if aws_access_key_id and aws_access_key_id.startswith('BENCH') else HOME_ACCOUNT
+        return types.SimpleNamespace(
+            client=lambda service_name, region_name=region_name, config=None, **kw:
+                self.client(service_name, region_name, config, account_id)
+        )
+
+    def call(self, service, name, operation, args, params, max_attempts, events, read_timeout=DEFAULT_READ_TIMEOUT):
+        operation_name = api_name(name)
+        event_name = f"response-received.{service.name}.{operation_name}"
+        for attempt in range(max_attempts):
+            latency = self.account_latency.get(service.fleet.account_id, self.latency)
+            self.clock.sleep(latency * self.rng.uniform(0.5, 1.5))
+            waited = service.response_time(name, params)
+            if waited > read_timeout:
+                # The request went through (the other side still runs it); the client gives up and retries like botocore
+                with self.lock:
+                    self.calls[(service.name, operation_name)] += 1
+                    operation(*args, **params)
+                self.clock.sleep(read_timeout)
+                if attempt == max_attempts - 1:
+                    raise ReadTimeoutError(endpoint_url=f"https://{service.name}.{HOME_REGION}.amazonaws.com")
+                self.clock.sleep(self.rng.uniform(0, min(20, 2 ** attempt)))
+                continue
+            self.clock.sleep(waited)
+            # Like botocore, every attempt emits response-received with its attempt number
+            context = {'retries': {'attempt': attempt + 1}}
+            with self.lock:
+                self.calls[(service.name, operation_name)] += 1
+                try:
+                    if self.throttle_rate and self.rng.random() < self.throttle_rate:
+                        raise Throttled('ThrottlingException')
+                    result = operation(*args, **params)
+                except Throttled as e:
+                    self.throttled[(service.name, operation_name)] += 1
+                    error = client_error(str(e), operation_name, 'Rate exceeded')
+                except ClientError as e:
+                    events.emit(event_name, context=context, parsed_response=e.response,
+                                response_dict={'status_code': 400}, exception=None)
+                    raise
+                else:
+                    error = None
+            parsed = error.response if error else result
+            events.emit(event_name, context=context, parsed_response=parsed,
+                        response_dict={'status_code': 400 if error else 200}, exception=None)
+            if error is None:
+                return result
+            if attempt == max_attempts - 1:
+                raise error
+            self.clock.sleep(self.rng.uniform(0, min(20, 2 ** attempt)))
+
+    def take_invocations(self, function_name):
+        with self.lock:
+            taken = [i for i in self.invocations if i['FunctionName'] == function_name and i['InvocationType'] == 'Event']
+            self.invocations = [i for i in self.invocations if i not in taken]
+        return taken
+
+    def receive_messages(self, queue_url, visibility_timeout, max_receives):
+        """Every visible message of `queue_url`, as the Lambda event source mapping would poll them.
+
+        Received messages stay invisible for `visibility_timeout` seconds unless
+        deleted; one already received `max_receives` times goes to the
+        dead-letter list instead (the queue's redrive policy).
+        """
+        with self.lock:
+            received = []
+            for message in list(self.queues[queue_url]):
+                if message['VisibleAt'] > self.clock.now:
+                    continue
+                if message['ReceiveCount'] >= max_receives:
+                    self.queues[queue_url].remove(message)
+                    self.dead_letters.append(message)
+                    continue
+                message['ReceiveCount'] += 1
+                message['VisibleAt'] = self.clock.now + visibility_timeout
+                received.append(dict(message))
+        return received
+
+    def delete_message(self, queue_url, message_id):
+        with self.lock:
+            self.queues[queue_url] = [m for m in self.queues[queue_url] if m['MessageId'] != message_id]
+
+    def next_visible(self, queue_url):
+        with self.lock:
+            return min((m['VisibleAt'] for m in self.queues[queue_url]), default=None)
+
+    def calls_by_service(self):
+        totals = collections.Counter()
+        for (service, _), count in self.calls.items():
+            totals[service] += count
+        return totals
+
+
+@contextlib.contextmanager
+def install(aws):
+    """Make boto3.client / boto3.Session hand out `aws` fakes for the duration of the block."""
+    saved = (boto3.client, boto3.Session)
+    boto3.client = aws.client
+    boto3.Session = aws.session
+    try:
+        yield aws
+    finally:
+        boto3.client, boto3.Session = saved
@@ -0,0 +1,237 @@
+import contextlib
+import importlib.util
+import json
+import os
+import pathlib
+import sys
+import textwrap
+import types
+
+from bench.fake_aws import utc
+
+# The handlers are loaded from the working tree, or from another revision (--cold-start --source)
+ROOT = pathlib.Path(os.environ.get('BENCH_SOURCE_ROOT') or pathlib.Path(__file__).resolve().parent.parent)
+TEMPLATES = ROOT / 'cloudformation-templates'
+LAYER = TEMPLATES / 'patching'  # patch_common is deployed as a Lambda layer from here
+DR_LAMBDA = ROOT / 'tf-code-modules' / 'my-dr-orchestration' / 'modules' / 'tf-rds-failover-automation' / 'lambda-code'
+BUCKET = 'bench-patch-scan-results'
+TABLE = 'bench-patch-scan-subscribers'
+SENDER = 'patching@example.com'
+TOPIC = 'arn:aws:sns:ap-south-1:111111111111:bench-auto-patch'
+EXECUTION_ID = 'bench-failover-execution'
+TARGET_GROUPS = 3
+SHARD_QUEUE = 'https://sqs.ap-south-1.amazonaws.com/111111111111/bench-patch-scan-shards'
+SHARD_SIZE = 250
+REMOTE_ACCOUNTS = ('222222222222', '333333333333', '444444444444', '555555555555')
+
+
+def load_file(path, name):
+    """Import the handler at `path` as a fresh module, with a fresh patch_common behind it."""
+    for module in [m for m in sys.modules if m == 'patch_common' or m.startswith('patch_common.')]:
+        del sys.modules[module]
+    if str(LAYER) not in sys.path:
+        sys.path.insert(0, str(LAYER))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def inline_code(template, resource):
+    # The ZipFile block of `resource`, read as text so the CloudFormation tags (!Ref, !GetAtt) need no loader
+    lines = (TEMPLATES / template).read_text().splitlines()
+    start = lines.index(f"  {resource}:")
+    marker = next(n for n in range(start, len(lines)) if lines[n].strip() == 'ZipFile: |')
+    indent = len(lines[marker]) - len(lines[marker].lstrip())
+    block = []
+    for line in lines[marker + 1:]:
+        if line.strip() and len(line) - len(line.lstrip()) <= indent:
+            break
+        block.append(line)
+    return textwrap.dedent("\n".join(block))
+
+
+def load_inline(template, resource, name):
+    module = types.ModuleType(name)
+    module.__file__ = f"{template}#{resource}"
+    exec(compile(inline_code(template, resource), module.__file__, 'exec'), module.__dict__)
+    return module
+
+
+@contextlib.contextmanager
+def environment(variables):
+    saved = {key: os.environ.get(key) for key in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def instance_ids(fleet):
+    return [instance['InstanceId'] for instance in fleet.instances]
+
+
+def fleet_setup(aws, size):
+    aws.add_fleet(size)
+    return {}, {}
+
+
+def scan_setup(aws, size):
+    aws.add_fleet(size)
+    return {'DDB_TABLE_NAME': TABLE, 'S3_BUCKET_NAME': BUCKET, 'SES_SENDER': SENDER}, {}
+
+
+def sharded_setup(aws, size):
+    # Coordinator run; the runner delivers the queued shards to worker invocations
+    env, event = scan_setup(aws, size)
+    env.update({'SHARD_SIZE': str(SHARD_SIZE), 'SHARD_QUEUE_URL': SHARD_QUEUE})
+    return env, event
+
+
+def local_shards_setup(aws, size):
+    env, event = scan_setup(aws, size)
+    env['SHARD_SIZE'] = str(SHARD_SIZE)
+    return env, event
+
+
+def orchestrator_setup(aws, size):
+    # The fleet spread over remote accounts, scanned through AssumeRole sessions
+    for account_id in REMOTE_ACCOUNTS:
+        aws.add_fleet(size // len(REMOTE_ACCOUNTS), account_id)
+    env, event = scan_setup(aws, 0)
+    env['TARGETS'] = ",".join(f"{account_id}:ap-south-1" for account_id in REMOTE_ACCOUNTS)
+    return env, event
+
+
+def register_targets_setup(aws, size):
+    # New and old hosts split evenly over the target groups; cut-over gated on the failover Automation
+    ids = instance_ids(aws.add_fleet(size))
+    new, old = ids[:len(ids) // 2], ids[len(ids) // 2:]
+    mapping = [
+        {
+            'TargetGroupArn': f"arn:aws:elasticloadbalancing:ap-south-1:111111111111:targetgroup/bench-{n}/{n:016x}",
+            'Port': 8089,
+            'New': new[n::TARGET_GROUPS],
+            'Old': old[n::TARGET_GROUPS]
+        }
+        for n in range(TARGET_GROUPS)
+    ]
+    started = aws.clock.now - 600
+    aws.fleet().automations[EXECUTION_ID] = [
+        {'StepName': step, 'StepStatus': 'Success',
+         'ExecutionStartTime': utc(started + 120 * n), 'ExecutionEndTime': utc(started + 120 * (n + 1))}
+        for n, step in enumerate(('PromoteReadReplica', 'WaitForRDSAvailable', 'UpdateDNS'))
+    ]
+    env = {'TARGET_MAPPING': json.dumps(mapping), 'TIMELINE_BUCKET': BUCKET}
+    return env, {'Phase': 'cutover', 'AutomationExecutionId': EXECUTION_ID}
+
+
+def upload_report_setup(aws, size):
+    aws.add_fleet(size)
+    return {}, {'BucketName': BUCKET}
+
+
+def sanity_setup(aws, size):
+    ids = instance_ids(aws.add_fleet(size))
+    return {'SANITY_OUTPUT_BUCKET': BUCKET, 'SNS_TOPIC_ARN': TOPIC}, {'instance_ids': ids, 'phase': 'post'}
+
+
+def fleet_ami_setup(aws, size):
+    ids = instance_ids(aws.add_fleet(size))
+    return {'SNS_TOPIC_ARN': TOPIC, 'SANITY_FUNCTION': 'bench-sanity', 'STATE_BUCKET': BUCKET}, {'instance_ids': ids}
+
+
+def daily_setup(aws, size):
+    aws.add_fleet(size)
+    return {'S3_BUCKET_NAME': BUCKET, 'SES_FROM': SENDER, 'DDB_TABLE_NAME': TABLE}, {}
+
+
+def non_compliant_inline_setup(aws, size):
+    aws.add_fleet(size, tags={'PatchScanAutomation': 'SSM'})
+    return {}, {}
+
+
+# name -> how to load, configure and invoke one handler; timeouts and memory are the deployed values
+SCENARIOS = {
+    'patch-scan-emailer': {
+        'load': lambda: load_file(LAYER / 'ec2-patch-scan-automation' / 'PatchScanEmailer.py', 'PatchScanEmailer'),
+        'handler': 'lambda_handler',
+        'setup': scan_setup,
+        'timeout': 300,
+    },
+    'patch-scan-sharded': {
+        'load': lambda: load_file(LAYER / 'ec2-patch-scan-automation' / 'PatchScanEmailer.py', 'PatchScanEmailer'),
+        'handler': 'lambda_handler',
+        'setup': sharded_setup,
+        'timeout': 300,
+        # ShardQueue and its event source mapping in the stack
+        'queue': {'Url': SHARD_QUEUE, 'VisibilityTimeout': 1800, 'MaxReceiveCount': 4},
+    },
+    'patch-scan-local-shards': {
+        'load': lambda: load_file(LAYER / 'ec2-patch-scan-automation' / 'PatchScanEmailer.py', 'PatchScanEmailer'),
+        'handler': 'lambda_handler',
+        'setup': local_shards_setup,
+        'timeout': 300,
+    },
+    'patch-non-compliant': {
+        'load': lambda: load_file(
+            LAYER / 'patch-non-compliant-ec2' / 'PatchNonCompliantEC2Instances.py', 'PatchNonCompliantEC2Instances'
+        ),
+        'handler': 'lambda_handler',
+        'setup': fleet_setup,
+        'timeout': 900,
+    },
+    'combined-email': {
+        'load': lambda: load_file(TEMPLATES / 'patch-scan-combined-email.py', 'patch_scan_combined_email'),
+        'handler': 'lambda_handler',
+        'setup': scan_setup,
+        'timeout': 900,
+    },
+    'combined-email-orchestrator': {
+        'load': lambda: load_file(TEMPLATES / 'patch-scan-combined-email.py', 'patch_scan_combined_email'),
+        'handler': 'lambda_handler',
+        'setup': orchestrator_setup,
+        'timeout': 900,
+    },
+    'register-targets': {
+        'load': lambda: load_file(DR_LAMBDA / 'register_targets.py', 'register_targets'),
+        'handler': 'handler',
+        'setup': register_targets_setup,
+        'timeout': 300,
+    },
+    'upload-patch-scan-report': {
+        'load': lambda: load_inline('ScanAllEC2Instances-NoReboot-S3Upload', 'UploadPatchScanReportToS3', 'upload_report'),
+        'handler': 'lambda_handler',
+        'setup': upload_report_setup,
+        'timeout': 300,
+    },
+    'sanity-test': {
+        'load': lambda: load_inline('aws-auto-ami-patch-ssm-cfn-stack', 'SanityTestLambda', 'sanity_test'),
+        'handler': 'lambda_handler',
+        'setup': sanity_setup,
+        'timeout': 300,
+    },
+    'fleet-ami-patch': {
+        'load': lambda: load_inline('aws-auto-ami-patch-ssm-cfn-stack', 'FleetAmiPatchLambda', 'fleet_ami_patch'),
+        'handler': 'lambda_handler',
+        'setup': fleet_ami_setup,
+        'timeout': 900,
+    },
+    'patch-scan-daily': {
+        'load': lambda: load_inline('ec2-patch-scan-daily-automation.yaml', 'PatchScanLambda', 'patch_scan_daily'),
+        'handler': 'lambda_handler',
+        'setup': daily_setup,
+        'timeout': 300,
+    },
+    'patch-non-compliant-inline': {
+        'load': lambda: load_inline('patch-non-compliant-ec2-only', 'PatchComplianceLambda', 'patch_non_compliant_inline'),
+        'handler': 'lambda_handler',
+        'setup': non_compliant_inline_setup,
+        'timeout': 300,
+    },
+}
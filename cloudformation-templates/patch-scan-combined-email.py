@@ -1,163 +1,314 @@
 import boto3
 import os
-import json
+import collections
 import datetime
-import botocore
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from patch_common.aws_clients import CLIENT_CONFIG, LazyClient
+from patch_common.command_tracker import send_command_chunked, wait_for_commands
+from patch_common.digests import group_by_recipient
+from patch_common.discovery import iter_tagged_instances
+from patch_common.html_report import (
+    LINK_EXPIRY, REPORT_ROW_CAP, escape, rank_items, render_report, table_row, upload_report
+)
+from patch_common.metrics import instrument_client, instrumented, phase, set_fleet_size
+from patch_common.notifications import build_email, dispatch_emails
+from patch_common.patch_index import build_patch_index, non_compliant_ids, write_patch_index
+from patch_common.patch_states import fetch_patch_states
+from patch_common.results_writer import partition_prefix, write_results
+from patch_common.scan_planner import plan_scans
+from patch_common.scan_history import PREFIX as INCREMENTAL_PREFIX, record_incremental
+from patch_common.subscribers import ensure_subscribed
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize boto3 clients
-ec2 = boto3.client('ec2')
-ssm = boto3.client('ssm')
-ddb = boto3.client('dynamodb')
-s3 = boto3.client('s3')
-ses = boto3.client('ses', region_name=os.environ.get('AWS_REGION', 'ap-south-1'))
-sts = boto3.client('sts')
-iam = boto3.client('iam')
+# boto3 clients, created on first use and shared across warm invocations
+ec2 = LazyClient('ec2')
+ssm = LazyClient('ssm')
+ddb = LazyClient('dynamodb')
+s3 = LazyClient('s3')
+ses = LazyClient('ses', region_name=os.environ.get('AWS_REGION', 'ap-south-1'))
+sts = LazyClient('sts')
+iam = LazyClient('iam')
 
 # Load environment variables
 DDB_TABLE_NAME = os.environ['DDB_TABLE_NAME']
 S3_BUCKET_NAME = os.environ['S3_BUCKET_NAME']
 SES_SENDER = os.environ['SES_SENDER']
+SCAN_TIMEOUT = int(os.environ.get('SCAN_TIMEOUT', '240'))  # seconds
+# Reuse patch states from scans (by any process) newer than this many seconds; 0 scans every instance
+SCAN_MAX_AGE = int(os.environ.get('SCAN_MAX_AGE', '0'))
+# 'true': also store an index of missing patches (patch id -> instances) next to each target's scan results
+PATCH_INDEX = os.environ.get('PATCH_INDEX', 'false').lower() == 'true'
+# 'true': store only changes since the previous scan and mail only owners whose instances changed
+INCREMENTAL_RESULTS = os.environ.get('INCREMENTAL_RESULTS', 'false').lower() == 'true'
+RESULTS_FORMAT = os.environ.get('RESULTS_FORMAT', 'ndjson')  # 'ndjson' (gzip) or 'parquet'
+SCAN_TAGS = {'PatchScanAutomation': 'Enabled', 'PatchScanAutomationWindow': 'Daily'}
+# Orchestrator mode: comma-separated account_id:region targets, each scanned through TARGET_ROLE_NAME
+TARGETS = [target.strip() for target in os.environ.get('TARGETS', '').split(',') if target.strip()]
+TARGET_ROLE_NAME = os.environ.get('TARGET_ROLE_NAME', 'PatchScanOrchestratorRole')
+MAX_PARALLEL_TARGETS = int(os.environ.get('MAX_PARALLEL_TARGETS', '8'))
+# Owners with more instances than this get the top offenders inline and the full report as a presigned S3 link
+REPORT_ROW_CAP = int(os.environ.get('REPORT_ROW_CAP', REPORT_ROW_CAP))
+REPORT_LINK_EXPIRY = int(os.environ.get('REPORT_LINK_EXPIRY', LINK_EXPIRY))  # seconds
+REPORT_PREFIX = 'reports/'
+COMPLIANT = "🟢 Compliant"
 
-def is_email_subscribed(email):
-    try:
-        response = ddb.get_item(
-            TableName=DDB_TABLE_NAME,
-            Key={'Email': {'S': email}}
-        )
-        return 'Item' in response
-    except botocore.exceptions.ClientError as e:
-        logger.error(f"DynamoDB check error for {email}: {e.response['Error']['Message']}")
-        return False
-
-def get_account_details():
+def get_account_details(sts_client=sts, iam_client=iam):
     try:
-        account_id = sts.get_caller_identity()['Account']
-        aliases = iam.list_account_aliases().get('AccountAliases', [])
+        account_id = sts_client.get_caller_identity()['Account']
+        aliases = iam_client.list_account_aliases().get('AccountAliases', [])
         account_name = aliases[0] if aliases else account_id
         return account_id, account_name
     except Exception as e:
         logger.error(f"Could not get account details: {e}")
         return "Unknown", "Unknown"
 
-def lambda_handler(event, context):
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    account_id, account_name = get_account_details()
-    logger.info(f"Running in AWS Account: {account_name} ({account_id})")
-
-    reservations = ec2.describe_instances(
-        Filters=[
-            {'Name': 'tag:PatchScanAutomation', 'Values': ['Enabled']},
-            {'Name': 'tag:PatchScanAutomationWindow', 'Values': ['Daily']},
-            {'Name': 'instance-state-name', 'Values': ['running']}
-        ]
-    )['Reservations']
-
-    instance_ids = []
-    instance_map = {}
-    email_recipients = set()
-
-    for r in reservations:
-        for inst in r['Instances']:
-            instance_id = inst['InstanceId']
-            tags = {t['Key']: t['Value'] for t in inst.get('Tags', [])}
-            email = tags.get('PatchScanEmailAlert')
-            if email and "@" in email:
-                instance_ids.append(instance_id)
-                instance_map[instance_id] = {
-                    'email': email,
-                    'tags': tags,
-                    'private_ip': inst.get('PrivateIpAddress', 'N/A'),
-                    'hostname': inst.get('PrivateDnsName', 'N/A'),
-                    'name': tags.get('Name', 'N/A')
-                }
-                email_recipients.add(email)
+def assume_target_session(account_id, region):
+    credentials = sts.assume_role(
+        RoleArn=f"arn:aws:iam::{account_id}:role/{TARGET_ROLE_NAME}",
+        RoleSessionName='PatchScanOrchestrator'
+    )['Credentials']
+    return boto3.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken'],
+        region_name=region
+    )
 
-    if not instance_ids:
-        logger.info("No matching running instances found.")
-        return {'statusCode': 200, 'body': 'No instances found for scan.'}
+def new_target(account_id, account_name, region=None):
+    return {
+        'AccountId': account_id,
+        'AccountName': account_name,
+        'Region': region,
+        'Instances': {},
+        'Results': {},
+        'ReportIds': [],
+        'S3Key': "(not uploaded)",
+        'PatchIndex': None,
+        'Error': None
+    }
 
-    try:
-        command_id = ssm.send_command(
-            InstanceIds=instance_ids,
-            DocumentName="AWS-RunPatchBaseline",
-            Parameters={"Operation": ["Scan"]}
-        )['Command']['CommandId']
-        logger.info(f"Patch scan command sent: {command_id}")
-    except Exception as e:
-        logger.error(f"SSM SendCommand failed: {e}")
-        return {'statusCode': 500, 'body': 'Failed to send SSM command.'}
+def parse_target(entry):
+    # (account_id, region) of an 'account_id:region' TARGETS entry, None when malformed
+    account_id, _, region = entry.partition(':')
+    if not (len(account_id) == 12 and account_id.isdigit() and region):
+        return None
+    return account_id, region
 
-    waiter = ssm.get_waiter('command_executed')
-    for iid in instance_ids:
+def target_label(target):
+    label = f"{target['AccountName']} ({target['AccountId']})"
+    return f"{label} {target['Region']}" if target['Region'] else label
+
+def classify_state(iid, state):
+    if state is None:
+        logger.error(f"No patch state reported for {iid}")
+        return {
+            'ComplianceStatus': "⚠️ Error",
+            'MissingCount': 'N/A',
+            'InstalledPendingRebootCount': 'N/A'
+        }
+    missing = state.get('MissingCount', 0)
+    pending = state.get('InstalledPendingRebootCount', 0)
+    return {
+        'ComplianceStatus': "🔴 Non Compliant" if missing > 0 or pending > 0 else COMPLIANT,
+        'MissingCount': missing,
+        'InstalledPendingRebootCount': pending
+    }
+
+def scan_target(target, ec2_client, ssm_client):
+    # Discovery, patch scan and patch-state collection for one account/region; SendCommand errors propagate
+    label = target_label(target)
+    with phase('Discovery'):
+        for record in iter_tagged_instances(ec2_client, SCAN_TAGS, logger=logger):
+            target['Instances'][record.instance_id] = record
+    instance_ids = list(target['Instances'])
+    if not instance_ids:
+        logger.info(f"{label}: no matching running instances found.")
+        return target
+
+    to_scan = instance_ids
+    states = {}
+    if SCAN_MAX_AGE:
         try:
-            waiter.wait(CommandId=command_id, InstanceId=iid, WaiterConfig={'Delay': 30, 'MaxAttempts': 10})
+            with phase('ScanPlanning'):
+                to_scan, states, reasons = plan_scans(ssm_client, instance_ids, SCAN_MAX_AGE)
+            logger.info(
+                f"{label}: reusing recent patch states for {len(states)} instances, scanning {len(to_scan)}: "
+                f"{dict(collections.Counter(reasons.values()))}"
+            )
         except Exception as e:
-            logger.warning(f"Command not completed on {iid}: {e}")
+            logger.warning(f"{label}: scan planning failed, scanning every instance: {e}")
 
-    results = {}
-    non_compliant_count = 0
+    if to_scan:
+        with phase('SendCommand'):
+            commands = send_command_chunked(
+                ssm_client, to_scan,
+                DocumentName="AWS-RunPatchBaseline",
+                Parameters={"Operation": ["Scan"]}
+            )
+        logger.info(f"{label}: patch scan commands sent: {list(commands)}")
+
+        with phase('CommandWait'):
+            _, timed_out = wait_for_commands(ssm_client, commands, SCAN_TIMEOUT)
+        for iid in timed_out:
+            logger.warning(f"{label}: command not completed on {iid} within {SCAN_TIMEOUT}s")
+
+        stats = {}
+        try:
+            with phase('PatchStates'):
+                states.update(fetch_patch_states(ssm_client, to_scan, stats))
+            logger.info(f"{label}: fetched {len(to_scan)} fresh patch states in {stats['ApiCalls']} calls ({stats['WallTime']:.2f}s)")
+        except Exception as e:
+            logger.error(f"{label}: error fetching patch states: {e}")
 
     for iid in instance_ids:
+        target['Results'][iid] = classify_state(iid, states.get(iid))
+
+    if PATCH_INDEX:
+        # Built here because it needs the target's own SSM client
         try:
-            state = ssm.describe_instance_patch_states(InstanceIds=[iid])['InstancePatchStates'][0]
-            missing = state.get('MissingCount', 0)
-            pending = state.get('InstalledPendingRebootCount', 0)
-            if missing > 0 or pending > 0:
-                compliance_status = "🔴 Non Compliant"
-                non_compliant_count += 1
-            else:
-                compliance_status = "🟢 Compliant"
-            results[iid] = {
-                'ComplianceStatus': compliance_status,
-                'MissingCount': missing,
-                'InstalledPendingRebootCount': pending
-            }
+            with phase('PatchIndex'):
+                target['PatchIndex'], errors = build_patch_index(ssm_client, non_compliant_ids(states))
+            if errors:
+                logger.warning(f"{label}: could not read missing patches of {len(errors)} instances: {errors}")
         except Exception as e:
-            logger.error(f"Error fetching patch state for {iid}: {e}")
-            results[iid] = {
-                'ComplianceStatus': "⚠️ Error",
-                'MissingCount': 'N/A',
-                'InstalledPendingRebootCount': 'N/A'
-            }
-            non_compliant_count += 1
-
-    # Upload result to S3
-    s3_key = f"scans/{today}-scan-results.json"
+            logger.error(f"{label}: patch index error: {e}")
+    return target
+
+def scan_entry(entry):
+    # A malformed TARGETS entry fails like an unreachable account, without stopping the others
+    pair = parse_target(entry)
+    if pair is None:
+        target = new_target(entry, entry)
+        target['Error'] = f"malformed TARGETS entry {entry!r}, expected <account_id>:<region>"
+        logger.error(target['Error'])
+        return target
+    return scan_remote_target(*pair)
+
+def scan_remote_target(account_id, region):
+    # Any failure (AssumeRole, discovery, SendCommand) is recorded on the target instead of aborting the run
+    target = new_target(account_id, account_id, region)
     try:
-        s3.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=json.dumps(results, indent=2),
-            ContentType="application/json"
-        )
-        logger.info(f"Uploaded result to s3://{S3_BUCKET_NAME}/{s3_key}")
+        with phase('AssumeRole'):
+            session = assume_target_session(account_id, region)
+        clients = {service: instrument_client(session.client(service, config=CLIENT_CONFIG)) for service in ('sts', 'iam', 'ec2', 'ssm')}
+        _, target['AccountName'] = get_account_details(clients['sts'], clients['iam'])
+        scan_target(target, clients['ec2'], clients['ssm'])
     except Exception as e:
-        logger.error(f"S3 upload failed: {e}")
-
-    # Compose HTML table
-    html_table = ""
-    for idx, iid in enumerate(instance_ids, start=1):
-        meta = instance_map.get(iid, {})
-        res = results.get(iid, {})
-        html_table += f"""
-        <tr>
-            <td>{idx}</td>
-            <td>{iid}</td>
-            <td>{meta.get('name', 'N/A')}</td>
-            <td>{meta.get('hostname', 'N/A')}</td>
-            <td>{meta.get('private_ip', 'N/A')}</td>
-            <td>{res.get('ComplianceStatus')}</td>
-            <td>{res.get('MissingCount')}</td>
-            <td>{res.get('InstalledPendingRebootCount')}</td>
-        </tr>
-        """
-
-    html_body = f"""
+        logger.error(f"{target_label(target)}: scan failed: {e}")
+        target['Error'] = str(e)
+    return target
+
+def store_results(target, run_time):
+    # Sets S3Key and ReportIds (the instances whose owners get a report)
+    results = target['Results']
+    target['ReportIds'] = list(results)
+    if INCREMENTAL_RESULTS:
+        prefix = INCREMENTAL_PREFIX
+        if target['Region']:
+            prefix = f"{INCREMENTAL_PREFIX}{target['AccountId']}/{target['Region']}/"
+        try:
+            change = record_incremental(s3, S3_BUCKET_NAME, results, run_time, prefix)
+            target['S3Key'] = change['Key']
+            logger.info(
+                f"{target_label(target)}: uploaded {'full snapshot' if change['Full'] else 'delta'} to "
+                f"s3://{S3_BUCKET_NAME}/{change['Key']} ({change['Bytes']} bytes): "
+                f"{len(change['Changed'])} changed, {len(change['Removed'])} removed"
+            )
+            changed_owners = {target['Instances'][iid].email for iid in change['Changed']}
+            target['ReportIds'] = [iid for iid in results if target['Instances'][iid].email in changed_owners]
+        except Exception as e:
+            logger.error(f"{target_label(target)}: incremental S3 upload failed, reporting to every owner: {e}")
+    else:
+        try:
+            written = write_results(
+                s3, S3_BUCKET_NAME, results, target['AccountId'], run_time, RESULTS_FORMAT,
+                region=target['Region'], logger=logger
+            )
+            target['S3Key'] = written['Key']
+            logger.info(
+                f"{target_label(target)}: uploaded {written['Rows']} results to "
+                f"s3://{S3_BUCKET_NAME}/{written['Key']} ({written['Bytes']} bytes)"
+            )
+        except Exception as e:
+            logger.error(f"{target_label(target)}: S3 upload failed: {e}")
+
+    if target['PatchIndex'] is not None:
+        try:
+            partition = partition_prefix(run_time.strftime("%Y-%m-%d"), target['AccountId'], target['Region'])
+            written = write_patch_index(s3, S3_BUCKET_NAME, target['PatchIndex'], partition, run_time)
+            logger.info(
+                f"{target_label(target)}: uploaded index of {written['Patches']} missing patches to "
+                f"s3://{S3_BUCKET_NAME}/{written['Key']} ({written['Bytes']} bytes)"
+            )
+        except Exception as e:
+            logger.error(f"{target_label(target)}: patch index upload failed: {e}")
+
+def non_compliant_count(results):
+    return sum(1 for res in results.values() if res.get('ComplianceStatus') != COMPLIANT)
+
+def severity(item):
+    # Ranks non-compliant hosts first (most missing + pending patches first), then errors, then compliant hosts
+    res = item[3]
+    if res.get('ComplianceStatus') == COMPLIANT:
+        return (0, 0)
+    counts = (res.get('MissingCount'), res.get('InstalledPendingRebootCount'))
+    return (1, sum(count for count in counts if isinstance(count, int)))
+
+def render_html_row(index, item):
+    _, iid, meta, res = item
+    return table_row(
+        (iid, meta.name, meta.hostname, meta.private_ip, res.get('ComplianceStatus'),
+         res.get('MissingCount'), res.get('InstalledPendingRebootCount')),
+        index
+    )
+
+def report_rows(items, sectioned=False):
+    # Generator, so a report is rendered row by row into its buffer; sectioned adds a heading row per account/region
+    current = None
+    for index, item in enumerate(items, start=1):
+        if sectioned and item[0] is not current:
+            current = item[0]
+            yield f'<tr><th colspan="8">{escape(target_label(current))}</th></tr>\n'
+        yield render_html_row(index, item)
+
+def render_target_summary(targets):
+    rows = "".join(
+        f"<tr><td>{escape(target['AccountName'])} ({target['AccountId']})</td><td>{escape(target['Region'])}</td>"
+        f"<td>{len(target['Results'])}</td><td>{non_compliant_count(target['Results'])}</td>"
+        f"<td>{escape('⚠️ ' + target['Error']) if target['Error'] else 'OK'}</td>"
+        f"<td>s3://{S3_BUCKET_NAME}/{escape(target['S3Key'])}</td></tr>"
+        for target in targets
+    )
+    return f"""
+      <table>
+        <thead>
+          <tr><th>Account</th><th>Region</th><th>Instances</th><th>Non-Compliant</th><th>Status</th><th>Results</th></tr>
+        </thead>
+        <tbody>{rows}</tbody>
+      </table>
+      <br/>
+    """
+
+def render_owner_summary(items, shown, report):
+    non_compliant = sum(1 for item in items if severity(item)[0])
+    missing = sum(severity(item)[1] for item in items)
+    summary = f"<p>{len(items)} instances, {non_compliant} non-compliant, {missing} missing or pending-reboot patches.</p>"
+    if shown < len(items):
+        if report:
+            link = f'<a href="{escape(report["Url"])}">full report ({len(items)} instances)</a>'
+        else:
+            link = "full report unavailable, see the logs"
+        summary += f"<p>Showing the {shown} most severe instances; {link}.</p>"
+    return summary
+
+def report_head(today, account_line, summary=""):
+    return f"""
     <html>
     <head>
       <style>
@@ -169,7 +320,8 @@ def lambda_handler(event, context):
     </head>
     <body>
       <h2>Aggregated Patch Scan Report - {today}</h2>
-      <p><strong>AWS Account:</strong> {account_name} ({account_id})</p>
+      <p><strong>AWS Account:</strong> {escape(account_line)}</p>
+      {summary}
       <table>
         <thead>
           <tr>
@@ -184,34 +336,127 @@ def lambda_handler(event, context):
           </tr>
         </thead>
         <tbody>
-          {html_table}
+"""
+
+def report_tail(footer):
+    return f"""
         </tbody>
       </table>
-      <p><i>Detailed results in S3: s3://{S3_BUCKET_NAME}/{s3_key}</i></p>
+      <p><i>{escape(footer)}</i></p>
     </body>
     </html>
     """
 
-    subject = f"[{account_name}] Patch Scan Report: {non_compliant_count} Non-Compliant Instances"
+def report_key(recipient, run_time):
+    # Hashed so owner addresses do not appear in object keys or links
+    digest = hashlib.sha256(recipient.encode('utf-8')).hexdigest()[:16]
+    return f"{REPORT_PREFIX}dt={run_time.strftime('%Y-%m-%d')}/{digest}-{run_time.strftime('%H%M%S')}.html.gz"
+
+def owner_report(recipient, items, targets, today, run_time):
+    """Returns (subject, html body) for one owner.
+
+    Items are ranked by severity; up to REPORT_ROW_CAP rows are inlined. Past
+    the cap the full report is streamed to S3 and linked from the summary.
+    """
+    ranked = rank_items(items, severity)
+    shown = ranked[:REPORT_ROW_CAP]
+    sectioned = bool(TARGETS)
+    if sectioned:
+        # The most severe hosts fleet-wide, displayed in one section per account/region (ranked within it)
+        position = {id(target): index for index, target in enumerate(targets)}
+        ranked.sort(key=lambda item: position[id(item[0])])
+        shown.sort(key=lambda item: position[id(item[0])])
+    non_compliant = sum(1 for item in items if severity(item)[0])
+
+    if sectioned:
+        accounts = len({target['AccountId'] for target in targets})
+        subject = f"[{accounts} accounts] Patch Scan Report: {non_compliant} Non-Compliant Instances"
+        account_line = f"{accounts} accounts, {len(targets)} account/region targets"
+        footer = "Detailed results in S3: see the Results column above"
+        target_summary = render_target_summary(targets)
+    else:
+        target = targets[0]
+        subject = f"[{target['AccountName']}] Patch Scan Report: {non_compliant} Non-Compliant Instances"
+        account_line = f"{target['AccountName']} ({target['AccountId']})"
+        footer = f"Detailed results in S3: s3://{S3_BUCKET_NAME}/{target['S3Key']}"
+        target_summary = ""
+
+    report = None
+    if len(shown) < len(ranked):
+        try:
+            with phase('ReportUpload'):
+                report = upload_report(
+                    s3, S3_BUCKET_NAME, report_key(recipient, run_time),
+                    report_head(today, account_line, target_summary), report_rows(ranked, sectioned), report_tail(footer),
+                    REPORT_LINK_EXPIRY
+                )
+            logger.info(f"Full report for {recipient}: {report['Rows']} rows, {report['Bytes']} bytes at {report['Key']}")
+        except Exception as e:
+            logger.error(f"Could not upload the full report for {recipient}: {e}")
+
+    summary = target_summary + render_owner_summary(items, len(shown), report)
+    html_body = render_report(report_head(today, account_line, summary), report_rows(shown, sectioned), report_tail(footer))
+    return subject, html_body
+
+@instrumented
+def lambda_handler(event, context):
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    run_time = datetime.datetime.utcnow()
+
+    if TARGETS:
+        # Bounded fan-out: total runtime follows the slowest target, not the sum of targets
+        logger.info(f"Scanning {len(TARGETS)} account/region targets, {MAX_PARALLEL_TARGETS} at a time")
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_TARGETS) as executor:
+            targets = list(executor.map(scan_entry, TARGETS))
+        failed = [target_label(target) for target in targets if target['Error']]
+        if failed:
+            logger.error(f"{len(failed)} of {len(targets)} targets failed: {failed}")
+    else:
+        account_id, account_name = get_account_details()
+        logger.info(f"Running in AWS Account: {account_name} ({account_id})")
+        target = new_target(account_id, account_name)
+        try:
+            scan_target(target, ec2, ssm)
+        except Exception as e:
+            logger.error(f"SSM SendCommand failed: {e}")
+            return {'statusCode': 500, 'body': 'Failed to send SSM command.'}
+        if not target['Instances']:
+            return {'statusCode': 200, 'body': 'No instances found for scan.'}
+        targets = [target]
 
-    for email in email_recipients:
-        if not is_email_subscribed(email):
-            try:
-                ddb.put_item(TableName=DDB_TABLE_NAME, Item={'Email': {'S': email}})
-            except Exception as e:
-                logger.warning(f"Could not add {email} to DynamoDB: {e}")
+    set_fleet_size(sum(len(target['Instances']) for target in targets))
+    for target in targets:
+        if target['Results']:
+            with phase('S3Upload'):
+                store_results(target, run_time)
+            logger.info(
+                f"{target_label(target)}: {non_compliant_count(target['Results'])} of "
+                f"{len(target['Results'])} instances are non-compliant"
+            )
 
+    # One HTML report per owner, containing only that owner's instances (grouped by target)
+    owners = group_by_recipient(
+        (target['Instances'][iid].email, (target, iid, target['Instances'][iid], target['Results'][iid]))
+        for target in targets for iid in target['ReportIds']
+    )
+    email_recipients = set(owners)
+
+    ddb_stats = {}
     try:
-        ses.send_email(
-            Source=SES_SENDER,
-            Destination={'ToAddresses': list(email_recipients)},
-            Message={
-                'Subject': {'Data': subject, 'Charset': 'UTF-8'},
-                'Body': {'Html': {'Data': html_body, 'Charset': 'UTF-8'}}
-            }
-        )
-        logger.info("Email sent to recipients.")
+        with phase('DynamoDB'):
+            added = ensure_subscribed(ddb, DDB_TABLE_NAME, email_recipients, ddb_stats)
+        logger.info(f"Subscriber registry: {len(added)} new emails, {ddb_stats.get('ApiCalls', 0)} DynamoDB calls")
     except Exception as e:
-        logger.error(f"SES send_email failed: {e}")
+        logger.warning(f"Could not add subscriber emails to DynamoDB: {e}")
+
+    emails = []
+    with phase('Reports'):
+        for recipient, items in owners.items():
+            subject, html_body = owner_report(recipient, items, targets, today, run_time)
+            emails.append(build_email([recipient], subject, html=html_body))
+
+    with phase('SES'):
+        email_stats = dispatch_emails(ses, SES_SENDER, emails, logger=logger)
+    logger.info(f"Patch scan reports sent to {len(email_recipients)} owners: {email_stats}")
 
     return {'statusCode': 200, 'body': 'Patch scan report sent.'}
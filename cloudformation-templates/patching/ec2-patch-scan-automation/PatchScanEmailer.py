@@ -1,91 +1,163 @@
-import boto3
 import os
-import json
+import collections
 import datetime
-import time
-import botocore
+import json
 import logging
 
+from patch_common.aws_clients import LazyClient
+from patch_common.command_tracker import send_command_chunked, wait_for_commands
+from patch_common.digests import MAX_DIGEST_BYTES, build_digests, part_suffix
+from patch_common.discovery import InstanceRecord, iter_tagged_instances
+from patch_common.metrics import instrumented, phase, set_fleet_size
+from patch_common.notifications import build_email, dispatch_bulk_templated, dispatch_emails
+from patch_common.patch_index import build_patch_index, merge_patch_indexes, non_compliant_ids, write_patch_index
+from patch_common.patch_states import fetch_patch_states
+from patch_common.results_writer import partition_prefix, write_results
+from patch_common.scan_planner import plan_scans
+from patch_common.scan_history import record_incremental
+from patch_common.sharding import (
+    LocalQueue, SqsQueue, build_shards, claim_reduce, completed_shards, read_partials, shard_done, write_partial
+)
+from patch_common.subscribers import ensure_subscribed
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ec2 = boto3.client('ec2')
-ssm = boto3.client('ssm')
-ddb = boto3.client('dynamodb')
-s3 = boto3.client('s3')
-ses = boto3.client('ses', region_name='ap-south-1')
+ec2 = LazyClient('ec2')
+ssm = LazyClient('ssm')
+ddb = LazyClient('dynamodb')
+s3 = LazyClient('s3')
+# Same region as the PatchScanReport template the stack creates (SES_REGION, default the function's own region)
+ses = LazyClient('ses', region_name=os.environ.get('SES_REGION') or os.environ.get('AWS_REGION'))
+sqs = LazyClient('sqs')
+lambda_client = LazyClient('lambda')
 
 DDB_TABLE_NAME = os.environ['DDB_TABLE_NAME']
 S3_BUCKET_NAME = os.environ['S3_BUCKET_NAME']
 SES_SENDER = os.environ['SES_SENDER']
+# 'individual': one formatted digest per owner, 'bulk': SendBulkTemplatedEmail with SES_TEMPLATE_NAME
+EMAIL_MODE = os.environ.get('EMAIL_MODE', 'individual')
+SES_TEMPLATE_NAME = os.environ.get('SES_TEMPLATE_NAME', 'PatchScanReport')
+BULK_DIGEST_BYTES = 200 * 1024  # keeps ReplacementTemplateData under the SES 256 KB limit
+SCAN_TIMEOUT = int(os.environ.get('SCAN_TIMEOUT', '240'))  # seconds
+# Reuse patch states from scans (by any process) newer than this many seconds; 0 scans every instance
+SCAN_MAX_AGE = int(os.environ.get('SCAN_MAX_AGE', '0'))
+# 'true': store only changes since the previous scan and mail only owners whose instances changed
+INCREMENTAL_RESULTS = os.environ.get('INCREMENTAL_RESULTS', 'false').lower() == 'true'
+RESULTS_FORMAT = os.environ.get('RESULTS_FORMAT', 'ndjson')  # 'ndjson' (gzip) or 'parquet'
+# 'true': also store an index of missing patches (patch id -> instances) next to the scan results
+PATCH_INDEX = os.environ.get('PATCH_INDEX', 'false').lower() == 'true'
+# Sharded mode: SHARD_SIZE > 0 makes the scheduled run a coordinator queueing shards of that many instances
+SHARD_SIZE = int(os.environ.get('SHARD_SIZE', '0'))
+SHARD_QUEUE_URL = os.environ.get('SHARD_QUEUE_URL', '')  # empty: shards run on LOCAL_WORKERS threads in this invocation
+SHARD_MAX_ATTEMPTS = int(os.environ.get('SHARD_MAX_ATTEMPTS', '3'))  # scans of one shard before it is reported as failed
+LOCAL_WORKERS = int(os.environ.get('LOCAL_WORKERS', '4'))
+SCAN_TAGS = {'PatchScanAutomation': 'Enabled', 'PatchScanAutomationWindow': 'Daily'}
 
-def is_email_subscribed(email):
-    try:
-        response = ddb.get_item(
-            TableName=DDB_TABLE_NAME,
-            Key={'Email': {'S': email}}
-        )
-        return 'Item' in response
-    except Exception as e:
-        logger.error(f"DynamoDB check error for {email}: {e}")
-        return False
+def render_instance_report(index, item):
+    instance, data = item
+    return (
+        f"{index}. Patch Scan Report for {instance.instance_id}\n"
+        f"Hostname: {instance.hostname}\n"
+        f"Private IP: {instance.private_ip}\n"
+        f"Missing Patches: {data.get('MissingCount', 0)}\n"
+        f"Pending Reboot Patches: {data.get('InstalledPendingRebootCount', 0)}\n"
+        f"Compliance Status: {data.get('ComplianceStatus', 'Unknown')}\n"
+        f"Operation Time: {data.get('OperationStartTime')} to {data.get('OperationEndTime')} UTC\n"
+    )
 
-def lambda_handler(event, context):
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
+def digest_totals(digest):
+    missing = sum(data.get('MissingCount', 0) for _, data in digest['Items'])
+    pending = sum(data.get('InstalledPendingRebootCount', 0) for _, data in digest['Items'])
+    return missing, pending
 
-    logger.info("Starting patch scan automation...")
+def digest_subject(digest):
+    missing, pending = digest_totals(digest)
+    return (
+        f"Patch Scan Report: {len(digest['Items'])} instances | "
+        f"Missing Patches: {missing} | Pending Reboot: {pending}{part_suffix(digest)}"
+    )
 
-    # Fetch EC2 instances with relevant tags
-    reservations = ec2.describe_instances(
-        Filters=[
-            {'Name': 'tag:PatchScanAutomation', 'Values': ['Enabled']},
-            {'Name': 'tag:PatchScanAutomationWindow', 'Values': ['Daily']},
-            {'Name': 'instance-state-name', 'Values': ['running']}  # Only running instances
+def digest_template_data(digest):
+    missing, pending = digest_totals(digest)
+    return {
+        'Count': len(digest['Items']),
+        'MissingCount': missing,
+        'PendingReboot': pending,
+        'PartSuffix': part_suffix(digest),
+        'Instances': [
+            {
+                'InstanceId': instance.instance_id,
+                'Hostname': instance.hostname,
+                'PrivateIp': instance.private_ip,
+                'MissingCount': data.get('MissingCount', 0),
+                'PendingReboot': data.get('InstalledPendingRebootCount', 0),
+                'ComplianceStatus': data.get('ComplianceStatus', 'Unknown'),
+                'StartTime': data.get('OperationStartTime'),
+                'EndTime': data.get('OperationEndTime')
+            }
+            for instance, data in digest['Items']
         ]
-    )['Reservations']
+    }
 
-    instance_ids = []
+def discover_instances():
     instance_map = {}
+    with phase('Discovery'):
+        for record in iter_tagged_instances(ec2, SCAN_TAGS, logger=logger):
+            instance_map[record.instance_id] = record
+    set_fleet_size(len(instance_map))
+    logger.info(f"{len(instance_map)} instances added for patch scan.")
+    return instance_map
 
-    for r in reservations:
-        for inst in r['Instances']:
-            iid = inst['InstanceId']
-            tags = {t['Key']: t['Value'] for t in inst.get('Tags', [])}
-            email = tags.get('PatchScanEmailAlert')
-            if email and "@" in email:
-                private_ip = inst.get('PrivateIpAddress', 'N/A')
-                hostname = inst.get('PrivateDnsName', 'N/A')
-                instance_ids.append(iid)
-                instance_map[iid] = {
-                    'email': email,
-                    'tags': tags,
-                    'private_ip': private_ip,
-                    'hostname': hostname
-                }
-                logger.info(f"Instance {iid} added for patch scan. Email: {email}, Private IP: {private_ip}")
-
-    if not instance_ids:
-        logger.info("No matching running instances found.")
-        return
+def scan_states(instance_ids):
+    """Patch states of `instance_ids`: recent ones reused (SCAN_MAX_AGE), the rest from a new scan. SendCommand errors are raised."""
+    to_scan = instance_ids
+    states = {}
+    if SCAN_MAX_AGE:
+        try:
+            with phase('ScanPlanning'):
+                to_scan, states, reasons = plan_scans(ssm, instance_ids, SCAN_MAX_AGE)
+            logger.info(
+                f"Reusing recent patch states for {len(states)} instances, scanning {len(to_scan)}: "
+                f"{dict(collections.Counter(reasons.values()))}"
+            )
+        except Exception as e:
+            logger.warning(f"Scan planning failed, scanning every instance: {e}")
 
-    try:
-        logger.info(f"Sending patch scan command to instances: {instance_ids}")
-        ssm.send_command(
-            InstanceIds=instance_ids,
-            DocumentName="AWS-RunPatchBaseline",
-            Parameters={"Operation": ["Scan"]}
-        )
-    except Exception as e:
-        logger.error(f"SendCommand failed: {e}")
-        return
+    if to_scan:
+        logger.info(f"Sending patch scan command to {len(to_scan)} instances")
+        with phase('SendCommand'):
+            commands = send_command_chunked(
+                ssm, to_scan,
+                DocumentName="AWS-RunPatchBaseline",
+                Parameters={"Operation": ["Scan"]}
+            )
 
-    time.sleep(20)  # Wait for scan to complete
+        # Wait for the scan to finish on every instance, or until SCAN_TIMEOUT
+        with phase('CommandWait'):
+            statuses, timed_out = wait_for_commands(ssm, commands, SCAN_TIMEOUT)
+        logger.info(f"Patch scan finished on {len(statuses)} instances")
+        if timed_out:
+            logger.warning(f"Patch scan did not finish within {SCAN_TIMEOUT}s on: {timed_out}")
 
+        stats = {}
+        try:
+            with phase('PatchStates'):
+                states.update(fetch_patch_states(ssm, to_scan, stats))
+            logger.info(f"Fetched {len(to_scan)} fresh patch states in {stats['ApiCalls']} calls ({stats['WallTime']:.2f}s)")
+        except Exception as e:
+            logger.error(f"Patch state fetch error: {e}")
+    return states
+
+def collect_results(instance_ids, states):
     results = {}
     for iid in instance_ids:
+        state = states.get(iid)
+        if state is None:
+            logger.error(f"No patch state reported for {iid}")
+            continue
         try:
-            state = ssm.describe_instance_patch_states(InstanceIds=[iid])['InstancePatchStates'][0]
             results[iid] = {
                 'ComplianceStatus': state.get('PatchComplianceStatus', 'Unknown'),
                 'MissingCount': state.get('MissingCount', 0),
@@ -97,63 +169,217 @@ def lambda_handler(event, context):
         except Exception as e:
             logger.error(f"Patch state error for {iid}: {e}")
             continue
+    return results
 
+def missing_patch_index(states):
+    # None when PATCH_INDEX is off or the index could not be built
+    if not PATCH_INDEX:
+        return None
+    try:
+        with phase('PatchIndex'):
+            index, errors = build_patch_index(ssm, non_compliant_ids(states))
+        if errors:
+            logger.warning(f"Could not read missing patches of {len(errors)} instances: {errors}")
+        return index
+    except Exception as e:
+        logger.error(f"Patch index error: {e}")
+        return None
+
+def report_results(results, instance_map, index, run_time, account_id):
     # Save results to S3
-    s3_key = f"scans/{today}-scan-results.json"
+    changed_owners = None
+    if INCREMENTAL_RESULTS:
+        try:
+            with phase('S3Upload'):
+                change = record_incremental(s3, S3_BUCKET_NAME, results, run_time)
+            changed_owners = {instance_map[iid].email for iid in change['Changed']}
+            logger.info(
+                f"Saved {'full snapshot' if change['Full'] else 'delta'} to S3 at {change['Key']} "
+                f"({change['Bytes']} bytes): {len(change['Changed'])} changed, {len(change['Removed'])} removed"
+            )
+        except Exception as e:
+            logger.error(f"Incremental S3 upload error, reporting to every owner: {e}")
+    else:
+        try:
+            with phase('S3Upload'):
+                written = write_results(
+                    s3, S3_BUCKET_NAME, results, account_id, run_time, RESULTS_FORMAT, logger=logger
+                )
+            logger.info(f"Saved {written['Rows']} scan results to S3 at {written['Key']} ({written['Bytes']} bytes)")
+        except Exception as e:
+            logger.error(f"S3 upload error: {e}")
+
+    if index is not None:
+        try:
+            with phase('PatchIndex'):
+                written = write_patch_index(
+                    s3, S3_BUCKET_NAME, index, partition_prefix(run_time.strftime("%Y-%m-%d"), account_id), run_time
+                )
+            logger.info(f"Saved index of {written['Patches']} missing patches to S3 at {written['Key']} ({written['Bytes']} bytes)")
+        except Exception as e:
+            logger.error(f"Patch index error: {e}")
+
+    if changed_owners is not None:
+        results = {iid: data for iid, data in results.items() if instance_map[iid].email in changed_owners}
+        logger.info(f"{len(changed_owners)} owners have instances whose patch state changed")
+
+    # One digest per owner, containing only that owner's instances
+    digests = build_digests(
+        ((instance_map[iid].email, (instance_map[iid], data)) for iid, data in results.items()),
+        render_instance_report,
+        BULK_DIGEST_BYTES if EMAIL_MODE == 'bulk' else MAX_DIGEST_BYTES
+    )
+
+    # Add emails to DDB if not subscribed
+    ddb_stats = {}
     try:
-        s3.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=json.dumps(results, indent=2),
-            ContentType="application/json"
-        )
-        logger.info(f"Saved scan results to S3 at {s3_key}")
+        with phase('DynamoDB'):
+            added = ensure_subscribed(ddb, DDB_TABLE_NAME, {digest['Recipient'] for digest in digests}, ddb_stats)
+        if added:
+            logger.info(f"Added new subscriber emails to DynamoDB: {sorted(added)}")
+        logger.info(f"Subscriber registry: {ddb_stats.get('ApiCalls', 0)} DynamoDB calls")
     except Exception as e:
-        logger.error(f"S3 upload error: {e}")
-
-    # Send email per instance
-    for iid, data in results.items():
-        email = instance_map[iid]['email']
-        private_ip = instance_map[iid]['private_ip']
-        hostname = instance_map[iid]['hostname']
-        missing = data.get('MissingCount', 0)
-        pending = data.get('InstalledPendingRebootCount', 0)
-        compliance = data.get('ComplianceStatus', 'Unknown')
-        start_time = data.get('OperationStartTime')
-        end_time = data.get('OperationEndTime')
-
-        subject = (
-            f"Patch Scan Report for {iid} | Private IP: {private_ip} | "
-            f"Missing Patches: {missing} | Pending Reboot: {pending}"
-        )
-
-        body = (
-            f"Patch Scan Report for {iid}\n\n"
-            f"Hostname: {hostname}\n"
-            f"Private IP: {private_ip}\n"
-            f"Missing Patches: {missing}\n"
-            f"Pending Reboot Patches: {pending}\n"
-            f"Compliance Status: {compliance}\n"
-            f"Operation Time: {start_time} to {end_time} UTC"
-        )
-
-        # Add email to DDB if not subscribed
-        if not is_email_subscribed(email):
+        logger.error(f"Error saving subscriber emails to DynamoDB: {e}")
+
+    with phase('SES'):
+        if EMAIL_MODE == 'bulk':
+            # Rendered by the stored SES template (PatchScanReportTemplate in the stack)
+            destinations = [(digest['Recipient'], digest_template_data(digest)) for digest in digests]
+            email_stats = dispatch_bulk_templated(ses, SES_SENDER, SES_TEMPLATE_NAME, destinations, logger=logger)
+        else:
+            emails = [
+                build_email([digest['Recipient']], digest_subject(digest), text="\n".join(digest['Rows']))
+                for digest in digests
+            ]
+            email_stats = dispatch_emails(ses, SES_SENDER, emails, logger=logger)
+    logger.info(f"Patch result digests for {len(results)} instances: {email_stats}")
+
+def coordinate(instance_map, context):
+    # Queue the fleet as shards; on SQS the worker storing the last shard starts the reduce, locally this invocation does
+    run_time = datetime.datetime.utcnow()
+    run_id = f"{run_time.strftime('%Y-%m-%dT%H-%M-%SZ')}-{context.aws_request_id[:8]}"
+    shards = build_shards(instance_map.values(), SHARD_SIZE)
+    items = [
+        {'Run': run_id, 'RunTime': run_time.isoformat(), 'Shard': n, 'Shards': len(shards), 'Instances': shard}
+        for n, shard in enumerate(shards)
+    ]
+    queue = SqsQueue(sqs, SHARD_QUEUE_URL) if SHARD_QUEUE_URL else LocalQueue()
+    with phase('Enqueue'):
+        queue.send(items)
+    logger.info(f"Run {run_id}: {len(instance_map)} instances queued as {len(shards)} shards of up to {SHARD_SIZE}")
+    if SHARD_QUEUE_URL:
+        return {'statusCode': 202, 'body': json.dumps({'run': run_id, 'shards': len(shards)})}
+
+    queue.drain(scan_shard, LOCAL_WORKERS, SHARD_MAX_ATTEMPTS + 1)
+    return reduce_run({'Run': run_id, 'RunTime': run_time.isoformat(), 'Shards': len(shards)}, context)
+
+def scan_shard(item, receives):
+    """Scan one work item and store its partial results; True when every shard of its run is stored.
+
+    A shard whose partial results already exist (a redelivery) is not
+    scanned again. On its last attempt a failing shard stores the error
+    instead of raising, so the run is still reduced and reports it.
+    """
+    run_id, shard = item['Run'], item['Shard']
+    if not shard_done(s3, S3_BUCKET_NAME, run_id, shard):
+        partial = {'Shard': shard, 'Instances': item['Instances'], 'Attempts': receives}
+        if receives > SHARD_MAX_ATTEMPTS:
+            # The previous delivery died (e.g. Lambda timeout) on the last attempt
+            partial['Error'] = f"no result after {SHARD_MAX_ATTEMPTS} attempts"
+        else:
+            instance_ids = [row[0] for row in item['Instances']]
             try:
-                ddb.put_item(TableName=DDB_TABLE_NAME, Item={'Email': {'S': email}})
-                logger.info(f"Added new subscriber email {email} to DynamoDB.")
+                states = scan_states(instance_ids)
+                partial['Results'] = collect_results(instance_ids, states)
+                partial['Index'] = missing_patch_index(states)
             except Exception as e:
-                logger.error(f"Error saving {email} to DynamoDB: {e}")
+                if receives < SHARD_MAX_ATTEMPTS:
+                    raise
+                partial['Error'] = str(e)
+        with phase('S3Upload'):
+            write_partial(s3, S3_BUCKET_NAME, run_id, shard, partial)
+        logger.info(f"Run {run_id} shard {shard}: {len(partial.get('Results', {}))} results stored (attempt {receives})")
+    return completed_shards(s3, S3_BUCKET_NAME, run_id) >= item['Shards']
 
+def handle_shards(records, context):
+    # SQS event source mapping with ReportBatchItemFailures: only the failed shards are delivered again
+    failures = []
+    instances = 0
+    for record in records:
         try:
-            ses.send_email(
-                Source=SES_SENDER,
-                Destination={'ToAddresses': [email]},
-                Message={
-                    'Subject': {'Data': subject},
-                    'Body': {'Text': {'Data': body}}
-                }
-            )
-            logger.info(f"Sent patch result for {iid} to {email}")
-        except botocore.exceptions.ClientError as e:
-            logger.error(f"SES error for {iid}: {e.response['Error']['Message']}")
+            item = json.loads(record['body'])
+            # A worker's fleet is the hosts of the shards it was handed, not the whole run
+            instances += len(item['Instances'])
+            set_fleet_size(instances)
+            if scan_shard(item, int(record['attributes']['ApproximateReceiveCount'])):
+                lambda_client.invoke(
+                    FunctionName=context.function_name,
+                    InvocationType='Event',
+                    Payload=json.dumps({'Reduce': {'Run': item['Run'], 'RunTime': item['RunTime'], 'Shards': item['Shards']}})
+                )
+        except Exception as e:
+            logger.error(f"Shard {record['messageId']} failed, it will be retried: {e}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
+def reduce_run(run, context):
+    run_id = run['Run']
+    # Workers finishing together may each start a reduce; only the first one to claim the run goes on
+    if not claim_reduce(s3, S3_BUCKET_NAME, run_id):
+        logger.info(f"Run {run_id} is already reduced by another invocation")
+        return
+    with phase('Reduce'):
+        partials = read_partials(s3, S3_BUCKET_NAME, run_id, run['Shards'])
+        instance_map = {}
+        results = {}
+        indexes = []
+        failed = {}
+        for shard, partial in enumerate(partials):
+            if partial is None:
+                failed[shard] = 'no partial results stored'
+                continue
+            instance_map.update((row[0], InstanceRecord(*row)) for row in partial['Instances'])
+            results.update(partial.get('Results', {}))
+            if partial.get('Error'):
+                failed[shard] = partial['Error']
+            if partial.get('Index') is not None:
+                indexes.append(partial['Index'])
+    set_fleet_size(len(instance_map))
+    logger.info(f"Run {run_id}: merged {len(results)} results of {len(instance_map)} instances from {len(partials)} shards")
+    if failed:
+        logger.error(f"Run {run_id}: {len(failed)} shards failed, their instances are not reported: {failed}")
+
+    index = merge_patch_indexes(indexes) if PATCH_INDEX else None
+    report_results(
+        results, instance_map, index, datetime.datetime.fromisoformat(run['RunTime']),
+        context.invoked_function_arn.split(':')[4]
+    )
+
+@instrumented
+def lambda_handler(event, context):
+    if 'Records' in event:
+        return handle_shards(event['Records'], context)
+    if 'Reduce' in event:
+        return reduce_run(event['Reduce'], context)
+
+    logger.info("Starting patch scan automation...")
+
+    # Fetch EC2 instances with relevant tags
+    instance_map = discover_instances()
+    if not instance_map:
+        logger.info("No matching running instances found.")
+        return
+    if SHARD_SIZE:
+        return coordinate(instance_map, context)
+
+    instance_ids = list(instance_map)
+    try:
+        states = scan_states(instance_ids)
+    except Exception as e:
+        logger.error(f"SendCommand failed: {e}")
+        return
+    results = collect_results(instance_ids, states)
+    index = missing_patch_index(states)
+    report_results(
+        results, instance_map, index, datetime.datetime.utcnow(), context.invoked_function_arn.split(':')[4]
+    )
@@ -1,43 +1,65 @@
-import boto3
 import json
+import os
 import time
 
-ssm_client = boto3.client('ssm')
-ec2_client = boto3.client('ec2')
-ses_client = boto3.client('ses')
+from patch_common.aws_clients import LazyClient
+from patch_common.command_tracker import TERMINAL_STATUSES
+from patch_common.digests import build_digests, part_suffix
+from patch_common.discovery import iter_tagged_instances, valid_email
+from patch_common.metrics import instrumented, phase, set_fleet_size
+from patch_common.notifications import build_email, dispatch_emails
+from patch_common.patch_index import build_patch_index, instances_for_patches, load_patch_index, non_compliant_ids
+from patch_common.patch_states import fetch_patch_states
+from patch_common.rollout import advance_rollout, new_rollout, plan_waves, skipped_instances
+
+ssm_client = LazyClient('ssm')
+ec2_client = LazyClient('ec2')
+ses_client = LazyClient('ses')
+s3_client = LazyClient('s3')
+lambda_client = LazyClient('lambda')
 
 SENDER_EMAIL = 'no-reply@piramal.info'
 TAG_KEY = 'PatchDeployAutomation'
 TAG_VALUE = 'Enabled'
 EMAIL_TAG = 'PatchScanEmailAlert'
-POLL_INTERVAL = 30
-MAX_WAIT_TIME = 900  # seconds
+MAX_WAIT_TIME = int(os.environ.get('ROLLOUT_TIMEOUT', '14400'))  # seconds for the whole rollout
+PATCH_COMMENT = 'Patch triggered by Lambda'
+STATUS_CHANGE_EVENT = 'EC2 Command Invocation Status-change Notification'
+# 'poll': track the command in-process, re-invoking this Lambda before it times out
+# 'events': return after SendCommand, post-patch reports come from EventBridge events, one email per host and event
+COMPLETION_MODE = os.environ.get('COMPLETION_MODE', 'poll')
+RESUME_MARGIN = 60  # seconds left in the invocation when tracking hands over
+# Wave rollout: canary, then waves growing by ROLLOUT_GROWTH; the next wave starts once
+# ROLLOUT_SUCCESS_THRESHOLD of the previous one succeeded, new waves stop past ROLLOUT_FAILURE_BUDGET
+ROLLOUT_CANARY_SIZE = int(os.environ.get('ROLLOUT_CANARY_SIZE', '1'))
+ROLLOUT_GROWTH = int(os.environ.get('ROLLOUT_GROWTH', '2'))
+ROLLOUT_MAX_WAVE = int(os.environ.get('ROLLOUT_MAX_WAVE', '200'))
+ROLLOUT_SUCCESS_THRESHOLD = float(os.environ.get('ROLLOUT_SUCCESS_THRESHOLD', '0.9'))
+ROLLOUT_FAILURE_BUDGET = float(os.environ.get('ROLLOUT_FAILURE_BUDGET', '0.1'))
+ROLLOUT_GROUP_BY = os.environ.get('ROLLOUT_GROUP_BY', 'none')  # 'none', 'name' or 'az'
+MAX_CONCURRENCY = os.environ.get('MAX_CONCURRENCY', '50')  # per SendCommand chunk
+MAX_ERRORS = os.environ.get('MAX_ERRORS', '25%')
+PATCH_COMMAND = {
+    'DocumentName': 'AWS-RunPatchBaseline',
+    'Parameters': {'Operation': ['Install']},
+    'TimeoutSeconds': 900,
+    'Comment': PATCH_COMMENT,
+    'MaxConcurrency': MAX_CONCURRENCY,
+    'MaxErrors': MAX_ERRORS
+}
+GROUP_KEYS = {
+    'name': lambda instance: instance.name,
+    'az': lambda instance: instance.availability_zone
+}
 
 def get_tagged_instances():
-    instances = []
-    response = ec2_client.describe_instances(
-        Filters=[
-            {'Name': f'tag:{TAG_KEY}', 'Values': [TAG_VALUE]},
-            {'Name': 'instance-state-name', 'Values': ['running']}
-        ]
-    )
-    for reservation in response['Reservations']:
-        for instance in reservation['Instances']:
-            email = None
-            for tag in instance.get('Tags', []):
-                if tag['Key'] == EMAIL_TAG:
-                    email = tag['Value']
-            if email:
-                instances.append({
-                    'InstanceId': instance['InstanceId'],
-                    'PrivateIp': instance.get('PrivateIpAddress'),
-                    'Hostname': instance.get('PrivateDnsName'),
-                    'Email': email
-                })
+    with phase('Discovery'):
+        # Hosts with a malformed email tag are still patched, only their reports are skipped
+        instances = list(iter_tagged_instances(ec2_client, {TAG_KEY: TAG_VALUE}, EMAIL_TAG, valid_emails_only=False))
+    set_fleet_size(len(instances))
     return instances
 
-def get_patch_state(instance_id):
-    state = ssm_client.describe_instance_patch_states(InstanceIds=[instance_id])['InstancePatchStates'][0]
+def to_patch_data(state):
     return {
         'MissingPatches': state.get('MissingCount', 0),
         'PendingReboot': state.get('InstalledPendingRebootCount', 0),
@@ -46,86 +68,198 @@ def get_patch_state(instance_id):
         'OperationEnd': state.get('OperationEndTime', '')
     }
 
-def send_email(instance, patch_data, stage):
-    subject = f"Patch Scan Report for {instance['InstanceId']} | Private IP: {instance['PrivateIp']} | Missing Patches: {patch_data['MissingPatches']} | Pending Reboot: {patch_data['PendingReboot']}"
-    body = f"""
-Patch {stage} Report for {instance['InstanceId']}
-
-Hostname: {instance['Hostname']}
-Private IP: {instance['PrivateIp']}
+def render_report(index, item):
+    instance, patch_data = item
+    return f"""{index}. {instance.instance_id}
+Hostname: {instance.hostname}
+Private IP: {instance.private_ip}
 Missing Patches: {patch_data['MissingPatches']}
 Pending Reboot Patches: {patch_data['PendingReboot']}
 Compliance Status: {patch_data['ComplianceStatus']}
 Operation Time: {patch_data['OperationStart']} to {patch_data['OperationEnd']} UTC
 """
-    ses_client.send_email(
-        Source=SENDER_EMAIL,
-        Destination={'ToAddresses': [instance['Email']]},
-        Message={
-            'Subject': {'Data': subject},
-            'Body': {'Text': {'Data': body}}
+
+def send_reports(reports, stage):
+    # One digest per PatchScanEmailAlert owner instead of one email per instance
+    for instance, _ in reports:
+        if not valid_email(instance.email):
+            print(f"No {stage} report for {instance.instance_id}: invalid {EMAIL_TAG} tag {instance.email!r}")
+    reports = [(instance, data) for instance, data in reports if valid_email(instance.email)]
+    digests = build_digests(((instance.email, (instance, data)) for instance, data in reports), render_report)
+    emails = []
+    for digest in digests:
+        missing = sum(data['MissingPatches'] for _, data in digest['Items'])
+        pending = sum(data['PendingReboot'] for _, data in digest['Items'])
+        subject = f"Patch {stage} Report: {len(digest['Items'])} instances | Missing Patches: {missing} | Pending Reboot: {pending}{part_suffix(digest)}"
+        body = f"Patch {stage} Report\n\n" + "\n".join(digest['Rows'])
+        emails.append(build_email([digest['Recipient']], subject, text=body))
+    with phase('SES'):
+        stats = dispatch_emails(ses_client, SENDER_EMAIL, emails)
+    print(f"{stage} reports for {len(reports)} instances in {len(emails)} emails: {stats}")
+
+def send_post_patch_reports(instances_by_id, done):
+    # A host stopped, terminated or untagged since the rollout started is not rediscovered on resume: no report for it
+    with phase('PatchStates'):
+        states = fetch_patch_states(ssm_client, [iid for iid in done if iid in instances_by_id])
+    reports = []
+    for iid, status in done.items():
+        if iid not in instances_by_id:
+            print(f"Patch command finished on {iid}: {status} (no longer running and tagged, not reported)")
+            continue
+        if iid in states:
+            reports.append((instances_by_id[iid], to_patch_data(states[iid])))
+        print(f"Patch command finished on {iid}: {status}")
+    send_reports(reports, "Post-Patch")
+
+def run_rollout(rollout, instances, started_at, context, command=PATCH_COMMAND):
+    instances_by_id = {i.instance_id: i for i in instances}
+    deadline = started_at + MAX_WAIT_TIME
+    if context:
+        deadline = min(deadline, time.time() + context.get_remaining_time_in_millis() / 1000 - RESUME_MARGIN)
+
+    with phase('Rollout'):
+        advance_rollout(
+            ssm_client, rollout, command,
+            # In events mode post-patch reports come from status events; the rollout is still gated here
+            on_complete=(lambda done: send_post_patch_reports(instances_by_id, done)) if COMPLETION_MODE == 'poll' else None,
+            deadline=deadline,
+            clock=time.time,
+            success_threshold=ROLLOUT_SUCCESS_THRESHOLD,
+            failure_budget=ROLLOUT_FAILURE_BUDGET
+        )
+    pending = sorted(iid for ids in rollout['Commands'].values() for iid in ids)
+    unfinished = pending or (not rollout['Halted'] and skipped_instances(rollout))
+
+    if unfinished and context and time.time() < started_at + MAX_WAIT_TIME:
+        # Hand the rollout to a fresh invocation instead of hitting the Lambda timeout
+        lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'Resume': {'Rollout': rollout, 'StartedAt': started_at, 'Command': command}})
+        )
+        return {
+            'statusCode': 202,
+            'body': json.dumps({
+                'message': 'Patch rollout continues in a new invocation.',
+                'wavesLaunched': rollout['Launched'],
+                'waves': len(rollout['Waves']),
+                'finishedInstances': sorted(rollout['Statuses']),
+                'pendingInstances': pending
+            })
         }
-    )
 
-def wait_for_command(command_id, instance_id):
-    elapsed = 0
-    while elapsed < MAX_WAIT_TIME:
-        time.sleep(POLL_INTERVAL)
-        elapsed += POLL_INTERVAL
-        invocations = ssm_client.list_command_invocations(
-            CommandId=command_id,
-            InstanceId=instance_id,
-            Details=True
-        )['CommandInvocations']
-        if invocations and invocations[0]['Status'] in ['Success', 'Failed', 'Cancelled', 'TimedOut']:
-            return invocations[0]['Status']
-    return "TimedOut"
+    if pending and COMPLETION_MODE == 'poll':
+        send_post_patch_reports(instances_by_id, {iid: 'TimedOut' for iid in pending})
+    if rollout['Halted']:
+        print(f"Patch rollout halted after {rollout['Launched']} of {len(rollout['Waves'])} waves: {rollout['Halted']}")
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Patch rollout halted.' if rollout['Halted'] else 'Patch workflow complete.',
+            'haltReason': rollout['Halted'],
+            'patchedInstances': sorted(iid for iid, status in rollout['Statuses'].items() if status == 'Success'),
+            'failedInstances': sorted(iid for iid, status in rollout['Statuses'].items() if status != 'Success'),
+            'skippedInstances': skipped_instances(rollout),
+            'timedOutInstances': pending
+        })
+    }
+
+def resume_rollout(resume, context):
+    rollout = resume['Rollout']
+    ids = {iid for wave in rollout['Waves'] for iid in wave}
+    instances = [i for i in get_tagged_instances() if i.instance_id in ids]
+    return run_rollout(rollout, instances, resume['StartedAt'], context, resume.get('Command', PATCH_COMMAND))
+
+def handle_status_change(detail):
+    # One event per host, so events mode sends a single-instance report rather than an owner digest
+    if detail.get('document-name') != 'AWS-RunPatchBaseline' or detail.get('status') not in TERMINAL_STATUSES:
+        return {'statusCode': 200, 'body': 'Ignored status change.'}
+
+    # Only report on commands sent by this Lambda, not scans from other automation
+    commands = ssm_client.list_commands(CommandId=detail['command-id'])['Commands']
+    if not commands or commands[0].get('Comment') != PATCH_COMMENT:
+        return {'statusCode': 200, 'body': 'Ignored status change.'}
 
+    instances = list(iter_tagged_instances(
+        ec2_client, {TAG_KEY: TAG_VALUE}, EMAIL_TAG, instance_ids=[detail['instance-id']], valid_emails_only=False
+    ))
+    if not instances:
+        return {'statusCode': 200, 'body': 'Instance is not tagged for patching.'}
+
+    send_post_patch_reports({i.instance_id: i for i in instances}, {detail['instance-id']: detail['status']})
+    return {'statusCode': 200, 'body': f"Post-Patch report sent for {detail['instance-id']}."}
+
+def patch_command(install_override_list=None):
+    # InstallOverrideList (S3/HTTPS URL of a patch list) limits Install to those patches instead of the whole baseline
+    if not install_override_list:
+        return PATCH_COMMAND
+    return dict(PATCH_COMMAND, Parameters=dict(PATCH_COMMAND['Parameters'], InstallOverrideList=[install_override_list]))
+
+def hosts_missing_patches(patch_ids, states, patch_index=None):
+    """Instance ids missing (or failing) any of `patch_ids`.
+
+    Reads the index a scan stored (patch_index = {'Bucket', 'Key'}) or
+    builds one from DescribeInstancePatches on the non-compliant hosts.
+    """
+    with phase('PatchIndex'):
+        if patch_index:
+            index = load_patch_index(s3_client, patch_index['Bucket'], patch_index['Key'])
+        else:
+            index, errors = build_patch_index(ssm_client, non_compliant_ids(states))
+            if errors:
+                print(f"Could not read patches of {len(errors)} instances: {errors}")
+    print(f"Patch index: {len(index)} distinct patches")
+    return set(instances_for_patches(index, patch_ids))
+
+@instrumented
 def lambda_handler(event, context):
+    if event.get('detail-type') == STATUS_CHANGE_EVENT:
+        return handle_status_change(event['detail'])
+    if 'Resume' in event:
+        return resume_rollout(event['Resume'], context)
+
     all_instances = get_tagged_instances()
     if not all_instances:
         return {'statusCode': 200, 'body': 'No tagged instances found.'}
 
-    compliance = ssm_client.describe_instance_patch_states(
-        InstanceIds=[i['InstanceId'] for i in all_instances]
-    )
+    stats = {}
+    with phase('PatchStates'):
+        states = fetch_patch_states(ssm_client, [i.instance_id for i in all_instances], stats)
+
+    # Event {'PatchIds': [KB/package ids]} patches only the hosts missing those patches
+    patch_ids = event.get('PatchIds')
+    targeted = hosts_missing_patches(patch_ids, states, event.get('PatchIndex')) if patch_ids else None
 
     non_compliant = []
-    for state in compliance['InstancePatchStates']:
-        if state.get('CriticalNonCompliantCount', 0) > 0 or state.get('SecurityNonCompliantCount', 0) > 0:
-            for i in all_instances:
-                if i['InstanceId'] == state['InstanceId']:
-                    patch_data = get_patch_state(i['InstanceId'])
-                    send_email(i, patch_data, "Pre-Patch")
-                    non_compliant.append(i)
+    reports = []
+    for i in all_instances:
+        state = states.get(i.instance_id)
+        if targeted is not None:
+            selected = i.instance_id in targeted and state is not None
+        else:
+            selected = state and (state.get('CriticalNonCompliantCount', 0) > 0 or state.get('SecurityNonCompliantCount', 0) > 0)
+        if selected:
+            reports.append((i, to_patch_data(state)))
+            non_compliant.append(i)
+    send_reports(reports, "Pre-Patch")
 
     if not non_compliant:
+        if targeted is not None:
+            return {'statusCode': 200, 'body': f"No tagged instance is missing {patch_ids}."}
         return {'statusCode': 200, 'body': 'All tagged instances are compliant.'}
 
-    ids_to_patch = [i['InstanceId'] for i in non_compliant]
-    command = ssm_client.send_command(
-        InstanceIds=ids_to_patch,
-        DocumentName='AWS-RunPatchBaseline',
-        Parameters={'Operation': ['Install']},
-        TimeoutSeconds=900,
-        Comment='Patch triggered by Lambda'
-    )
-
-    for instance in non_compliant:
-        wait_for_command(command['Command']['CommandId'], instance['InstanceId'])
-        updated_patch_data = get_patch_state(instance['InstanceId'])
-        send_email(instance, updated_patch_data, "Post-Patch")
-
-    return {
-        'statusCode': 200,
-        'body': json.dumps({
-            'message': 'Patch workflow complete.',
-            'patchedInstances': ids_to_patch,
-            'commandId': command['Command']['CommandId']
-        })
-    }
-
+    print(f"DescribeInstancePatchStates: {stats['ApiCalls']} calls in {stats['WallTime']:.2f}s")
 
+    group_key = GROUP_KEYS.get(ROLLOUT_GROUP_BY)
+    instances_by_id = {i.instance_id: i for i in non_compliant}
+    waves = plan_waves(
+        list(instances_by_id),
+        group_of=(lambda iid: group_key(instances_by_id[iid])) if group_key else None,
+        canary_size=ROLLOUT_CANARY_SIZE,
+        growth=ROLLOUT_GROWTH,
+        max_wave=ROLLOUT_MAX_WAVE
+    )
+    print(f"Patching {len(non_compliant)} instances in {len(waves)} waves: {[len(wave) for wave in waves]}")
 
-CloudShell
-Feedback
+    return run_rollout(new_rollout(waves), non_compliant, time.time(), context, patch_command(event.get('InstallOverrideList')))
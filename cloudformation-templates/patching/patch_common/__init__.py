@@ -0,0 +1,2 @@
+# Shared helpers for the patch scan / patch deploy Lambdas.
+# Packaged as a Lambda layer, see patching/Readme.md.
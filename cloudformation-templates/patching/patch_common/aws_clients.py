@@ -0,0 +1,50 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+from patch_common.metrics import instrument_client
+
+MAX_POOL_CONNECTIONS = 32  # at least the widest thread pool using one client (dispatch, fan-out, describe calls)
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 30    # seconds
+MAX_ATTEMPTS = 8
+
+# Adaptive mode adds client-side rate limiting on top of the standard throttling retry policy
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS}
+)
+
+# (service, region) -> client, shared by every module for the life of the container
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service, region_name=None):
+    client = _clients.get((service, region_name))
+    if client is None:
+        with _lock:
+            client = _clients.get((service, region_name))
+            if client is None:
+                client = instrument_client(boto3.client(service, region_name=region_name, config=CLIENT_CONFIG))
+                _clients[(service, region_name)] = client
+    return client
+
+
+class LazyClient:
+    """Module-level stand-in for a boto3 client.
+
+    The real client is built by get_client on first attribute access, so a
+    handler that returns early never pays for clients it did not use, and
+    warm invocations reuse the cached client and its connection pool.
+    """
+
+    def __init__(self, service, region_name=None):
+        self._service = service
+        self._region_name = region_name
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service, self._region_name), name)
@@ -0,0 +1,83 @@
+import time
+
+TERMINAL_STATUSES = ('Success', 'Failed', 'Cancelled', 'TimedOut')
+MIN_POLL_INTERVAL = 5   # seconds
+MAX_POLL_INTERVAL = 60  # seconds
+BACKOFF_FACTOR = 2
+PAGE_SIZE = 50  # ListCommandInvocations maximum
+MAX_IDS_PER_COMMAND = 50  # SendCommand InstanceIds limit
+
+
+def send_command_chunked(ssm_client, instance_ids, **kwargs):
+    # Returns {command_id: [instance ids]}, one command per 50 instances
+    commands = {}
+    for start in range(0, len(instance_ids), MAX_IDS_PER_COMMAND):
+        chunk = list(instance_ids[start:start + MAX_IDS_PER_COMMAND])
+        command_id = ssm_client.send_command(InstanceIds=chunk, **kwargs)['Command']['CommandId']
+        commands[command_id] = chunk
+    return commands
+
+
+def list_invocation_statuses(ssm_client, command_id):
+    # One paginated listing covers every instance the command was sent to
+    statuses = {}
+    paginator = ssm_client.get_paginator('list_command_invocations')
+    for page in paginator.paginate(CommandId=command_id, PaginationConfig={'PageSize': PAGE_SIZE}):
+        for invocation in page['CommandInvocations']:
+            statuses[invocation['InstanceId']] = invocation['Status']
+    return statuses
+
+
+def track_commands(ssm_client, commands, on_complete=None, deadline=None,
+                   clock=time.monotonic, sleep=time.sleep,
+                   min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+    """Wait for every invocation in `commands` ({command_id: [instance ids]}) to finish.
+
+    Each tick lists all invocations of each unfinished command at once. The
+    interval is reset to `min_interval` whenever a host finishes and doubles
+    (up to `max_interval`) while nothing changes. `on_complete` is called
+    with {instance_id: status} for the hosts that finished in that tick.
+    Tracking stops once `deadline` (a `clock()` value) has passed.
+
+    Returns ({instance_id: status} for finished hosts, [pending instance ids]).
+    """
+    pending = {command_id: set(ids) for command_id, ids in commands.items() if ids}
+    finished = {}
+    interval = min_interval
+    while pending:
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
+            sleep(min(interval, remaining))
+        else:
+            sleep(interval)
+        done = {}
+        for command_id in list(pending):
+            statuses = list_invocation_statuses(ssm_client, command_id)
+            for iid in pending[command_id]:
+                if statuses.get(iid) in TERMINAL_STATUSES:
+                    done[iid] = statuses[iid]
+            pending[command_id].difference_update(done)
+            if not pending[command_id]:
+                del pending[command_id]
+        if done:
+            finished.update(done)
+            if on_complete:
+                on_complete(done)
+            interval = min_interval
+        else:
+            interval = min(interval * BACKOFF_FACTOR, max_interval)
+    return finished, sorted(iid for ids in pending.values() for iid in ids)
+
+
+def track_command(ssm_client, command_id, instance_ids, **kwargs):
+    return track_commands(ssm_client, {command_id: instance_ids}, **kwargs)
+
+
+def wait_for_commands(ssm_client, commands, timeout, clock=time.monotonic, **kwargs):
+    """Block until every host in `commands` is terminal or `timeout` seconds pass.
+
+    Returns ({instance_id: status}, [instance ids that timed out]).
+    """
+    return track_commands(ssm_client, commands, deadline=clock() + timeout, clock=clock, **kwargs)
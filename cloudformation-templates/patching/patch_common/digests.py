@@ -0,0 +1,58 @@
+import collections
+
+# SES caps a message at 10 MB after encoding; keep the rendered rows well below it
+MAX_DIGEST_BYTES = 4 * 1024 * 1024
+
+
+def group_by_recipient(items):
+    # items: iterable of (recipient, item), grouped in first-seen order
+    groups = collections.OrderedDict()
+    for recipient, item in items:
+        groups.setdefault(recipient, []).append(item)
+    return groups
+
+
+def split_by_size(rows, max_bytes=MAX_DIGEST_BYTES):
+    part = []
+    size = 0
+    for row in rows:
+        row_size = len(row.encode('utf-8'))
+        if part and size + row_size > max_bytes:
+            yield part
+            part = []
+            size = 0
+        part.append(row)
+        size += row_size
+    if part:
+        yield part
+
+
+def build_digests(items, render_row, max_bytes=MAX_DIGEST_BYTES):
+    """Group `items` ([(recipient, item)]) into one digest per recipient.
+
+    `render_row(index, item)` renders one item (index starts at 1 for each
+    recipient). A recipient whose rendered rows exceed `max_bytes` gets
+    several parts. Returns a list of dicts with Recipient, Part, Parts,
+    Items and Rows.
+    """
+    digests = []
+    for recipient, group in group_by_recipient(items).items():
+        rendered = [render_row(index, item) for index, item in enumerate(group, start=1)]
+        parts = []
+        start = 0
+        for rows in split_by_size(rendered, max_bytes):
+            parts.append((group[start:start + len(rows)], rows))
+            start += len(rows)
+        for number, (part_items, rows) in enumerate(parts, start=1):
+            digests.append({
+                'Recipient': recipient,
+                'Part': number,
+                'Parts': len(parts),
+                'Items': part_items,
+                'Rows': rows
+            })
+    return digests
+
+
+def part_suffix(digest):
+    return f" (part {digest['Part']}/{digest['Parts']})" if digest['Parts'] > 1 else ""
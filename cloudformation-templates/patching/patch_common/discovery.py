@@ -0,0 +1,72 @@
+import collections
+
+EMAIL_TAG = 'PatchScanEmailAlert'
+PAGE_SIZE = 1000  # DescribeInstances maximum
+
+# One compact record per instance instead of the raw DescribeInstances payload
+InstanceRecord = collections.namedtuple(
+    'InstanceRecord', ['instance_id', 'private_ip', 'hostname', 'email', 'name', 'availability_zone']
+)
+
+
+def build_filters(tags, email_tag=EMAIL_TAG, instance_ids=None):
+    # Tag values, the email tag and the running state are all filtered server side
+    filters = [{'Name': f'tag:{key}', 'Values': [value]} for key, value in tags.items()]
+    filters.append({'Name': 'tag-key', 'Values': [email_tag]})
+    filters.append({'Name': 'instance-state-name', 'Values': ['running']})
+    if instance_ids:
+        filters.append({'Name': 'instance-id', 'Values': list(instance_ids)})
+    return filters
+
+
+def valid_email(address):
+    return bool(address) and "@" in address
+
+
+def to_record(instance, email_tag=EMAIL_TAG):
+    email = None
+    name = 'N/A'
+    for tag in instance.get('Tags', []):
+        if tag['Key'] == email_tag:
+            email = tag['Value']
+        elif tag['Key'] == 'Name':
+            name = tag['Value']
+    if not email:
+        return None
+    return InstanceRecord(
+        instance_id=instance['InstanceId'],
+        private_ip=instance.get('PrivateIpAddress', 'N/A'),
+        hostname=instance.get('PrivateDnsName', 'N/A'),
+        email=email,
+        name=name,
+        availability_zone=instance.get('Placement', {}).get('AvailabilityZone', 'N/A')
+    )
+
+
+def iter_tagged_instances(ec2_client, tags, email_tag=EMAIL_TAG, page_size=PAGE_SIZE, instance_ids=None,
+                          valid_emails_only=True, logger=None):
+    """Yield an InstanceRecord for every running instance matching all of `tags`.
+
+    Pages are streamed through the DescribeInstances paginator, so only one
+    page of raw API output is held in memory at a time. `instance_ids`
+    narrows the lookup to specific (still tagged) instances. An instance
+    whose email tag is not an address is logged, and skipped unless
+    `valid_emails_only` is False.
+    """
+    paginator = ec2_client.get_paginator('describe_instances')
+    pages = paginator.paginate(
+        Filters=build_filters(tags, email_tag, instance_ids),
+        PaginationConfig={'PageSize': page_size}
+    )
+    for page in pages:
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                record = to_record(instance, email_tag)
+                if not record:
+                    continue
+                if not valid_email(record.email):
+                    if logger:
+                        logger.warning(f"Instance {record.instance_id} has an invalid {email_tag} tag: {record.email!r}")
+                    if valid_emails_only:
+                        continue
+                yield record
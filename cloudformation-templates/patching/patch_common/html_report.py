@@ -0,0 +1,66 @@
+import gzip
+import html
+import io
+import tempfile
+
+REPORT_ROW_CAP = 500  # rows inlined in an email; larger reports inline only the top offenders
+LINK_EXPIRY = 7 * 24 * 3600  # seconds, the SigV4 maximum for presigned URLs
+SPOOL_BYTES = 1024 * 1024  # compressed report size kept in memory before spilling to /tmp
+
+
+def escape(value):
+    return html.escape(str(value))
+
+
+def table_row(values, index=None):
+    cells = "".join(f"<td>{escape(value)}</td>" for value in values)
+    return f"<tr><td>{index}</td>{cells}</tr>\n" if index is not None else f"<tr>{cells}</tr>\n"
+
+
+def rank_items(items, severity):
+    # Most severe first; stable, so hosts of equal severity keep their original order
+    return sorted(items, key=severity, reverse=True)
+
+
+def write_report(out, head, rows, tail):
+    """Stream `head`, every string in `rows` (any iterable) and `tail` into the text stream `out`."""
+    out.write(head)
+    count = 0
+    for row in rows:
+        out.write(row)
+        count += 1
+    out.write(tail)
+    return count
+
+
+def render_report(head, rows, tail):
+    buffer = io.StringIO()
+    write_report(buffer, head, rows, tail)
+    return buffer.getvalue()
+
+
+def upload_report(s3_client, bucket, key, head, rows, tail, expires_in=LINK_EXPIRY):
+    """Gzip the report into a spooled temp file, upload it and return a presigned GET URL.
+
+    Only the compressed output is buffered (in memory up to SPOOL_BYTES, on
+    disk past it), so memory stays flat however many rows `rows` yields. The
+    object is stored with Content-Encoding gzip, so browsers open the link as
+    a plain HTML page. A URL signed with the Lambda role's temporary
+    credentials also stops working when those credentials expire.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+        with gzip.GzipFile(fileobj=spool, mode='wb') as gz:
+            text = io.TextIOWrapper(gz, encoding='utf-8')
+            count = write_report(text, head, rows, tail)
+            text.flush()
+            text.detach()  # leave closing (and the gzip trailer) to the GzipFile block
+        size = spool.tell()
+        spool.seek(0)
+        s3_client.upload_fileobj(
+            spool, bucket, key,
+            ExtraArgs={'ContentType': 'text/html; charset=utf-8', 'ContentEncoding': 'gzip'}
+        )
+    url = s3_client.generate_presigned_url(
+        'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires_in
+    )
+    return {'Key': key, 'Rows': count, 'Bytes': size, 'Url': url}
@@ -0,0 +1,122 @@
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+
+# Standard library only: register_targets (tf-rds-failover-automation) bundles this file and aws_clients.py
+# without the rest of the layer
+NAMESPACE = 'PatchAutomation'
+DIMENSIONS = ('Function', 'AccountId', 'FleetSize')
+MAX_METRICS = 100  # EMF limit per metric directive
+THROTTLE_CODES = (
+    'Throttling', 'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded',
+    'ProvisionedThroughputExceededException', 'SlowDown'
+)
+
+# Collector of the running invocation; a container runs one invocation at a time
+_active = None
+
+
+def fleet_size_bucket(count):
+    # Order of magnitude, so the dimension stays low-cardinality: 0, <=10, <=100, <=1000, ...
+    return "0" if count <= 0 else f"<={10 ** len(str(count - 1))}"
+
+
+class Metrics:
+    """Phase timings, counters and per-service API calls of one invocation, emitted as one EMF line."""
+
+    def __init__(self, function_name, account_id, namespace=NAMESPACE):
+        self.namespace = namespace
+        self.dimensions = {'Function': function_name, 'AccountId': account_id, 'FleetSize': fleet_size_bucket(0)}
+        self.values = {}  # name -> [value, unit]
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def add(self, name, value=1, unit='Count'):
+        with self.lock:
+            entry = self.values.setdefault(name, [0, unit])
+            entry[0] += value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Phases may nest or run on several threads; each accumulates its own elapsed time
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Time", (time.monotonic() - started) * 1000, 'Milliseconds')
+
+    def payload(self, timestamp=None):
+        self.add('InvocationTime', (time.monotonic() - self.started) * 1000, 'Milliseconds')
+        with self.lock:
+            names = sorted(self.values)[:MAX_METRICS]
+            document = dict(self.dimensions)
+            document.update({name: round(self.values[name][0], 3) for name in names})
+        document['_aws'] = {
+            'Timestamp': int((timestamp or time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [list(DIMENSIONS)],
+                'Metrics': [{'Name': name, 'Unit': self.values[name][1]} for name in names]
+            }]
+        }
+        return document
+
+
+def instrumented(handler):
+    """Decorator for a Lambda handler: collects metrics for the invocation and prints them as EMF when it returns.
+
+    The line goes to stdout rather than through logging, so the Lambda log
+    prefix does not stop CloudWatch from extracting it.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _active
+        arn = getattr(context, 'invoked_function_arn', '')
+        _active = Metrics(
+            getattr(context, 'function_name', handler.__module__),
+            arn.split(':')[4] if arn.count(':') >= 4 else 'unknown'
+        )
+        try:
+            return handler(event, context)
+        finally:
+            metrics, _active = _active, None
+            sys.stdout.write(json.dumps(metrics.payload(), separators=(',', ':')) + "\n")
+            sys.stdout.flush()
+    return wrapper
+
+
+def phase(name):
+    return _active.phase(name) if _active else contextlib.nullcontext()
+
+
+def count(name, value=1, unit='Count'):
+    if _active:
+        _active.add(name, value, unit)
+
+
+def set_fleet_size(instances):
+    if _active:
+        _active.dimensions['FleetSize'] = fleet_size_bucket(instances)
+
+
+def _on_response(service, context=None, parsed_response=None, response_dict=None, **kwargs):
+    # response-received fires once per HTTP attempt, retries included
+    if not _active:
+        return
+    attempt = (context or {}).get('retries', {}).get('attempt', 1)
+    code = (parsed_response or {}).get('Error', {}).get('Code')
+    throttled = code in THROTTLE_CODES or (response_dict or {}).get('status_code') == 429
+    for name, hit in (('ApiCalls', attempt == 1), ('Retries', attempt > 1), ('Throttles', throttled)):
+        if hit:
+            _active.add(name)
+            _active.add(f"{service}.{name}")
+
+
+def instrument_client(client):
+    """Count the calls, retries and throttles of `client` into the running invocation's metrics; returns `client`."""
+    service = client.meta.service_model.service_name
+    client.meta.events.register('response-received', functools.partial(_on_response, service))
+    return client
@@ -0,0 +1,161 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 6  # sends of a bulk destination SES reported as throttled or transiently failed
+BASE_BACKOFF = 0.5  # seconds
+MAX_BACKOFF = 20    # seconds
+BULK_DESTINATIONS_PER_CALL = 50  # SendBulkTemplatedEmail limit
+RETRYABLE_BULK_STATUSES = ('AccountThrottled', 'TransientFailure')
+
+_send_rate = {}
+
+
+class TokenBucket:
+    # Thread-safe token bucket; acquire() blocks until the tokens are available
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+
+def get_send_rate(ses_client):
+    # MaxSendRate is per account and region, look it up once per container
+    if 'MaxSendRate' not in _send_rate:
+        _send_rate['MaxSendRate'] = ses_client.get_send_quota()['MaxSendRate']
+    return _send_rate['MaxSendRate']
+
+
+def backoff_delay(attempt):
+    # Full jitter: anywhere between 0 and the exponential cap
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+def error_message(error):
+    if isinstance(error, ClientError):
+        return error.response['Error']['Message']
+    return str(error)
+
+
+def build_email(to_addresses, subject, text=None, html=None):
+    body = {}
+    if text is not None:
+        body['Text'] = {'Data': text, 'Charset': 'UTF-8'}
+    if html is not None:
+        body['Html'] = {'Data': html, 'Charset': 'UTF-8'}
+    return {
+        'Destination': {'ToAddresses': list(to_addresses)},
+        'Message': {'Subject': {'Data': subject, 'Charset': 'UTF-8'}, 'Body': body}
+    }
+
+
+def dispatch_emails(ses_client, sender, emails, max_workers=MAX_WORKERS, send_rate=None, logger=None):
+    """Send `emails` (see build_email) through a bounded thread pool.
+
+    Sends are paced by a token bucket at the account's SES MaxSendRate (one
+    token per recipient); throttling that still happens is retried by the
+    client's own retry policy (aws_clients.CLIENT_CONFIG). Returns {'Sent',
+    'Failed'} counts.
+    """
+    stats = {'Sent': 0, 'Failed': 0}
+    if not emails:
+        return stats
+    bucket = TokenBucket(send_rate or get_send_rate(ses_client))
+    lock = threading.Lock()
+
+    def send(email):
+        bucket.acquire(len(email['Destination']['ToAddresses']))
+        try:
+            ses_client.send_email(Source=sender, **email)
+            outcome = 'Sent'
+        except (BotoCoreError, ClientError) as e:
+            if logger:
+                logger.error(f"SES error for {email['Destination']['ToAddresses']}: {error_message(e)}")
+            outcome = 'Failed'
+        with lock:
+            stats[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(send, emails))
+    return stats
+
+
+def dispatch_bulk_templated(ses_client, sender, template_name, destinations, default_data=None,
+                            max_workers=MAX_WORKERS, send_rate=None, logger=None, sleep=time.sleep):
+    """Send a stored SES template to `destinations` ([(to_address, template_data)]).
+
+    Up to 50 destinations go into each SendBulkTemplatedEmail call. Calls run
+    in the same paced thread pool as dispatch_emails, and destinations that
+    come back throttled or with a transient failure are resent.
+    """
+    stats = {'Sent': 0, 'Failed': 0, 'Throttled': 0}
+    if not destinations:
+        return stats
+    bucket = TokenBucket(send_rate or get_send_rate(ses_client))
+    lock = threading.Lock()
+    default_json = json.dumps(default_data or {})
+
+    def send(chunk):
+        local = {}
+        sent = failed = 0
+        for attempt in range(MAX_ATTEMPTS):
+            bucket.acquire(len(chunk))
+            try:
+                response = ses_client.send_bulk_templated_email(
+                    Source=sender,
+                    Template=template_name,
+                    DefaultTemplateData=default_json,
+                    Destinations=[
+                        {'Destination': {'ToAddresses': [address]}, 'ReplacementTemplateData': json.dumps(data)}
+                        for address, data in chunk
+                    ]
+                )
+            except (BotoCoreError, ClientError) as e:
+                if logger:
+                    logger.error(f"SES bulk send error: {error_message(e)}")
+                failed += len(chunk)
+                break
+            retry = []
+            for destination, status in zip(chunk, response['Status']):
+                if status['Status'] == 'Success':
+                    sent += 1
+                elif status['Status'] in RETRYABLE_BULK_STATUSES and attempt < MAX_ATTEMPTS - 1:
+                    local['Throttled'] = local.get('Throttled', 0) + 1
+                    retry.append(destination)
+                else:
+                    failed += 1
+                    if logger:
+                        logger.error(f"SES bulk send to {destination[0]} failed: {status['Status']}")
+            if not retry:
+                break
+            chunk = retry
+            sleep(backoff_delay(attempt))
+        with lock:
+            stats['Sent'] += sent
+            stats['Failed'] += failed
+            stats['Throttled'] += local.get('Throttled', 0)
+
+    chunks = [destinations[i:i + BULK_DESTINATIONS_PER_CALL]
+              for i in range(0, len(destinations), BULK_DESTINATIONS_PER_CALL)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(send, chunks))
+    return stats
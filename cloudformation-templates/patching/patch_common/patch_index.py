@@ -0,0 +1,109 @@
+import gzip
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+INDEX_STATES = ('Missing', 'Failed')  # DescribeInstancePatches State filter
+DETAIL_FIELDS = ('Title', 'Classification', 'Severity', 'CVEIds')
+PAGE_SIZE = 50
+MAX_WORKERS = 8
+INDEX_FILE = 'patch-index'
+
+
+def non_compliant_ids(states):
+    # {instance_id: InstancePatchState} -> hosts that have anything to look up
+    return [
+        iid for iid, state in states.items()
+        if state.get('MissingCount', 0) > 0 or state.get('FailedCount', 0) > 0
+    ]
+
+
+def fetch_instance_patches(ssm_client, instance_id, patch_states=INDEX_STATES):
+    patches = []
+    pages = ssm_client.get_paginator('describe_instance_patches').paginate(
+        InstanceId=instance_id,
+        Filters=[{'Key': 'State', 'Values': list(patch_states)}],
+        PaginationConfig={'PageSize': PAGE_SIZE}
+    )
+    for page in pages:
+        patches.extend(page['Patches'])
+    return patches
+
+
+def add_patch(index, instance_id, patch):
+    # Details are stored once per patch; ids and repeated values are interned so every host shares them
+    patch_id = sys.intern(patch['KBId'])
+    entry = index.get(patch_id)
+    if entry is None:
+        entry = {field: sys.intern(patch[field]) for field in DETAIL_FIELDS if patch.get(field)}
+        entry['Instances'] = {}
+        index[patch_id] = entry
+    entry['Instances'].setdefault(sys.intern(patch['State']), []).append(instance_id)
+
+
+def build_patch_index(ssm_client, instance_ids, patch_states=INDEX_STATES, max_workers=MAX_WORKERS):
+    """Inverted index of the patches in `patch_states` on `instance_ids`.
+
+    DescribeInstancePatches is paginated per host and up to `max_workers`
+    hosts are read concurrently. Returns ({patch id (KBId): {Title,
+    Classification, Severity, CVEIds, 'Instances': {state: [instance ids]}}},
+    {instance_id: error}) for hosts whose patches could not be read.
+    """
+    index = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_instance_patches, ssm_client, iid, patch_states): iid
+            for iid in instance_ids
+        }
+        for future in as_completed(futures):
+            iid = sys.intern(futures[future])
+            try:
+                patches = future.result()
+            except Exception as e:
+                errors[iid] = str(e)
+                continue
+            for patch in patches:
+                add_patch(index, iid, patch)
+    for entry in index.values():
+        for ids in entry['Instances'].values():
+            ids.sort()
+    return index, errors
+
+
+def merge_patch_indexes(indexes):
+    # Indexes built over disjoint sets of hosts (e.g. one per shard) -> one index over all of them
+    merged = {}
+    for index in indexes:
+        for patch_id, entry in index.items():
+            target = merged.get(patch_id)
+            if target is None:
+                merged[patch_id] = target = {field: value for field, value in entry.items() if field != 'Instances'}
+                target['Instances'] = {}
+            for state, ids in entry['Instances'].items():
+                target['Instances'].setdefault(state, []).extend(ids)
+    for entry in merged.values():
+        for ids in entry['Instances'].values():
+            ids.sort()
+    return merged
+
+
+def instances_for_patches(index, patch_ids):
+    # Every host listed under any state of any of `patch_ids`
+    return sorted({
+        iid for patch_id in patch_ids
+        for ids in index.get(patch_id, {}).get('Instances', {}).values() for iid in ids
+    })
+
+
+def write_patch_index(s3_client, bucket, index, partition, run_time):
+    """Store `index` as gzip JSON in the scan results `partition` (see results_writer.partition_prefix)."""
+    key = f"{partition}{INDEX_FILE}-{run_time.strftime('%H%M%S')}.json.gz"
+    body = gzip.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/gzip')
+    return {'Key': key, 'Patches': len(index), 'Bytes': len(body)}
+
+
+def load_patch_index(s3_client, bucket, key):
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    return json.loads(gzip.decompress(body))
@@ -0,0 +1,33 @@
+import time
+
+MAX_IDS_PER_CALL = 50  # DescribeInstancePatchStates InstanceIds / MaxResults limit
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_patch_states(ssm_client, instance_ids, stats=None):
+    """Return {instance_id: InstancePatchState} for all of `instance_ids`.
+
+    IDs are sent 50 per request and every request is paginated. When `stats`
+    is a dict, 'ApiCalls' and 'WallTime' (seconds) are accumulated into it.
+    """
+    started = time.monotonic()
+    api_calls = 0
+    states = {}
+    paginator = ssm_client.get_paginator('describe_instance_patch_states')
+    for chunk in chunked(list(instance_ids), MAX_IDS_PER_CALL):
+        pages = paginator.paginate(
+            InstanceIds=chunk,
+            PaginationConfig={'PageSize': MAX_IDS_PER_CALL}
+        )
+        for page in pages:
+            api_calls += 1
+            for state in page['InstancePatchStates']:
+                states[state['InstanceId']] = state
+    if stats is not None:
+        stats['ApiCalls'] = stats.get('ApiCalls', 0) + api_calls
+        stats['WallTime'] = stats.get('WallTime', 0.0) + time.monotonic() - started
+    return states
@@ -0,0 +1,84 @@
+import gzip
+import io
+import json
+
+from patch_common.scan_history import get_json, put_json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only needed for the parquet format
+    pyarrow = None
+
+PREFIX = 'scans/history/'
+COUNT_COLUMNS = ('MissingCount', 'InstalledPendingRebootCount')
+
+
+def to_rows(results, account_id, scan_time):
+    # One flat row per instance; non-numeric counts (e.g. 'N/A') become null so columns keep one type
+    rows = []
+    for iid, data in results.items():
+        row = {'InstanceId': iid, 'AccountId': account_id, 'ScanTime': scan_time}
+        row.update(data)
+        for column in COUNT_COLUMNS:
+            if column in row and not isinstance(row[column], int):
+                row[column] = None
+        rows.append(row)
+    return rows
+
+
+def encode_ndjson_gz(rows):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        for row in rows:
+            gz.write(json.dumps(row, separators=(',', ':'), default=str).encode('utf-8') + b'\n')
+    return buffer.getvalue()
+
+
+def encode_parquet(rows):
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), buffer, compression='snappy')
+    return buffer.getvalue()
+
+
+# format -> (encoder, file extension, content type)
+WRITERS = {
+    'ndjson': (encode_ndjson_gz, 'ndjson.gz', 'application/gzip'),
+    'parquet': (encode_parquet, 'parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def partition_prefix(dt, account_id, region=None, prefix=PREFIX):
+    partition = f"{prefix}dt={dt}/account={account_id}/"
+    return f"{partition}region={region}/" if region else partition
+
+
+def write_results(s3_client, bucket, results, account_id, run_time, fmt='ndjson', region=None,
+                  prefix=PREFIX, logger=None):
+    """Write `results` ({instance_id: fields}) as one file in a Hive-style partition.
+
+    The file goes to {prefix}dt=YYYY-MM-DD/account=<id>/ (plus region=<name>/
+    when `region` is given) and is listed in that partition's manifest.json
+    with its format, row count, size and columns. `fmt` is a WRITERS key;
+    parquet falls back to ndjson when pyarrow is not installed. Returns the
+    manifest entry for the file.
+    """
+    if fmt == 'parquet' and pyarrow is None:
+        if logger:
+            logger.warning("pyarrow is not available, writing ndjson instead of parquet")
+        fmt = 'ndjson'
+    encode, extension, content_type = WRITERS[fmt]
+
+    rows = to_rows(results, account_id, run_time.isoformat())
+    body = encode(rows)
+    partition = partition_prefix(run_time.strftime("%Y-%m-%d"), account_id, region, prefix)
+    key = f"{partition}scan-{run_time.strftime('%H%M%S')}.{extension}"
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type)
+
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    entry = {'Key': key, 'Format': fmt, 'Rows': len(rows), 'Bytes': len(body), 'Columns': columns}
+    manifest_key = f"{partition}manifest.json"
+    manifest = get_json(s3_client, bucket, manifest_key) or {'Files': []}
+    manifest['Files'].append(entry)
+    put_json(s3_client, bucket, manifest_key, manifest)
+    return entry
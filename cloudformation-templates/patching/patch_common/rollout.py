@@ -0,0 +1,121 @@
+import collections
+import time
+
+from patch_common.command_tracker import (
+    BACKOFF_FACTOR, MAX_POLL_INTERVAL, MIN_POLL_INTERVAL, TERMINAL_STATUSES,
+    list_invocation_statuses, send_command_chunked
+)
+
+CANARY_SIZE = 1
+GROWTH_FACTOR = 2
+MAX_WAVE_SIZE = 200
+SUCCESS_THRESHOLD = 0.9  # share of a wave that must succeed before the next wave starts
+FAILURE_BUDGET = 0.1     # share of the whole rollout allowed to fail before it halts
+
+
+def interleave_groups(instance_ids, group_of=None):
+    # Round-robin across groups so early waves never take out a whole group (e.g. one AZ)
+    if group_of is None:
+        return list(instance_ids)
+    groups = collections.OrderedDict()
+    for iid in instance_ids:
+        groups.setdefault(group_of(iid), []).append(iid)
+    ordered = []
+    queues = list(groups.values())
+    for position in range(max((len(queue) for queue in queues), default=0)):
+        ordered.extend(queue[position] for queue in queues if position < len(queue))
+    return ordered
+
+
+def plan_waves(instance_ids, group_of=None, canary_size=CANARY_SIZE, growth=GROWTH_FACTOR, max_wave=MAX_WAVE_SIZE):
+    """Split `instance_ids` into a canary wave followed by waves growing by `growth`, capped at `max_wave`."""
+    ordered = interleave_groups(instance_ids, group_of)
+    waves = []
+    size = max(1, canary_size)
+    start = 0
+    while start < len(ordered):
+        waves.append(ordered[start:start + size])
+        start += size
+        size = min(max_wave, size * growth)
+    return waves
+
+
+def new_rollout(waves):
+    # Plain dict so the whole rollout can be handed to a resumed invocation as JSON
+    return {'Waves': waves, 'Launched': 0, 'Commands': {}, 'Statuses': {}, 'Halted': None}
+
+
+def wave_progress(rollout, index):
+    wave = rollout['Waves'][index]
+    statuses = [rollout['Statuses'].get(iid) for iid in wave]
+    succeeded = sum(1 for status in statuses if status == 'Success')
+    finished = sum(1 for status in statuses if status is not None)
+    return succeeded / len(wave), finished == len(wave)
+
+
+def failure_count(rollout):
+    return sum(1 for status in rollout['Statuses'].values() if status != 'Success')
+
+
+def skipped_instances(rollout):
+    return [iid for wave in rollout['Waves'][rollout['Launched']:] for iid in wave]
+
+
+def advance_rollout(ssm_client, rollout, send_kwargs, on_complete=None, deadline=None,
+                    clock=time.monotonic, sleep=time.sleep,
+                    success_threshold=SUCCESS_THRESHOLD, failure_budget=FAILURE_BUDGET,
+                    min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+    """Drive `rollout` (see new_rollout) until it finishes, halts or `deadline` passes.
+
+    The next wave is sent (in 50-ID SendCommand chunks with `send_kwargs`)
+    as soon as the latest wave's success ratio reaches `success_threshold`;
+    earlier waves keep running meanwhile. New waves stop once more than
+    `failure_budget` of all instances failed, or when a wave finishes below
+    the threshold, and the reason is stored in rollout['Halted']. Every tick
+    polls all in-flight commands; `on_complete` gets {instance_id: status}
+    for the hosts that finished in that tick. Returns `rollout`.
+    """
+    waves = rollout['Waves']
+    max_failures = int(failure_budget * sum(len(wave) for wave in waves))
+    interval = min_interval
+    while True:
+        if not rollout['Halted'] and rollout['Launched'] < len(waves):
+            ratio, wave_done = wave_progress(rollout, rollout['Launched'] - 1) if rollout['Launched'] else (1.0, True)
+            if ratio >= success_threshold:
+                wave = waves[rollout['Launched']]
+                rollout['Commands'].update(send_command_chunked(ssm_client, wave, **send_kwargs))
+                rollout['Launched'] += 1
+                interval = min_interval
+            elif wave_done:
+                rollout['Halted'] = f"wave {rollout['Launched']} succeeded on {ratio:.0%} of hosts, below {success_threshold:.0%}"
+        if not rollout['Commands']:
+            break
+
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
+            sleep(min(interval, remaining))
+        else:
+            sleep(interval)
+
+        done = {}
+        for command_id in list(rollout['Commands']):
+            statuses = list_invocation_statuses(ssm_client, command_id)
+            ids = rollout['Commands'][command_id]
+            finished = {iid: statuses[iid] for iid in ids if statuses.get(iid) in TERMINAL_STATUSES}
+            done.update(finished)
+            rollout['Commands'][command_id] = [iid for iid in ids if iid not in finished]
+            if not rollout['Commands'][command_id]:
+                del rollout['Commands'][command_id]
+        if done:
+            rollout['Statuses'].update(done)
+            if on_complete:
+                on_complete(done)
+            interval = min_interval
+        else:
+            interval = min(interval * BACKOFF_FACTOR, max_interval)
+
+        if not rollout['Halted'] and failure_count(rollout) > max_failures:
+            rollout['Halted'] = f"{failure_count(rollout)} failed hosts exceed the failure budget of {max_failures}"
+    return rollout
@@ -0,0 +1,72 @@
+import json
+
+from botocore.exceptions import ClientError
+
+PREFIX = 'scans/incremental/'
+TRACKED_FIELDS = ('MissingCount', 'InstalledPendingRebootCount', 'ComplianceStatus')
+FULL_SNAPSHOT_EVERY = 7  # deltas written between two full snapshots
+
+
+def get_json(s3_client, bucket, key):
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def put_json(s3_client, bucket, key, data):
+    body = json.dumps(data, separators=(',', ':'), default=str)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/json")
+    return len(body)
+
+
+def load_previous(s3_client, bucket, prefix=PREFIX):
+    # Rebuild the last run's results from the latest full snapshot plus the deltas after it
+    manifest = get_json(s3_client, bucket, f"{prefix}manifest.json") or {'Snapshot': None, 'Deltas': []}
+    state = {}
+    if manifest['Snapshot']:
+        state = get_json(s3_client, bucket, manifest['Snapshot']) or {}
+    for key in manifest['Deltas']:
+        delta = get_json(s3_client, bucket, key) or {}
+        state.update(delta.get('Changed', {}))
+        for iid in delta.get('Removed', []):
+            state.pop(iid, None)
+    return state, manifest
+
+
+def diff_results(previous, current, fields=TRACKED_FIELDS):
+    changed = {
+        iid: data for iid, data in current.items()
+        if iid not in previous or any(previous[iid].get(f) != data.get(f) for f in fields)
+    }
+    removed = sorted(iid for iid in previous if iid not in current)
+    return {'Changed': changed, 'Removed': removed}
+
+
+def record_incremental(s3_client, bucket, results, run_time, prefix=PREFIX, full_every=FULL_SNAPSHOT_EVERY):
+    """Store only what changed in `results` since the previous run.
+
+    A compact delta is written under {prefix}deltas/, and every
+    `full_every` runs (or when there is no history yet) a full snapshot
+    under {prefix}snapshots/ replaces the delta chain. Returns the delta
+    plus the Key and Bytes written and whether it was a Full snapshot.
+    """
+    previous, manifest = load_previous(s3_client, bucket, prefix)
+    delta = diff_results(previous, results)
+    stamp = run_time.strftime("%Y-%m-%dT%H-%M-%SZ")
+
+    if not manifest['Snapshot'] or len(manifest['Deltas']) >= full_every:
+        key = f"{prefix}snapshots/{stamp}.json"
+        written = put_json(s3_client, bucket, key, results)
+        manifest = {'Snapshot': key, 'Deltas': []}
+        full = True
+    else:
+        key = f"{prefix}deltas/{stamp}.json"
+        written = put_json(s3_client, bucket, key, delta)
+        manifest['Deltas'].append(key)
+        full = False
+
+    put_json(s3_client, bucket, f"{prefix}manifest.json", manifest)
+    return dict(delta, Key=key, Bytes=written, Full=full)
@@ -0,0 +1,66 @@
+import datetime
+
+from patch_common.patch_states import fetch_patch_states
+
+
+def patch_group_baselines(ssm_client):
+    # {patch group: baseline id} as currently registered
+    baselines = {}
+    for page in ssm_client.get_paginator('describe_patch_groups').paginate():
+        for mapping in page['Mappings']:
+            baselines[mapping['PatchGroup']] = mapping['BaselineIdentity']['BaselineId']
+    return baselines
+
+
+def baseline_modified_dates(ssm_client, baseline_ids):
+    # One GetPatchBaseline per distinct baseline; a fleet usually has only a handful
+    return {
+        baseline_id: ssm_client.get_patch_baseline(BaselineId=baseline_id).get('ModifiedDate')
+        for baseline_id in set(baseline_ids)
+    }
+
+
+def stale_reason(state, now, max_age, group_baselines, modified_dates):
+    """Why `state` (an InstancePatchState or None) needs a new scan, or None when it can be reused."""
+    if state is None or not state.get('OperationEndTime'):
+        return 'no patch state'
+    ended = state['OperationEndTime']
+    if now - ended > datetime.timedelta(seconds=max_age):
+        return 'older than max age'
+    group = state.get('PatchGroup')
+    if group in group_baselines and group_baselines[group] != state.get('BaselineId'):
+        return 'patch group moved to another baseline'
+    modified = modified_dates.get(state.get('BaselineId'))
+    if modified and modified > ended:
+        return 'baseline modified since last scan'
+    return None
+
+
+def plan_scans(ssm_client, instance_ids, max_age, now=None, stats=None):
+    """Split `instance_ids` into hosts that need a scan and hosts whose last scan is still usable.
+
+    Patch states are fetched first in bulk. A host is reused when its last
+    Scan/Install operation (from any source: this function, a State Manager
+    association, another document) ended less than `max_age` seconds ago and
+    its baseline is unchanged since then: same baseline registered for its
+    patch group, and not modified after the operation ended. Returns
+    (to_scan, cached_states, reasons) where reasons maps each host to scan
+    to why it was picked.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    states = fetch_patch_states(ssm_client, instance_ids, stats)
+    group_baselines = patch_group_baselines(ssm_client) if states else {}
+    modified_dates = baseline_modified_dates(
+        ssm_client, [state['BaselineId'] for state in states.values() if state.get('BaselineId')]
+    )
+    to_scan = []
+    cached = {}
+    reasons = {}
+    for iid in instance_ids:
+        reason = stale_reason(states.get(iid), now, max_age, group_baselines, modified_dates)
+        if reason:
+            to_scan.append(iid)
+            reasons[iid] = reason
+        else:
+            cached[iid] = states[iid]
+    return to_scan, cached, reasons
@@ -0,0 +1,149 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from patch_common.scan_history import get_json, put_json
+
+PREFIX = 'scans/shards/'
+SQS_BATCH = 10  # SendMessageBatch entries per call
+SQS_MAX_BYTES = 256 * 1024  # per message and per SendMessageBatch call
+MAX_SEND_ATTEMPTS = 5
+READ_WORKERS = 16
+REDUCE_MARKER = 'reduce.json'
+
+
+def shard_hash(instance_id):
+    # Stable across processes and runs, unlike hash() under PYTHONHASHSEED
+    return int.from_bytes(hashlib.blake2b(instance_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def build_shards(records, shard_size):
+    """Split `records` (InstanceRecords) into work items of at most `shard_size` instances.
+
+    Instances are ordered by a stable hash of their id before chunking, so
+    the same fleet always gives the same shards and every shard gets an even
+    mix of owners, AZs and patch groups rather than one slow group.
+    """
+    ordered = sorted(records, key=lambda record: shard_hash(record.instance_id))
+    return [ordered[start:start + shard_size] for start in range(0, len(ordered), shard_size)]
+
+
+class SqsQueue:
+    """Work items as SQS messages; the queue's Lambda event source mapping delivers them to the workers."""
+
+    def __init__(self, sqs_client, queue_url):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+
+    def _batches(self, bodies):
+        batch, size = [], 0
+        for body in bodies:
+            length = len(body.encode('utf-8'))
+            if length > SQS_MAX_BYTES:
+                raise ValueError(f"work item of {length} bytes is over the SQS message limit, lower the shard size")
+            if len(batch) == SQS_BATCH or size + length > SQS_MAX_BYTES:
+                yield batch
+                batch, size = [], 0
+            batch.append(body)
+            size += length
+        if batch:
+            yield batch
+
+    def send(self, items):
+        bodies = [json.dumps(item, separators=(',', ':')) for item in items]
+        for batch in self._batches(bodies):
+            entries = [{'Id': str(n), 'MessageBody': body} for n, body in enumerate(batch)]
+            for _ in range(MAX_SEND_ATTEMPTS):
+                failed = self.sqs.send_message_batch(QueueUrl=self.queue_url, Entries=entries).get('Failed', [])
+                if any(entry.get('SenderFault') for entry in failed):
+                    raise RuntimeError(f"SQS rejected work items: {failed}")
+                failed_ids = {entry['Id'] for entry in failed}
+                entries = [entry for entry in entries if entry['Id'] in failed_ids]
+                if not entries:
+                    break
+            else:
+                raise RuntimeError(f"{len(entries)} work items could not be queued")
+        return len(bodies)
+
+
+class LocalQueue:
+    """In-memory stand-in for SqsQueue, for tests and for runs without a queue.
+
+    drain() plays the event source mapping within the calling process: up to
+    `concurrency` items are processed at once, and an item whose worker
+    raises is delivered again with the next receive count, up to
+    `max_receives` deliveries (the queue's redrive maxReceiveCount).
+    """
+
+    def __init__(self):
+        self.bodies = []
+
+    def send(self, items):
+        # Serialised like SQS messages, so items that would not survive a real queue fail here too
+        self.bodies.extend(json.dumps(item, separators=(',', ':')) for item in items)
+        return len(items)
+
+    def drain(self, worker, concurrency, max_receives):
+        pending = [(body, 1) for body in self.bodies]
+        self.bodies = []
+        while pending:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = {executor.submit(worker, json.loads(body), receives): (body, receives) for body, receives in pending}
+            pending = [
+                (body, receives + 1) for future, (body, receives) in futures.items()
+                if future.exception() is not None and receives < max_receives
+            ]
+
+
+def run_prefix(run_id, prefix=PREFIX):
+    return f"{prefix}run={run_id}/"
+
+
+def shard_key(run_id, shard, prefix=PREFIX):
+    return f"{run_prefix(run_id, prefix)}shard-{shard:05d}.json"
+
+
+def shard_done(s3_client, bucket, run_id, shard, prefix=PREFIX):
+    # A redelivered shard whose partial results were already stored is not scanned again
+    try:
+        s3_client.head_object(Bucket=bucket, Key=shard_key(run_id, shard, prefix))
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def write_partial(s3_client, bucket, run_id, shard, partial, prefix=PREFIX):
+    return put_json(s3_client, bucket, shard_key(run_id, shard, prefix), partial)
+
+
+def completed_shards(s3_client, bucket, run_id, prefix=PREFIX):
+    prefix = f"{run_prefix(run_id, prefix)}shard-"
+    completed = 0
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        completed += page.get('KeyCount', len(page.get('Contents', [])))
+    return completed
+
+
+def claim_reduce(s3_client, bucket, run_id, prefix=PREFIX):
+    """True for exactly one caller per run: the reduce marker is created with a conditional put."""
+    try:
+        s3_client.put_object(
+            Bucket=bucket, Key=f"{run_prefix(run_id, prefix)}{REDUCE_MARKER}", Body=b'{}', IfNoneMatch='*'
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            return False
+        raise
+
+
+def read_partials(s3_client, bucket, run_id, shards, prefix=PREFIX, max_workers=READ_WORKERS):
+    # Partial results of shards 0..shards-1, None for a shard that stored nothing
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda shard: get_json(s3_client, bucket, shard_key(run_id, shard, prefix)), range(shards)
+        ))
@@ -0,0 +1,85 @@
+import random
+import time
+
+BATCH_GET_LIMIT = 100   # BatchGetItem keys per request
+BATCH_WRITE_LIMIT = 25  # BatchWriteItem items per request
+CACHE_TTL = 900  # seconds a warm container trusts its cached subscriber list
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = 0.05  # seconds
+
+# table name -> {'Emails': set of known subscribers, 'Expires': clock() value}
+_cache = {}
+
+
+def _cache_entry(table_name, clock):
+    entry = _cache.get(table_name)
+    if entry is None or entry['Expires'] <= clock():
+        entry = {'Emails': set(), 'Expires': clock() + CACHE_TTL}
+        _cache[table_name] = entry
+    return entry
+
+
+def _count_call(stats):
+    if stats is not None:
+        stats['ApiCalls'] = stats.get('ApiCalls', 0) + 1
+
+
+def _backoff(attempt, sleep):
+    sleep(random.uniform(0, BASE_BACKOFF * 2 ** attempt))
+
+
+def batch_get_emails(ddb_client, table_name, emails, stats=None, sleep=time.sleep):
+    # Returns the subset of `emails` already in the table
+    found = set()
+    for start in range(0, len(emails), BATCH_GET_LIMIT):
+        request = {table_name: {
+            'Keys': [{'Email': {'S': email}} for email in emails[start:start + BATCH_GET_LIMIT]],
+            'ProjectionExpression': 'Email'
+        }}
+        for attempt in range(MAX_ATTEMPTS):
+            _count_call(stats)
+            response = ddb_client.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(table_name, []):
+                found.add(item['Email']['S'])
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+            _backoff(attempt, sleep)
+        else:
+            raise RuntimeError(f"BatchGetItem on {table_name} left unprocessed keys after {MAX_ATTEMPTS} attempts")
+    return found
+
+
+def batch_put_emails(ddb_client, table_name, emails, stats=None, sleep=time.sleep):
+    for start in range(0, len(emails), BATCH_WRITE_LIMIT):
+        request = {table_name: [
+            {'PutRequest': {'Item': {'Email': {'S': email}}}}
+            for email in emails[start:start + BATCH_WRITE_LIMIT]
+        ]}
+        for attempt in range(MAX_ATTEMPTS):
+            _count_call(stats)
+            response = ddb_client.batch_write_item(RequestItems=request)
+            request = response.get('UnprocessedItems')
+            if not request:
+                break
+            _backoff(attempt, sleep)
+        else:
+            raise RuntimeError(f"BatchWriteItem on {table_name} left unprocessed items after {MAX_ATTEMPTS} attempts")
+
+
+def ensure_subscribed(ddb_client, table_name, emails, stats=None, clock=time.monotonic, sleep=time.sleep):
+    """Make sure every address in `emails` is in the subscriber table.
+
+    Addresses seen within CACHE_TTL by this container are skipped outright;
+    the rest are looked up with BatchGetItem and missing ones written with
+    BatchWriteItem. Returns the set of newly added addresses.
+    """
+    entry = _cache_entry(table_name, clock)
+    unknown = sorted(set(emails) - entry['Emails'])
+    if not unknown:
+        return set()
+    existing = batch_get_emails(ddb_client, table_name, unknown, stats, sleep)
+    new = [email for email in unknown if email not in existing]
+    batch_put_emails(ddb_client, table_name, new, stats, sleep)
+    entry['Emails'].update(unknown)
+    return set(new)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# patch_common is shipped as a Lambda layer and imported as a top-level package; bench lives at the repo root
+for path in (os.path.join(ROOT, 'cloudformation-templates', 'patching'), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,28 @@
+import boto3
+
+from bench import clock as virtual_time
+from bench import coldstart
+from bench import fake_aws
+from bench.scenarios import SCENARIOS, environment
+
+LAZY_HANDLERS = ('patch-scan-emailer', 'patch-non-compliant', 'combined-email-orchestrator', 'register-targets')
+
+
+def test_cold_start_times_each_handler_in_a_fresh_interpreter():
+    results = coldstart.cold_start(['combined-email-orchestrator', 'register-targets'], repeat=2)
+    assert [result['Scenario'] for result in results] == ['combined-email-orchestrator', 'register-targets']
+    for result in results:
+        assert (result['Status'], result['Detail'], result['Samples']) == ('ok', '', 2)
+        assert 0 < result['MinInitMs'] <= result['InitMs'] <= result['MaxInitMs']
+        assert result['Boto3Ms'] > 0
+
+
+def test_module_init_builds_no_clients(monkeypatch):
+    built = []
+    monkeypatch.setattr(boto3, 'client', lambda *args, **kwargs: built.append(args))
+    for name in LAZY_HANDLERS:
+        scenario = SCENARIOS[name]
+        variables, _ = scenario['setup'](fake_aws.FakeAWS(virtual_time.VirtualClock()), 10)
+        with environment(variables):
+            scenario['load']()
+    assert built == []
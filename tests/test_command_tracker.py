@@ -0,0 +1,119 @@
+from patch_common.command_tracker import send_command_chunked, track_commands, wait_for_commands
+from patch_common.rollout import advance_rollout, new_rollout, plan_waves
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeSSM:
+    """SendCommand/ListCommandInvocations where each host finishes `durations[iid]` seconds after its command was sent."""
+
+    def __init__(self, clock, durations, failing=()):
+        self.clock = clock
+        self.durations = durations
+        self.failing = set(failing)
+        self.commands = {}
+        self.list_calls = 0
+
+    def send_command(self, InstanceIds, **kwargs):
+        command_id = f"cmd-{len(self.commands)}"
+        self.commands[command_id] = (list(InstanceIds), self.clock())
+        return {'Command': {'CommandId': command_id}}
+
+    def get_paginator(self, name):
+        assert name == 'list_command_invocations'
+        return self
+
+    def paginate(self, CommandId, PaginationConfig):
+        self.list_calls += 1
+        ids, sent = self.commands[CommandId]
+        size = PaginationConfig['PageSize']
+        for start in range(0, len(ids), size):
+            yield {'CommandInvocations': [
+                {'InstanceId': iid, 'Status': self.status(iid, sent)} for iid in ids[start:start + size]
+            ]}
+
+    def status(self, iid, sent):
+        if self.clock() - sent < self.durations[iid]:
+            return 'InProgress'
+        return 'Failed' if iid in self.failing else 'Success'
+
+
+def host_durations(count, slowest):
+    # Spread between 30s and `slowest`, so a serial wait would take far longer than the slowest host
+    return {f"i-{n:05d}": 30 + (slowest - 30) * n / (count - 1) for n in range(count)}
+
+
+def test_track_commands_waits_for_slowest_host_only():
+    clock = FakeClock()
+    durations = host_durations(120, slowest=900)
+    ssm = FakeSSM(clock, durations)
+    commands = send_command_chunked(ssm, sorted(durations), DocumentName='AWS-RunPatchBaseline')
+    completions = []
+
+    finished, pending = track_commands(ssm, commands, on_complete=completions.append, clock=clock, sleep=clock.sleep)
+
+    slowest = max(durations.values())
+    assert len(commands) == 3
+    assert pending == []
+    assert finished == {iid: 'Success' for iid in durations}
+    # Hosts are tracked concurrently: done within one poll interval of the slowest host, not the serial sum
+    assert slowest <= clock.now < slowest + 60
+    assert clock.now < sum(durations.values()) / 10
+    reported = [iid for done in completions for iid in done]
+    assert sorted(reported) == sorted(durations)
+
+
+def test_wait_for_commands_reports_hosts_past_the_timeout():
+    clock = FakeClock()
+    durations = {'i-fast': 40, 'i-slow': 4000}
+    ssm = FakeSSM(clock, durations)
+    commands = send_command_chunked(ssm, sorted(durations))
+
+    finished, pending = wait_for_commands(ssm, commands, timeout=600, clock=clock, sleep=clock.sleep)
+
+    assert finished == {'i-fast': 'Success'}
+    assert pending == ['i-slow']
+    assert clock.now == 600
+
+
+def test_advance_rollout_overlaps_waves_and_reports_each_host_once():
+    clock = FakeClock()
+    durations = host_durations(300, slowest=600)
+    ssm = FakeSSM(clock, durations)
+    rollout = new_rollout(plan_waves(sorted(durations)))
+    completions = []
+
+    advance_rollout(ssm, rollout, {'DocumentName': 'AWS-RunPatchBaseline'},
+                    on_complete=completions.append, clock=clock, sleep=clock.sleep)
+
+    assert rollout['Halted'] is None
+    assert rollout['Launched'] == len(rollout['Waves'])
+    assert rollout['Commands'] == {}
+    assert rollout['Statuses'] == {iid: 'Success' for iid in durations}
+    reported = [iid for done in completions for iid in done]
+    assert sorted(reported) == sorted(durations)
+    # A wave starts once 90% of the previous one succeeded, so the rollout takes far less than one slowest host per wave
+    assert clock.now < len(rollout['Waves']) * max(durations.values()) / 2
+
+
+def test_advance_rollout_halts_on_failed_canary():
+    clock = FakeClock()
+    durations = host_durations(50, slowest=300)
+    ssm = FakeSSM(clock, durations, failing=['i-00000'])
+    rollout = new_rollout(plan_waves(sorted(durations)))
+    completions = []
+
+    advance_rollout(ssm, rollout, {}, on_complete=completions.append, clock=clock, sleep=clock.sleep)
+
+    assert rollout['Launched'] == 1
+    assert rollout['Halted'].startswith('wave 1 succeeded on 0% of hosts')
+    assert completions == [{'i-00000': 'Failed'}]
@@ -0,0 +1,85 @@
+import logging
+import math
+import time
+import tracemalloc
+
+import pytest
+
+from patch_common.discovery import EMAIL_TAG, iter_tagged_instances
+
+TAGS = {'PatchScanAutomation': 'Enabled'}
+
+
+class FakeEC2:
+    """DescribeInstances paginator that builds each page on demand, so the fake itself holds one page at a time."""
+
+    def __init__(self, count, email=lambda n: f"owner{n // 25}@example.com"):
+        self.count = count
+        self.email = email
+        self.pages = 0
+        self.page_sizes = []
+
+    def get_paginator(self, name):
+        assert name == 'describe_instances'
+        return self
+
+    def paginate(self, Filters, PaginationConfig):
+        size = PaginationConfig['PageSize']
+        self.page_sizes.append(size)
+        for start in range(0, self.count, size):
+            self.pages += 1
+            yield {'Reservations': [{'Instances': [self.instance(n) for n in range(start, min(start + size, self.count))]}]}
+
+    def instance(self, n):
+        return {
+            'InstanceId': f"i-{n:017x}",
+            'PrivateIpAddress': f"10.0.{n // 256 % 256}.{n % 256}",
+            'PrivateDnsName': f"ip-10-0-{n // 256 % 256}-{n % 256}.ec2.internal",
+            'Placement': {'AvailabilityZone': 'ap-south-1a'},
+            'Tags': [{'Key': 'Name', 'Value': f"app-{n % 50}"}, {'Key': EMAIL_TAG, 'Value': self.email(n)}],
+        }
+
+
+def stream(count):
+    # Peak traced bytes and seconds of consuming discovery without keeping the records
+    ec2 = FakeEC2(count)
+    tracemalloc.start()
+    started = time.perf_counter()
+    seen = sum(1 for _ in iter_tagged_instances(ec2, TAGS))
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert seen == count
+    return ec2, peak, seconds
+
+
+def test_discovery_pages_at_the_api_maximum():
+    ec2 = FakeEC2(10000)
+    records = list(iter_tagged_instances(ec2, TAGS))
+    assert len(records) == 10000
+    assert ec2.page_sizes == [1000]
+    assert ec2.pages == math.ceil(10000 / 1000)
+
+
+def test_discovery_memory_is_bounded_by_one_page():
+    _, small_peak, _ = stream(2000)
+    ec2, large_peak, _ = stream(10000)
+    assert ec2.pages == 10
+    # Streaming: five times the fleet, the same peak (the page being read while the next one is fetched)
+    assert large_peak < 1.25 * small_peak
+
+
+def test_discovery_time_is_linear():
+    small = min(stream(1000)[2] for _ in range(3))
+    large = min(stream(10000)[2] for _ in range(3))
+    assert large < 30 * small
+
+
+@pytest.mark.parametrize('valid_emails_only, kept', [(True, 2), (False, 3)])
+def test_invalid_email_tag_is_logged(caplog, valid_emails_only, kept):
+    ec2 = FakeEC2(3, email=lambda n: 'ops-team' if n == 1 else f"owner{n}@example.com")
+    logger = logging.getLogger('discovery-test')
+    with caplog.at_level(logging.WARNING, logger='discovery-test'):
+        records = list(iter_tagged_instances(ec2, TAGS, valid_emails_only=valid_emails_only, logger=logger))
+    assert len(records) == kept
+    assert caplog.messages == [f"Instance i-{1:017x} has an invalid {EMAIL_TAG} tag: 'ops-team'"]
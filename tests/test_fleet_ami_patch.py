@@ -0,0 +1,61 @@
+import json
+import math
+
+from bench import clock as virtual_time
+from bench import fake_aws
+from bench.scenarios import SCENARIOS, environment
+
+SCENARIO = SCENARIOS['fleet-ami-patch']
+
+
+def run(aws, size=20):
+    # Whole pipeline in one call (no context, so no self-resume) on the virtual clock
+    env, event = SCENARIO['setup'](aws, size)
+    with environment(env), virtual_time.install(aws.clock), fake_aws.install(aws):
+        module = SCENARIO['load']()
+        response = module.lambda_handler(event, None)
+    return response, json.loads(response['body'])
+
+
+def baseline_invocations(aws):
+    return [i for i in aws.invocations if i['InvocationType'] == 'RequestResponse']
+
+
+def test_slow_baseline_is_waited_for_and_invoked_once():
+    aws = fake_aws.FakeAWS(virtual_time.VirtualClock(), sync_invoke_time=200)
+    response, body = run(aws)
+    assert response['statusCode'] == 200
+    assert len(baseline_invocations(aws)) == 1
+    assert len(body['patchedInstances']) == 20
+
+
+def test_baseline_timeout_aborts_with_a_notice():
+    aws = fake_aws.FakeAWS(virtual_time.VirtualClock(), sync_invoke_time=400)
+    response, body = run(aws)
+    assert response['statusCode'] == 502
+    assert 'Sanity baseline failed' in body['message']
+    assert len(baseline_invocations(aws)) == 1
+    assert aws.calls[('ec2', 'CreateImage')] == 0
+    [message] = aws.messages
+    assert message.startswith('Sanity baseline failed, no instance was backed up or patched')
+
+
+def test_images_unknown_to_describe_images_stay_pending(monkeypatch):
+    create_image = fake_aws.EC2.create_image
+    lost = []
+
+    def create_lost_image(self, InstanceId, Name, **params):
+        # The first AMI never shows up in DescribeImages; the others only after IMAGE_VISIBLE_DELAY
+        result = create_image(self, InstanceId, Name, **params)
+        if not lost:
+            lost.append(InstanceId)
+            self.fleet.images[result['ImageId']]['Visible'] = math.inf
+        return result
+
+    monkeypatch.setattr(fake_aws.EC2, 'create_image', create_lost_image)
+    aws = fake_aws.FakeAWS(virtual_time.VirtualClock())
+    response, body = run(aws)
+    assert response['statusCode'] == 200
+    assert len(body['patchedInstances']) == 19
+    assert list(body['failedInstances']) == lost
+    assert 'not found after' in body['failedInstances'][lost[0]]
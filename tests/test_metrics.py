@@ -0,0 +1,137 @@
+import json
+import types
+
+import boto3
+import pytest
+
+from patch_common import metrics
+
+ARN = 'arn:aws:lambda:ap-south-1:123456789012:function:PatchScanEmailer'
+
+
+class FakeMonotonic:
+    # Every read advances 0.25s, so each phase and the invocation itself have a known length
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        self.now += 0.25
+        return self.now
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    monkeypatch.setattr(metrics, 'time', types.SimpleNamespace(monotonic=FakeMonotonic(), time=lambda: 1700000000.5))
+
+
+def context(function_name='PatchScanEmailer', arn=ARN):
+    return types.SimpleNamespace(function_name=function_name, invoked_function_arn=arn)
+
+
+def emf_lines(out):
+    return [json.loads(line) for line in out.splitlines() if line.startswith('{') and '"_aws"' in line]
+
+
+def ssm_response(ssm, attempt, code=None, status=200):
+    parsed = {'Error': {'Code': code, 'Message': 'Rate exceeded'}} if code else {'Command': {}}
+    ssm.meta.events.emit(
+        'response-received.ssm.SendCommand',
+        context={'retries': {'attempt': attempt}},
+        parsed_response=parsed,
+        response_dict={'status_code': status},
+        exception=None
+    )
+
+
+@pytest.mark.parametrize('count, bucket', [
+    (0, '0'), (1, '<=10'), (7, '<=10'), (10, '<=10'), (11, '<=100'), (1000, '<=1000'), (1001, '<=10000')
+])
+def test_fleet_size_bucket(count, bucket):
+    assert metrics.fleet_size_bucket(count) == bucket
+
+
+def test_instrumented_prints_one_emf_line(fake_time, capsys):
+    @metrics.instrumented
+    def handler(event, context):
+        metrics.set_fleet_size(1000)
+        with metrics.phase('Discovery'):
+            pass
+        metrics.count('EmailsSent', 3)
+        return {'statusCode': 200}
+
+    assert handler({}, context()) == {'statusCode': 200}
+
+    [document] = emf_lines(capsys.readouterr().out)
+    assert document['Function'] == 'PatchScanEmailer'
+    assert document['AccountId'] == '123456789012'
+    assert document['FleetSize'] == '<=1000'
+    assert document['DiscoveryTime'] == 250.0
+    assert document['EmailsSent'] == 3
+    assert document['InvocationTime'] > document['DiscoveryTime']
+    directive, = document['_aws']['CloudWatchMetrics']
+    assert document['_aws']['Timestamp'] == 1700000000500
+    assert directive['Namespace'] == 'PatchAutomation'
+    assert directive['Dimensions'] == [['Function', 'AccountId', 'FleetSize']]
+    units = {metric['Name']: metric['Unit'] for metric in directive['Metrics']}
+    assert units == {'DiscoveryTime': 'Milliseconds', 'EmailsSent': 'Count', 'InvocationTime': 'Milliseconds'}
+
+
+def test_instrumented_emits_when_handler_raises(fake_time, capsys):
+    @metrics.instrumented
+    def handler(event, context):
+        with metrics.phase('Scan'):
+            raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        handler({}, context(arn=''))
+
+    [document] = emf_lines(capsys.readouterr().out)
+    assert document['AccountId'] == 'unknown'
+    assert document['FleetSize'] == '0'
+    assert document['ScanTime'] == 250.0
+    assert metrics._active is None
+
+
+def test_instrument_client_counts_calls_retries_and_throttles(fake_time, capsys):
+    ssm = metrics.instrument_client(boto3.client('ssm', region_name='ap-south-1'))
+
+    @metrics.instrumented
+    def handler(event, context):
+        # One call throttled twice before it succeeds, then one call that succeeds first time
+        ssm_response(ssm, 1, code='ThrottlingException', status=400)
+        ssm_response(ssm, 2, status=429)
+        ssm_response(ssm, 3)
+        ssm_response(ssm, 1)
+
+    handler({}, context())
+    ssm_response(ssm, 1)  # outside an invocation: not counted anywhere
+
+    [document] = emf_lines(capsys.readouterr().out)
+    assert document['ApiCalls'] == 2
+    assert document['Retries'] == 2
+    assert document['Throttles'] == 2
+    assert document['ssm.ApiCalls'] == 2
+    assert document['ssm.Retries'] == 2
+    assert document['ssm.Throttles'] == 2
+
+
+def test_shard_worker_reports_its_shard_as_fleet_size(capsys):
+    from bench import clock as virtual_time
+    from bench import fake_aws
+    from bench.__main__ import FakeContext, sqs_event
+    from bench.scenarios import SCENARIOS, SHARD_QUEUE, environment
+
+    scenario = SCENARIOS['patch-scan-sharded']
+    clock = virtual_time.VirtualClock(1700000000.0)
+    aws = fake_aws.FakeAWS(clock, latency=0.001)
+    env, event = scenario['setup'](aws, 2000)
+    with environment(env), virtual_time.install(clock), fake_aws.install(aws):
+        module = scenario['load']()
+        module.lambda_handler(event, FakeContext('bench-patch-scan-sharded', clock, scenario['timeout']))
+        message = aws.receive_messages(SHARD_QUEUE, 1800, 4)[0]
+        module.lambda_handler(sqs_event(message, scenario['queue']), FakeContext('bench-patch-scan-sharded', clock, 300))
+
+    coordinator, worker = emf_lines(capsys.readouterr().out)
+    assert coordinator['FleetSize'] == '<=10000'
+    assert worker['FleetSize'] == '<=1000'  # one 250-host shard
+    assert worker['ssm.ApiCalls'] > 0
@@ -0,0 +1,88 @@
+import importlib
+import logging
+import sys
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from patch_common import notifications
+from patch_common.notifications import build_email, dispatch_emails
+
+SENDER = 'patching@example.com'
+
+
+class StubSES:
+    def __init__(self, fail=None):
+        self.fail = fail or {}  # address -> exception raised for it
+        self.sent = []
+        self.quota_calls = 0
+
+    def get_send_quota(self):
+        self.quota_calls += 1
+        return {'MaxSendRate': 14.0}
+
+    def send_email(self, Source, Destination, Message):
+        address = Destination['ToAddresses'][0]
+        self.sent.append(address)
+        if address in self.fail:
+            raise self.fail[address]
+        return {'MessageId': f"stub-{len(self.sent)}"}
+
+
+@pytest.fixture(autouse=True)
+def no_cached_send_rate(monkeypatch):
+    monkeypatch.setattr(notifications, '_send_rate', {})
+
+
+def emails(count):
+    return [build_email([f"owner{n}@example.com"], 'Patch report', text='body') for n in range(count)]
+
+
+def test_no_emails_makes_no_calls():
+    ses = StubSES()
+    assert dispatch_emails(ses, SENDER, []) == {'Sent': 0, 'Failed': 0}
+    assert ses.quota_calls == 0
+
+
+def test_connection_errors_fail_only_their_message(caplog):
+    ses = StubSES(fail={'owner1@example.com': EndpointConnectionError(endpoint_url='https://email.ap-south-1.amazonaws.com')})
+    with caplog.at_level(logging.ERROR):
+        stats = dispatch_emails(ses, SENDER, emails(3), send_rate=100, logger=logging.getLogger('ses-test'))
+    assert stats == {'Sent': 2, 'Failed': 1}
+    assert len(caplog.messages) == 1 and 'owner1@example.com' in caplog.messages[0]
+
+
+def test_throttling_is_left_to_the_client_retries():
+    # The client (CLIENT_CONFIG) already retried; dispatch must not multiply its attempts
+    throttled = ClientError({'Error': {'Code': 'Throttling', 'Message': 'Maximum sending rate exceeded.'}}, 'SendEmail')
+    ses = StubSES(fail={'owner0@example.com': throttled})
+    stats = dispatch_emails(ses, SENDER, emails(2), send_rate=100)
+    assert stats == {'Sent': 1, 'Failed': 1}
+    assert sorted(ses.sent) == ['owner0@example.com', 'owner1@example.com']
+
+
+def test_dispatch_runs_at_the_ses_send_rate():
+    from bench import clock as virtual_time
+    from bench import fake_aws
+
+    latency = 0.2  # seconds per SendEmail: one at a time, at most 5 emails/s
+    count = 280
+    clock = virtual_time.VirtualClock()
+    aws = fake_aws.FakeAWS(clock, latency=latency, seed=1)
+    with virtual_time.install(clock), fake_aws.install(aws):
+        # Imported under the virtual clock, so the token bucket and the thread pool run on it
+        for name in [m for m in sys.modules if m == 'patch_common' or m.startswith('patch_common.')]:
+            del sys.modules[name]
+        virtual = importlib.import_module('patch_common.notifications')
+        ses = importlib.import_module('patch_common.aws_clients').get_client('ses')
+        started = clock.now
+        stats = virtual.dispatch_emails(ses, SENDER, emails(count))
+        elapsed = clock.now - started
+
+    rate = fake_aws.SES_MAX_SEND_RATE
+    assert stats == {'Sent': count, 'Failed': 0}
+    assert aws.emails == count
+    # Paced at MaxSendRate: close to count/rate, well under the serial count*latency.
+    # Throttles that slip through are retried by the client.
+    assert count / rate * 0.9 <= elapsed <= count / rate * 1.35
+    assert elapsed < count * latency / 2
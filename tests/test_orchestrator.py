@@ -0,0 +1,64 @@
+import logging
+
+from bench import clock as virtual_time
+from bench import fake_aws
+from bench.__main__ import FakeContext
+from bench.scenarios import BUCKET, REMOTE_ACCOUNTS, SCENARIOS, environment
+
+FAILING_ACCOUNT = '999999999999'  # no fleet in the fakes, so AssumeRole is denied
+# Latency of every call into each remote account, so each target takes a different time
+LATENCIES = dict(zip(REMOTE_ACCOUNTS, (0.05, 2.0, 5.0, 10.0)))
+
+
+def run(entries, size=400, **options):
+    # One orchestrator invocation over TARGETS `entries`; returns (response, fakes, virtual seconds)
+    scenario = SCENARIOS['combined-email-orchestrator']
+    clock = virtual_time.VirtualClock()
+    aws = fake_aws.FakeAWS(clock, **options)
+    env, event = scenario['setup'](aws, size)
+    env['TARGETS'] = ",".join(entries)
+    with environment(env), virtual_time.install(clock), fake_aws.install(aws):
+        module = scenario['load']()
+        started = clock.now
+        response = module.lambda_handler(event, FakeContext('bench-combined-email', clock, scenario['timeout']))
+    return response, aws, clock.now - started
+
+
+def test_failing_account_does_not_stop_the_others(caplog):
+    accounts = (REMOTE_ACCOUNTS[0], FAILING_ACCOUNT) + REMOTE_ACCOUNTS[1:]
+    entries = [f"{account_id}:ap-south-1" for account_id in accounts] + ['333333333333', 'not-an-account:eu-west-1']
+
+    with caplog.at_level(logging.INFO):
+        response, aws, _ = run(entries, latency=0.01)
+
+    assert response['statusCode'] == 200
+    failed = [message for message in caplog.messages if 'targets failed' in message]
+    assert failed == [
+        f"3 of {len(entries)} targets failed: ['{FAILING_ACCOUNT} ({FAILING_ACCOUNT}) ap-south-1', "
+        "'333333333333 (333333333333)', 'not-an-account:eu-west-1 (not-an-account:eu-west-1)']"
+    ]
+    # Every healthy account was still scanned, stored and reported
+    keys = list(aws.buckets[BUCKET])
+    for account_id in REMOTE_ACCOUNTS:
+        assert any(f"/account={account_id}/region=ap-south-1/" in key for key in keys)
+        assert aws.fleet(account_id).commands
+    assert not any(f"account={FAILING_ACCOUNT}" in key for key in keys)
+    owners = {
+        tag['Value'] for account_id in REMOTE_ACCOUNTS for instance in aws.fleet(account_id).instances
+        for tag in instance['Tags'] if tag['Key'] == fake_aws.EMAIL_TAG
+    }
+    assert aws.emails == len(owners)
+
+
+def test_runtime_follows_the_slowest_account():
+    alone = {
+        account_id: run([f"{account_id}:ap-south-1"], account_latency=LATENCIES)[2] for account_id in REMOTE_ACCOUNTS
+    }
+    response, _, together = run([f"{account_id}:ap-south-1" for account_id in REMOTE_ACCOUNTS], account_latency=LATENCIES)
+
+    assert response['statusCode'] == 200
+    slowest = max(alone.values())
+    assert alone[REMOTE_ACCOUNTS[-1]] == slowest
+    # Targets are scanned concurrently: about the slowest one alone, well under all of them one after another
+    assert slowest * 0.9 <= together <= slowest * 1.2
+    assert together < sum(alone.values()) / 2
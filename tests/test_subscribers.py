@@ -0,0 +1,91 @@
+import math
+
+import pytest
+
+from patch_common import subscribers
+from patch_common.subscribers import BATCH_GET_LIMIT, BATCH_WRITE_LIMIT, ensure_subscribed
+
+TABLE = 'patch-scan-subscribers'
+
+
+class StubDynamoDB:
+    def __init__(self, unprocessed_once=False):
+        self.items = set()
+        self.calls = 0
+        self.unprocessed_once = unprocessed_once
+
+    def batch_get_item(self, RequestItems):
+        self.calls += 1
+        keys = RequestItems[TABLE]['Keys']
+        assert len(keys) <= BATCH_GET_LIMIT
+        if self.unprocessed_once:
+            # First page comes back entirely unprocessed, as under throttling
+            self.unprocessed_once = False
+            return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+        found = [{'Email': key['Email']} for key in keys if key['Email']['S'] in self.items]
+        return {'Responses': {TABLE: found}, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        requests = RequestItems[TABLE]
+        assert len(requests) <= BATCH_WRITE_LIMIT
+        self.items.update(request['PutRequest']['Item']['Email']['S'] for request in requests)
+        return {'UnprocessedItems': {}}
+
+
+@pytest.fixture(autouse=True)
+def cold_container(monkeypatch):
+    monkeypatch.setattr(subscribers, '_cache', {})
+
+
+def fleet_emails(instances=5000, owners=300):
+    # One address per instance, as read from the PatchScanEmailAlert tags
+    return [f"owner{n % owners}@example.com" for n in range(instances)]
+
+
+def test_round_trips_for_5000_instances_and_300_owners():
+    ddb = StubDynamoDB()
+    emails = fleet_emails()
+
+    stats = {}
+    assert len(ensure_subscribed(ddb, TABLE, emails, stats)) == 300
+    # First run: every owner looked up and written once, in batches
+    assert stats['ApiCalls'] == ddb.calls == math.ceil(300 / BATCH_GET_LIMIT) + math.ceil(300 / BATCH_WRITE_LIMIT)
+
+    # Next cold start, everyone already subscribed: lookups only
+    subscribers._cache.clear()
+    stats = {}
+    assert ensure_subscribed(ddb, TABLE, emails, stats) == set()
+    assert stats['ApiCalls'] == math.ceil(300 / BATCH_GET_LIMIT) < 10
+
+    # Warm container within CACHE_TTL: no DynamoDB call at all
+    stats = {}
+    assert ensure_subscribed(ddb, TABLE, emails, stats) == set()
+    assert stats == {}
+
+
+def test_cache_expires_after_ttl():
+    ddb = StubDynamoDB()
+    now = [0.0]
+    ensure_subscribed(ddb, TABLE, fleet_emails(100, 10), clock=lambda: now[0])
+    calls = ddb.calls
+    now[0] = subscribers.CACHE_TTL + 1
+    ensure_subscribed(ddb, TABLE, fleet_emails(100, 10), clock=lambda: now[0])
+    assert ddb.calls == calls + 1
+
+
+def test_unprocessed_keys_are_retried():
+    ddb = StubDynamoDB(unprocessed_once=True)
+    stats = {}
+    new = ensure_subscribed(ddb, TABLE, fleet_emails(50, 5), stats, sleep=lambda seconds: None)
+    assert len(new) == 5
+    assert stats['ApiCalls'] == 3  # get, get again for the unprocessed keys, one write
+
+
+def test_scan_handler_round_trips_at_5000_instances():
+    from bench.__main__ import run_scenario
+
+    result = run_scenario('patch-scan-emailer', 5000, trace_memory=False)
+    owners = 5000 // 25  # the bench fleet tags 25 instances per owner
+    assert result['Status'] == 'ok'
+    assert result['CallsByService']['dynamodb'] == math.ceil(owners / BATCH_GET_LIMIT) + math.ceil(owners / BATCH_WRITE_LIMIT)
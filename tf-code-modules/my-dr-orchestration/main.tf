@@ -23,6 +23,7 @@ module "rds_failover_automation_orchestrator" {
   target_group_ui_arn       = var.alb_target_group_ui_arn
   target_group_tomcat_arn   = var.alb_target_group_tomcat_arn
   target_group_tokengen_arn = var.alb_target_group_tokengen_arn
+  target_mapping            = var.alb_target_mapping
 
   new_ec2_instance_ids      = var.new_dr_ec2_instance_ids
   old_ec2_instance_ids      = var.old_dc_ec2_instance_ids
@@ -31,6 +32,7 @@ module "rds_failover_automation_orchestrator" {
   target_security_group_id  = var.rds_security_group_id
   dr_instance_1_cidr_ip     = var.dr_app_instance_1_cidr_ip
   dr_instance_2_cidr_ip     = var.dr_app_instance_2_cidr_ip
+  timeline_bucket           = var.failover_timeline_bucket
 
   # You can also override default names from the child module if needed
   # ssm_automation_role_name   = "CustomSSMAutomationRole-${var.environment_tag}"
@@ -61,15 +61,23 @@ resource "aws_iam_role_policy" "lambda_register_targets_policy" {
   role = aws_iam_role.lambda_execution_role.id
   policy = jsonencode({
     Version   = "2012-10-17",
-    Statement = [
+    Statement = concat([
       {
         Effect   = "Allow",
         Action   = [
           "elasticloadbalancing:RegisterTargets",
-          "elasticloadbalancing:DeregisterTargets"
+          "elasticloadbalancing:DeregisterTargets",
+          "elasticloadbalancing:DescribeTargetHealth"
         ],
         Resource = "*" # Consider scoping this to specific target group ARNs
       },
+      {
+        Effect   = "Allow",
+        Action   = [
+          "ssm:GetAutomationExecution"
+        ],
+        Resource = "*" # Reads the failover execution's step times for the timeline
+      },
       {
         Effect   = "Allow",
         Action   = [
@@ -79,6 +87,14 @@ resource "aws_iam_role_policy" "lambda_register_targets_policy" {
         ],
         Resource = "arn:aws:logs:*:*:*" # Standard Lambda logging permissions
       }
-    ]
+    ], var.timeline_bucket == "" ? [] : [
+      {
+        Effect   = "Allow",
+        Action   = [
+          "s3:PutObject"
+        ],
+        Resource = "arn:aws:s3:::${var.timeline_bucket}/failover-timelines/*"
+      }
+    ])
   })
 }
\ No newline at end of file
@@ -1,86 +1,199 @@
 # tf-rds-failover-automation/lambda_code/register_targets.py
 
 import os
-import boto3
+import json
+import time
+import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from patch_common import metrics
+from patch_common.aws_clients import MAX_POOL_CONNECTIONS, get_client as client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+HEALTH_TIMEOUT = int(os.environ.get('HEALTH_TIMEOUT', '240'))  # seconds to wait for new targets to turn healthy
+HEALTH_POLL_INTERVAL = 5  # seconds
+TIMELINE_BUCKET = os.environ.get('TIMELINE_BUCKET', '')  # failover timelines go to S3 when set, to the log otherwise
+TIMELINE_PREFIX = 'failover-timelines'
+PREREQUISITE_STEP = 'WaitForRDSAvailable'  # cut-over only proceeds once this Automation step succeeded
+
+def legacy_mapping(new_instances, old_instances):
+    # Same targets the original hard-coded handler used: UI and Tokengen get the first instance, Tomcat the first two
+    groups = [
+        (os.environ.get('TG_UI_ARN'), 8089, 1),
+        (os.environ.get('TG_TOMCAT_ARN'), 8089, 2),
+        (os.environ.get('TG_TOKENGEN_ARN'), 2405, 1)
+    ]
+    return [
+        {'TargetGroupArn': arn, 'Port': port, 'New': new_instances[:count], 'Old': old_instances[:count]}
+        for arn, port, count in groups if arn
+    ]
+
+def load_mapping():
+    """Returns [{'TargetGroupArn', 'Port', 'New': [instance ids], 'Old': [instance ids]}].
+
+    TARGET_MAPPING (JSON) is the declarative form; without it the mapping is
+    built from TG_UI_ARN/TG_TOMCAT_ARN/TG_TOKENGEN_ARN and the comma-separated
+    NEW_INSTANCES_IDS/OLD_INSTANCES_IDS.
+    """
+    if os.environ.get('TARGET_MAPPING'):
+        return json.loads(os.environ['TARGET_MAPPING'])
+    new_instances = [i.strip() for i in os.environ.get('NEW_INSTANCES_IDS', "").split(',') if i.strip()]
+    old_instances = [i.strip() for i in os.environ.get('OLD_INSTANCES_IDS', "").split(',') if i.strip()]
+    if not new_instances:
+        return []
+    return legacy_mapping(new_instances, old_instances)
+
+def targets(instance_ids, port):
+    return [{'Id': iid, 'Port': port} for iid in instance_ids]
+
+def old_only(group):
+    # Never deregister an instance that is also one of the group's new targets
+    return [iid for iid in group.get('Old', []) if iid not in group['New']]
+
+def register_group(elbv2, group):
+    logger.info(f"Registering {group['New']}:{group['Port']} to {group['TargetGroupArn']}")
+    elbv2.register_targets(TargetGroupArn=group['TargetGroupArn'], Targets=targets(group['New'], group['Port']))
+
+def unhealthy_targets(elbv2, group):
+    response = elbv2.describe_target_health(
+        TargetGroupArn=group['TargetGroupArn'],
+        Targets=targets(group['New'], group['Port'])
+    )
+    return [
+        description['Target']['Id'] for description in response['TargetHealthDescriptions']
+        if description['TargetHealth']['State'] != 'healthy'
+    ]
+
+def deregister_group(elbv2, group):
+    old = old_only(group)
+    if old:
+        logger.info(f"Deregistering {old}:{group['Port']} from {group['TargetGroupArn']}")
+        elbv2.deregister_targets(TargetGroupArn=group['TargetGroupArn'], Targets=targets(old, group['Port']))
+    return old
+
+def wait_and_cut_over(elbv2, groups, executor, timeout=HEALTH_TIMEOUT):
+    """Poll all groups each tick; a group's old targets are deregistered as soon as its new targets are healthy.
+
+    Deregistration (and so connection draining) overlaps across groups.
+    Returns ({arn: deregistered ids}, {arn: still unhealthy ids}).
+    """
+    waiting = {group['TargetGroupArn']: group for group in groups}
+    deregistered = {}
+    unhealthy = {}
+    deadline = time.time() + timeout
+    while waiting:
+        arns = list(waiting)
+        for arn, pending in zip(arns, executor.map(lambda arn: unhealthy_targets(elbv2, waiting[arn]), arns)):
+            unhealthy[arn] = pending
+        healthy = [waiting.pop(arn) for arn in arns if not unhealthy[arn]]
+        for group, old in zip(healthy, executor.map(lambda group: deregister_group(elbv2, group), healthy)):
+            deregistered[group['TargetGroupArn']] = old
+            del unhealthy[group['TargetGroupArn']]
+        if not waiting or time.time() >= deadline:
+            break
+        time.sleep(HEALTH_POLL_INTERVAL)
+    return deregistered, unhealthy
+
+def iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+def automation_steps(execution_id):
+    # Start/end of every failover Automation step, as recorded by SSM itself
+    execution = client('ssm').get_automation_execution(AutomationExecutionId=execution_id)['AutomationExecution']
+    return [
+        {
+            'Step': step['StepName'],
+            'Status': step['StepStatus'],
+            'Start': step['ExecutionStartTime'].isoformat() if step.get('ExecutionStartTime') else None,
+            'End': step['ExecutionEndTime'].isoformat() if step.get('ExecutionEndTime') else None
+        }
+        for step in execution.get('StepExecutions', [])
+    ]
+
+def save_timeline(execution_id, steps, phases, status):
+    """Write the failover timeline (Automation steps + this Lambda's phases) and the measured RTO."""
+    starts = [datetime.datetime.fromisoformat(step['Start']).timestamp() for step in steps if step['Start']]
+    first = min(starts) if starts else phases[0]['Start']
+    timeline = {
+        'AutomationExecutionId': execution_id,
+        'Status': status,
+        'Steps': steps,
+        'RegisterTargetsPhases': [
+            {'Phase': phase['Phase'], 'Start': iso(phase['Start']), 'End': iso(phase['End']),
+             'Seconds': round(phase['End'] - phase['Start'], 1)}
+            for phase in phases
+        ],
+        'RTOSeconds': round(phases[-1]['End'] - first, 1)
+    }
+    if TIMELINE_BUCKET:
+        key = f"{TIMELINE_PREFIX}/{execution_id}.json"
+        client('s3').put_object(Bucket=TIMELINE_BUCKET, Key=key, Body=json.dumps(timeline, indent=2))
+        logger.info(f"Failover timeline written to s3://{TIMELINE_BUCKET}/{key}, RTO {timeline['RTOSeconds']}s")
+    else:
+        logger.info(f"Failover timeline: {json.dumps(timeline)}")
+    return timeline
+
+@metrics.instrumented
 def handler(event, context):
-    elbv2 = boto3.client('elbv2')
+    elbv2 = client('elbv2')
 
-    tg_ui_arn = os.environ.get('TG_UI_ARN')
-    tg_tomcat_arn = os.environ.get('TG_TOMCAT_ARN')
-    tg_tokengen_arn = os.environ.get('TG_TOKENGEN_ARN')
-    new_instances_str = os.environ.get('NEW_INSTANCES_IDS', "")
-    old_instances_str = os.environ.get('OLD_INSTANCES_IDS', "")
+    # 'register' only adds the new targets (run asynchronously while RDS fails over); 'cutover' completes the switch
+    phase = event.get('Phase', 'cutover')
+    execution_id = event.get('AutomationExecutionId')
 
-    if not all([tg_ui_arn, tg_tomcat_arn, tg_tokengen_arn, new_instances_str, old_instances_str]):
-        logger.error("Missing one or more environment variables: TG_UI_ARN, TG_TOMCAT_ARN, TG_TOKENGEN_ARN, NEW_INSTANCES_IDS, OLD_INSTANCES_IDS")
+    groups = [group for group in load_mapping() if group.get('New')]
+    metrics.set_fleet_size(len({iid for group in groups for iid in group['New'] + group.get('Old', [])}))
+    if not groups:
+        logger.error("No target mapping: set TARGET_MAPPING, or TG_UI_ARN/TG_TOMCAT_ARN/TG_TOKENGEN_ARN with NEW_INSTANCES_IDS/OLD_INSTANCES_IDS")
         return {"status": "error", "message": "Missing environment variables"}
 
-    new_instances = [i.strip() for i in new_instances_str.split(',') if i.strip()]
-    old_instances = [i.strip() for i in old_instances_str.split(',') if i.strip()]
-
     actions = []
-
+    phases = []
+    steps = []
     try:
-        # --- Register New Targets ---
-        # Assuming specific instance mappings and ports as per original CFN
-        # UI TG: First new instance, port 8089
-        if len(new_instances) >= 1:
-            logger.info(f"Registering {new_instances[0]}:8089 to UI TG: {tg_ui_arn}")
-            elbv2.register_targets(TargetGroupArn=tg_ui_arn, Targets=[{'Id': new_instances[0], 'Port': 8089}])
-            actions.append(f"Registered {new_instances[0]} to UI TG")
-
-        # Tomcat TG: First and second new instances, port 8089
-        if len(new_instances) >= 2:
-            tomcat_targets = [{'Id': new_instances[0], 'Port': 8089}, {'Id': new_instances[1], 'Port': 8089}]
-            logger.info(f"Registering {tomcat_targets} to Tomcat TG: {tg_tomcat_arn}")
-            elbv2.register_targets(TargetGroupArn=tg_tomcat_arn, Targets=tomcat_targets)
-            actions.append(f"Registered {new_instances[0]},{new_instances[1]} to Tomcat TG")
-        elif len(new_instances) == 1: # Handle case if only one new instance provided for Tomcat
-            tomcat_targets = [{'Id': new_instances[0], 'Port': 8089}]
-            logger.info(f"Registering {tomcat_targets} to Tomcat TG: {tg_tomcat_arn} (only one instance available)")
-            elbv2.register_targets(TargetGroupArn=tg_tomcat_arn, Targets=tomcat_targets)
-            actions.append(f"Registered {new_instances[0]} to Tomcat TG")
-
-
-        # Tokengen TG: First new instance, port 2405
-        if len(new_instances) >= 1:
-            logger.info(f"Registering {new_instances[0]}:2405 to Tokengen TG: {tg_tokengen_arn}")
-            elbv2.register_targets(TargetGroupArn=tg_tokengen_arn, Targets=[{'Id': new_instances[0], 'Port': 2405}])
-            actions.append(f"Registered {new_instances[0]} to Tokengen TG")
-
-        # --- Deregister Old Targets ---
-        # UI TG: First old instance, port 8089
-        if len(old_instances) >= 1:
-            logger.info(f"Deregistering {old_instances[0]}:8089 from UI TG: {tg_ui_arn}")
-            elbv2.deregister_targets(TargetGroupArn=tg_ui_arn, Targets=[{'Id': old_instances[0], 'Port': 8089}])
-            actions.append(f"Deregistered {old_instances[0]} from UI TG")
-
-        # Tomcat TG: First and second old instances, port 8089
-        if len(old_instances) >= 2:
-            tomcat_targets_old = [{'Id': old_instances[0], 'Port': 8089}, {'Id': old_instances[1], 'Port': 8089}]
-            logger.info(f"Deregistering {tomcat_targets_old} from Tomcat TG: {tg_tomcat_arn}")
-            elbv2.deregister_targets(TargetGroupArn=tg_tomcat_arn, Targets=tomcat_targets_old)
-            actions.append(f"Deregistered {old_instances[0]},{old_instances[1]} from Tomcat TG")
-        elif len(old_instances) == 1: # Handle case if only one old instance provided for Tomcat
-            tomcat_targets_old = [{'Id': old_instances[0], 'Port': 8089}]
-            logger.info(f"Deregistering {tomcat_targets_old} from Tomcat TG: {tg_tomcat_arn} (only one instance available)")
-            elbv2.deregister_targets(TargetGroupArn=tg_tomcat_arn, Targets=tomcat_targets_old)
-            actions.append(f"Deregistered {old_instances[0]} from Tomcat TG")
-
-        # Tokengen TG: First old instance, port 2405
-        if len(old_instances) >= 1:
-            logger.info(f"Deregistering {old_instances[0]}:2405 from Tokengen TG: {tg_tokengen_arn}")
-            elbv2.deregister_targets(TargetGroupArn=tg_tokengen_arn, Targets=[{'Id': old_instances[0], 'Port': 2405}])
-            actions.append(f"Deregistered {old_instances[0]} from Tokengen TG")
+        if phase == 'cutover' and execution_id:
+            with metrics.phase('AutomationSteps'):
+                steps = automation_steps(execution_id)
+            prerequisite = next((step for step in steps if step['Step'] == PREREQUISITE_STEP), None)
+            if prerequisite and prerequisite['Status'] != 'Success':
+                logger.error(f"{PREREQUISITE_STEP} is {prerequisite['Status']}, not cutting over")
+                return {"status": "error", "message": f"{PREREQUISITE_STEP} is {prerequisite['Status']}"}
+
+        with ThreadPoolExecutor(max_workers=min(len(groups), MAX_POOL_CONNECTIONS)) as executor:
+            started = time.time()
+            # Registering again is a no-op for targets pre-registered in the 'register' phase
+            with metrics.phase('RegisterTargets'):
+                list(executor.map(lambda group: register_group(elbv2, group), groups))
+            actions.extend(f"Registered {group['New']} to {group['TargetGroupArn']}" for group in groups)
+            phases.append({'Phase': 'RegisterTargets', 'Start': started, 'End': time.time()})
+            if phase == 'register':
+                logger.info(f"Pre-registered new targets in {phases[0]['End'] - started:.1f}s: {actions}")
+                return {"status": "targets registered", "actions": actions}
+
+            started = time.time()
+            with metrics.phase('HealthGateAndDeregister'):
+                deregistered, unhealthy = wait_and_cut_over(elbv2, groups, executor)
+            phases.append({'Phase': 'HealthGateAndDeregister', 'Start': started, 'End': time.time()})
+        actions.extend(f"Deregistered {old} from {arn}" for arn, old in deregistered.items() if old)
+
+        status = "partial" if unhealthy else "targets updated"
+        with metrics.phase('SaveTimeline'):
+            timeline = save_timeline(execution_id, steps, phases, status) if execution_id else None
+        result = {"status": status, "actions": actions}
+        if timeline:
+            result["rtoSeconds"] = timeline['RTOSeconds']
+        if unhealthy:
+            # Old targets stay registered so the group never runs without a healthy target
+            logger.error(f"New targets not healthy after {HEALTH_TIMEOUT}s, old targets kept: {unhealthy}")
+            result["unhealthy"] = unhealthy
+            return result
 
         logger.info(f"Actions completed: {actions}")
-        return {"status": "targets updated", "actions": actions}
+        return result
 
     except Exception as e:
         logger.error(f"Error processing targets: {str(e)}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e), "actions": actions}
@@ -1,9 +1,34 @@
 # tf-rds-failover-automation/lambda.tf
 
+locals {
+  patch_common_dir = "../../../../cloudformation-templates/patching/patch_common"
+}
+
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_dir  = "${path.module}/lambda_code/"
-  output_path = "${path.module}/lambda_code/register_targets.zip"
+  output_path = "${path.module}/lambda-code/register_targets.zip"
+
+  source {
+    content  = file("${path.module}/lambda-code/register_targets.py")
+    filename = "register_targets.py"
+  }
+
+  # EMF instrumentation and client factory shared with the patching Lambdas (standard library and the
+  # runtime's boto3 only, so no layer is needed)
+  source {
+    content  = file("${path.module}/${local.patch_common_dir}/__init__.py")
+    filename = "patch_common/__init__.py"
+  }
+
+  source {
+    content  = file("${path.module}/${local.patch_common_dir}/metrics.py")
+    filename = "patch_common/metrics.py"
+  }
+
+  source {
+    content  = file("${path.module}/${local.patch_common_dir}/aws_clients.py")
+    filename = "patch_common/aws_clients.py"
+  }
 }
 
 resource "aws_lambda_function" "register_targets_lambda" {
@@ -11,7 +36,7 @@ resource "aws_lambda_function" "register_targets_lambda" {
   handler          = "register_targets.handler" # Corresponds to filename.handler_function
   runtime          = "python3.12"
   role             = aws_iam_role.lambda_execution_role.arn
-  timeout          = 60
+  timeout          = var.lambda_timeout
   filename         = data.archive_file.lambda_zip.output_path
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
 
@@ -22,6 +47,16 @@ resource "aws_lambda_function" "register_targets_lambda" {
       TG_TOKENGEN_ARN   = var.target_group_tokengen_arn
       NEW_INSTANCES_IDS = var.new_ec2_instance_ids
       OLD_INSTANCES_IDS = var.old_ec2_instance_ids
+      HEALTH_TIMEOUT    = tostring(var.health_timeout_seconds)
+      TIMELINE_BUCKET   = var.timeline_bucket
+      TARGET_MAPPING = length(var.target_mapping) > 0 ? jsonencode([
+        for group in var.target_mapping : {
+          TargetGroupArn = group.target_group_arn
+          Port           = group.port
+          New            = group.new_instance_ids
+          Old            = group.old_instance_ids
+        }
+      ]) : ""
     }
   }
   tags = var.tags
@@ -39,7 +39,9 @@ mainSteps:
       DBInstanceIdentifier: '{{ DBInstanceIdentifier }}'
       ForceFailover: true
 
-  - name: AddIngressForDR1
+  # Both DR CIDRs in one AuthorizeSecurityGroupIngress call; RebootDBInstance has already returned, so this
+  # and the target pre-registration below run while RDS is still failing over
+  - name: AddIngressForDR
     action: aws:executeAwsApi
     inputs:
       Service: ec2
@@ -52,21 +54,20 @@ mainSteps:
           IpRanges:
             - CidrIp: '{{ DrInstance1CidrIp }}'
               Description: "Allow DB access from DR Instance 1 (Automated)"
-
-  - name: AddIngressForDR2
-    action: aws:executeAwsApi
-    inputs:
-      Service: ec2
-      Api: AuthorizeSecurityGroupIngress
-      GroupId: '{{ TargetSecurityGroupId }}'
-      IpPermissions:
-        - IpProtocol: tcp
-          FromPort: 3306
-          ToPort: 3306
-          IpRanges:
             - CidrIp: '{{ DrInstance2CidrIp }}'
               Description: "Allow DB access from DR Instance 2 (Automated)"
 
+  - name: PreRegisterTargets
+    action: aws:invokeLambdaFunction
+    inputs:
+      FunctionName: '{{ LambdaFunctionName }}'
+      InvocationType: Event
+      Payload: >-
+        {
+          "Phase": "register",
+          "AutomationExecutionId": "{{ automation:EXECUTION_ID }}"
+        }
+
   - name: WaitForRDSAvailable
     action: aws:waitForAwsResourceProperty
     timeoutSeconds: 1800 # 30 minutes, adjust as needed
@@ -78,6 +79,7 @@ mainSteps:
       DesiredValues:
         - available
 
+  # Health-gated cut-over; also writes the failover timeline (every step's start/end and the RTO)
   - name: InvokeRegisterLambda
     action: aws:invokeLambdaFunction
     inputs:
@@ -85,7 +87,9 @@ mainSteps:
       Payload: >-
         {
           "DBInstanceIdentifier": "{{ DBInstanceIdentifier }}",
-          "InvokedBy": "SSMAutomationDocument"
+          "InvokedBy": "SSMAutomationDocument",
+          "Phase": "cutover",
+          "AutomationExecutionId": "{{ automation:EXECUTION_ID }}"
         }
 YAML
 }
\ No newline at end of file
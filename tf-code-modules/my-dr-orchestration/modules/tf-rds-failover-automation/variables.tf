@@ -36,6 +36,35 @@ variable "old_ec2_instance_ids" {
   default     = "i-06956b6ce7039d983,i-0a08e5fcab036c1e5"
 }
 
+variable "target_mapping" {
+  type = list(object({
+    target_group_arn = string
+    port             = number
+    new_instance_ids = list(string)
+    old_instance_ids = list(string)
+  }))
+  description = "Declarative cut-over mapping: target group -> new/old instances -> port. When empty, the UI/Tomcat/Tokengen variables above are used."
+  default     = []
+}
+
+variable "health_timeout_seconds" {
+  type        = number
+  description = "How long register_targets waits for new targets to turn healthy before it keeps the old targets registered."
+  default     = 240
+}
+
+variable "timeline_bucket" {
+  type        = string
+  description = "S3 bucket for failover timelines (failover-timelines/<execution id>.json). When empty the timeline is only logged to CloudWatch Logs."
+  default     = ""
+}
+
+variable "lambda_timeout" {
+  type        = number
+  description = "Timeout of the register_targets Lambda; must exceed health_timeout_seconds."
+  default     = 300
+}
+
 variable "ssm_automation_role_name" {
   type        = string
   description = "Name for the SSM Automation IAM Role"
@@ -47,6 +47,17 @@ variable "alb_target_group_tokengen_arn" {
   default = "arn:aws:elasticloadbalancing:ap-south-1:123456789012:targetgroup/My-Tokengen-TG/fedcba0987654321"
 }
 
+variable "alb_target_mapping" {
+  type = list(object({
+    target_group_arn = string
+    port             = number
+    new_instance_ids = list(string)
+    old_instance_ids = list(string)
+  }))
+  description = "Target group -> new/old instances -> port for the cut-over. Leave empty to use the UI/Tomcat/Tokengen ARNs with the instance id lists."
+  default     = []
+}
+
 variable "new_dr_ec2_instance_ids" {
   type        = string
   description = "Comma-separated list of new EC2 instance IDs in the DR site."
@@ -78,4 +89,10 @@ variable "dr_app_instance_2_cidr_ip" {
   description = "CIDR IP for the second DR application instance to allow DB access (e.g., 10.0.2.20/32)."
   # Example IP - replace with your actual IP
   default = "172.31.6.20/32"
+}
+
+variable "failover_timeline_bucket" {
+  type        = string
+  description = "S3 bucket that receives a timeline (per-step start/end and RTO) for every failover run. Leave empty to only log it."
+  default     = ""
 }
\ No newline at end of file